@@ -0,0 +1,91 @@
+# config/connection.py
+
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from config.settings import DB_CONFIG, DB_POOL, DB_SESSION
+
+APP_NAME = 'AmazonBI'
+
+_pool = None
+_slots = None
+_lock = threading.Lock()
+
+
+def get_pool():
+    """The process-wide pool, created on first use."""
+    global _pool, _slots
+    with _lock:
+        if _pool is None:
+            # DB_SESSION goes into the startup packet, so it costs nothing per borrow
+            options = ' '.join(f"-c {name}={value}" for name, value in DB_SESSION.items())
+            _pool = ThreadedConnectionPool(
+                DB_POOL['minconn'], DB_POOL['maxconn'],
+                options=options, **DB_CONFIG
+            )
+            _slots = threading.BoundedSemaphore(DB_POOL['maxconn'])
+    return _pool
+
+
+def get_connection(stage, bulk=False):
+    """
+    Borrow a connection for `stage`, waiting while all of them are in use.
+    The session is tagged with application_name 'AmazonBI:<stage>'; bulk
+    stages also get synchronous_commit=off. Give it back with
+    release_connection().
+    """
+    pool = get_pool()
+    _slots.acquire()
+    try:
+        conn = pool.getconn()
+    except Exception:
+        _slots.release()
+        raise
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT set_config('application_name', %s, false), "
+            "       set_config('synchronous_commit', %s, false);",
+            (f"{APP_NAME}:{stage}", 'off' if bulk else 'on')
+        )
+        cur.close()
+        conn.commit()
+    except Exception:
+        release_connection(conn)
+        raise
+    return conn
+
+
+def release_connection(conn):
+    """Return a borrowed connection; anything left uncommitted is rolled back."""
+    broken = conn.closed
+    if not broken:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            broken = True
+    try:
+        get_pool().putconn(conn, close=bool(broken))
+    finally:
+        _slots.release()
+
+
+@contextmanager
+def connection(stage, bulk=False):
+    """`with connection('stage') as conn:` wrapper around get/release."""
+    conn = get_connection(stage, bulk)
+    try:
+        yield conn
+    finally:
+        release_connection(conn)
+
+
+def close_pool():
+    global _pool
+    with _lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
@@ -0,0 +1,89 @@
+# config/scheduler.py
+#
+# Dependency-graph stage runner shared by the source loader (models/) and
+# the ELT loaders (elt/); it only needs the standard library.
+
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class StagesFailed(Exception):
+    """
+    Raised by run_stages(keep_going=True) once everything that could run has
+    finished. Carries the errors by stage, the stages skipped because
+    something they depend on failed, and the timings of the ones that passed.
+    """
+    def __init__(self, errors, skipped, timings):
+        self.errors = errors
+        self.skipped = skipped
+        self.timings = timings
+        failed = ", ".join(f"{name}: {e}" for name, e in errors.items())
+        super().__init__(f"{len(errors)} stage(s) failed ({failed}); skipped: {sorted(skipped) or 'none'}")
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _dependents(names, deps):
+    """Every stage that depends on any of `names`, directly or not."""
+    found = set()
+    frontier = set(names)
+    while frontier:
+        frontier = {n for n, d in deps.items() if set(d) & frontier and n not in found}
+        found |= frontier
+    return found
+
+
+def run_stages(stages, deps, max_workers=4, keep_going=False):
+    """
+    Run a small dependency graph of stages on a thread pool.
+
+      stages : {name: zero-argument callable}
+      deps   : {name: names that must finish first}
+
+    Each stage starts as soon as all of its dependencies have finished.
+    Returns {name: wall-clock seconds}. If a stage raises, nothing new is
+    started, the stages already running are allowed to finish, and the first
+    error is re-raised. With keep_going, only the failed stage's dependents
+    are skipped, everything else still runs, and StagesFailed is raised at
+    the end.
+    """
+    pending = dict(stages)
+    running = {}
+    timings = {}
+    done = set()
+    errors = {}
+    skipped = set()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            if not errors or keep_going:
+                ready = [n for n in pending if set(deps.get(n, ())) <= done]
+                for name in ready:
+                    running[pool.submit(_timed, pending.pop(name))] = name
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                name = running.pop(fut)
+                try:
+                    timings[name] = fut.result()
+                    done.add(name)
+                except Exception as e:
+                    errors[name] = e
+                    if keep_going:
+                        for dependent in _dependents([name], deps) & set(pending):
+                            skipped.add(dependent)
+                            del pending[dependent]
+
+    if errors:
+        if keep_going:
+            raise StagesFailed(errors, skipped, timings)
+        raise next(iter(errors.values()))
+    if pending:
+        raise ValueError(f"Stages with unsatisfiable dependencies: {sorted(pending)}")
+    return timings
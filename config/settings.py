@@ -6,6 +6,32 @@ DB_CONFIG = {
     'port': '5432'
 }
 
+# Shared connection pool used by every ELT stage and the dashboard
+DB_POOL = {
+    'minconn': 1,
+    'maxconn': 8,
+}
+
+# Session settings applied once when a pooled connection is opened
+DB_SESSION = {
+    'work_mem': '64MB',
+}
+
+# Monthly range partitions (python -m elt.partitions enable): how many months
+# past the load date the loaders keep created, and how many months of history
+# `python -m elt.partitions retire` keeps attached
+PARTITIONS = {
+    'months_ahead': 2,
+    'keep_months': 24,
+}
+
+# star.dim_date calendar: first day generated, and how far past today the
+# star loaders keep it filled
+CALENDAR = {
+    'start': '2020-01-01',
+    'days_ahead': 366,
+}
+
 EXCHANGE_RATE_API = {
     'url': 'https://api.exchangerate.host/latest',
     'key': '9a11331ddcc59c7d805af3a7',
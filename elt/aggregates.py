@@ -0,0 +1,55 @@
+# elt/aggregates.py
+#
+# star.agg_pricing: fact_pricing rolled up to (date, category, product,
+# country, city). It keeps sums and counts rather than averages, so any
+# coarser rollup (by category, by country, over a date range) is just
+# SUM(..._sum) / SUM(..._count) over its rows.
+
+AGG_PRICING = 'star.agg_pricing'
+
+# (aggregate column, expression over the fact rows)
+MEASURES = (
+    ('fact_rows',                 "COUNT(*)"),
+    ('actual_price_sum',          "SUM(fp.actual_price)"),
+    ('actual_price_count',        "COUNT(fp.actual_price)"),
+    ('discount_percentage_sum',   "SUM(fp.discount_percentage)"),
+    ('discount_percentage_count', "COUNT(fp.discount_percentage)"),
+    ('rate_to_base_sum',          "SUM(fp.rate_to_base)"),
+    ('rate_to_base_count',        "COUNT(fp.rate_to_base)"),
+)
+
+
+def agg_pricing_insert(touched=None):
+    """
+    INSERT ... SELECT aggregating star.fact_pricing into star.agg_pricing;
+    with `touched`, only the (date_sk, product_sk) slices listed in that table.
+    """
+    scope = f"JOIN {touched} t ON t.date_sk = fp.date_sk AND t.product_sk = fp.product_sk" if touched else ""
+    return f"""
+        INSERT INTO {AGG_PRICING}
+          (date_sk, full_date, category_sk, product_sk, country, city,
+           {', '.join(name for name, _ in MEASURES)})
+        SELECT fp.date_sk, fp.full_date, fp.category_sk, fp.product_sk, dl.country, dl.city,
+               {', '.join(expr for _, expr in MEASURES)}
+          FROM star.fact_pricing fp
+          JOIN star.dim_location dl
+            ON dl.location_sk = fp.location_sk
+          {scope}
+         GROUP BY fp.date_sk, fp.full_date, fp.category_sk, fp.product_sk, dl.country, dl.city;
+    """
+
+
+def refresh_agg_pricing(cur, touched):
+    """
+    Recompute the star.agg_pricing rows of every (date_sk, product_sk) slice
+    in `touched` from the fact: a fact row updated in place may have moved to
+    another category, so its whole slice is rebuilt rather than adjusted.
+    Returns the number of aggregate rows written.
+    """
+    cur.execute(f"""
+        DELETE FROM {AGG_PRICING} a
+         USING {touched} t
+         WHERE a.date_sk = t.date_sk AND a.product_sk = t.product_sk;
+    """)
+    cur.execute(agg_pricing_insert(touched))
+    return cur.rowcount
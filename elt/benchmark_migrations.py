@@ -0,0 +1,173 @@
+# elt/benchmark_migrations.py
+
+import argparse
+import json
+
+from config.connection import get_connection, release_connection
+from elt.migrations import MIGRATIONS, REWRITES_DATA, migrate, pending
+
+# The read side of the loader queries that filter on the current row,
+# as run by full_load_warehouse, the incremental loaders and the star loads.
+QUERIES = {
+    'warehouse: review SK lookups': """
+        SELECT r.review_id, wp.products_sk, wu.users_sk
+          FROM public.reviews r
+          JOIN warehouse.products wp
+            ON r.product_id = wp.product_id
+           AND wp.end_date = '9999-12-31'
+          JOIN warehouse.users wu
+            ON r.user_id = wu.user_id
+           AND wu.end_date = '9999-12-31'
+    """,
+    'warehouse: location SK lookups': """
+        SELECT l.location_id, wp.products_sk
+          FROM public.locations l
+          JOIN warehouse.products wp
+            ON l.product_id = wp.product_id
+           AND wp.end_date = '9999-12-31'
+    """,
+    'warehouse: single product lookup': """
+        SELECT products_sk
+          FROM warehouse.products
+         WHERE product_id = (SELECT MAX(product_id) FROM public.products)
+           AND end_date = '9999-12-31'
+    """,
+    'warehouse: product key map': """
+        SELECT product_id, products_sk
+          FROM warehouse.products
+         WHERE end_date = '9999-12-31'
+    """,
+    'warehouse: reviews of 100 products': """
+        SELECT w.review_id
+          FROM warehouse.reviews w
+         WHERE w.end_date = '9999-12-31'
+           AND w.product_sk IN (
+                SELECT products_sk FROM warehouse.products
+                 WHERE product_id IN (SELECT product_id FROM public.products ORDER BY product_id LIMIT 100))
+    """,
+    'star: new dim_product rows': """
+        SELECT p.product_id, p.product_name
+          FROM warehouse.products p
+         WHERE p.end_date = '9999-12-31'
+           AND NOT EXISTS (
+                SELECT 1 FROM star.dim_product dp
+                 WHERE dp.product_id = p.product_id)
+    """,
+    'star: fact_pricing dimension joins': """
+        SELECT pr.product_id, wc.category_id, wl.location_id
+          FROM warehouse.products pr
+          JOIN warehouse.categories wc
+            ON pr.category_sk = wc.categories_sk
+           AND wc.end_date = '9999-12-31'
+          JOIN warehouse.locations wl
+            ON pr.products_sk = wl.product_sk
+           AND wl.end_date   = '9999-12-31'
+         WHERE pr.end_date = '9999-12-31'
+    """,
+}
+
+DEFAULT_MIGRATIONS = ('001_current_row_indexes',)
+
+WAREHOUSE = ('categories', 'users', 'products', 'reviews', 'locations', 'exchange_rates')
+
+
+def scans(plan):
+    """'Seq Scan products', 'Index Only Scan ux_products_current', ... for every scan node."""
+    found = []
+    if 'Scan' in plan['Node Type']:
+        found.append(f"{plan['Node Type']} {plan.get('Index Name') or plan.get('Relation Name', '')}".strip())
+    for child in plan.get('Plans', ()):
+        found.extend(scans(child))
+    return found
+
+
+def analyze(cur):
+    for table in WAREHOUSE:
+        cur.execute(f"ANALYZE warehouse.{table};")
+
+
+def measure(cur, sql, repeat):
+    """Best execution time in ms over `repeat` EXPLAIN ANALYZE runs, and the plan's scans."""
+    best, plan = None, None
+    for _ in range(repeat):
+        cur.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}")
+        result = cur.fetchone()[0]
+        result = result[0] if isinstance(result, list) else json.loads(result)[0]
+        if best is None or result['Execution Time'] < best:
+            best, plan = result['Execution Time'], result['Plan']
+    return best, scans(plan)
+
+
+def benchmark(migrations=DEFAULT_MIGRATIONS, repeat=3, keep=False):
+    """
+    ANALYZE and time QUERIES, apply the selected pending `migrations`, ANALYZE
+    and time them again, all in one transaction that is rolled back afterwards
+    (committed with `keep`), so the comparison leaves the schema as it was.
+    Only index migrations can be compared: one in REWRITES_DATA changes the
+    rows the queries read, so it is refused. `keep` is refused too when it
+    would record a migration ahead of an earlier one still pending.
+    """
+    unknown = set(migrations) - {m[0] for m in MIGRATIONS}
+    if unknown:
+        print(f"Unknown migration(s): {', '.join(sorted(unknown))}")
+        return
+    rewrites = sorted(set(migrations) & REWRITES_DATA)
+    if rewrites:
+        print(f"Refusing to benchmark {', '.join(rewrites)}: data migrations change the rows the queries "
+              f"read, so before and after would not be comparable. Apply with python -m elt.migrations.")
+        return
+
+    conn = get_connection('benchmark_migrations')
+    try:
+        cur = conn.cursor()
+        waiting = [m[0] for m in pending(cur)]
+        todo = [m for m in waiting if m in migrations]
+        if not todo:
+            print(f"{', '.join(migrations)}: already applied; nothing to compare against.")
+            conn.rollback()
+            return
+        skipped = [m for m in waiting[:waiting.index(todo[-1])] if m not in todo]
+        if keep and skipped:
+            print(f"Refusing --keep: {', '.join(todo)} would be recorded ahead of pending {', '.join(skipped)}.")
+            conn.rollback()
+            return
+
+        analyze(cur)
+        before = {name: measure(cur, sql, repeat) for name, sql in QUERIES.items()}
+        migrate(cur, only=todo)
+        analyze(cur)
+        after = {name: measure(cur, sql, repeat) for name, sql in QUERIES.items()}
+
+        print(f"Migrations: {', '.join(todo)} (best of {repeat})")
+        for name in QUERIES:
+            (t0, plan0), (t1, plan1) = before[name], after[name]
+            print(f"\n  {name:<36}{t0:>10.2f} ms →{t1:>10.2f} ms  ({t0 / max(t1, 0.001):.1f}x)")
+            print(f"    before: {', '.join(plan0)}")
+            print(f"    after : {', '.join(plan1)}")
+
+        if keep:
+            conn.commit()
+            print("\nMigrations kept.")
+        else:
+            conn.rollback()
+            print("\nRolled back; run python -m elt.migrations to apply them.")
+        cur.close()
+    except Exception as e:
+        print("ERROR during migration benchmark:", e)
+        conn.rollback()
+    finally:
+        release_connection(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare loader query plans before and after pending index migrations")
+    parser.add_argument('--migration', action='append', dest='migrations', metavar='ID',
+                        help=f"pending migration to apply (repeatable; default {', '.join(DEFAULT_MIGRATIONS)})")
+    parser.add_argument('--repeat', type=int, default=3, help="EXPLAIN ANALYZE runs per query, best one counts")
+    parser.add_argument('--keep', action='store_true', help="commit the migrations instead of rolling back")
+    args = parser.parse_args()
+    benchmark(migrations=tuple(args.migrations or DEFAULT_MIGRATIONS), repeat=args.repeat, keep=args.keep)
+
+
+if __name__ == "__main__":
+    main()
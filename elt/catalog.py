@@ -0,0 +1,115 @@
+# elt/catalog.py
+#
+# Read what the loaders need to know about a table's definition from the
+# system catalogs, for the tools that rebuild tables next to the live ones
+# (shadow.py, partitions.py).
+
+import re
+from datetime import date
+
+
+def renamed(table, suffix):
+    """warehouse.products → warehouse.products_shadow"""
+    schema, name = table.split('.')
+    return f"{schema}.{name}{suffix}"
+
+
+def bare(table):
+    return table.split('.')[1]
+
+
+def table_indexes(cur, table):
+    """(name, CREATE INDEX statement) for every index not backing a constraint."""
+    cur.execute("""
+        SELECT c.relname, pg_get_indexdef(i.indexrelid)
+          FROM pg_index i
+          JOIN pg_class c ON c.oid = i.indexrelid
+         WHERE i.indrelid = %s::regclass
+           AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid)
+         ORDER BY c.relname;
+    """, (table,))
+    return cur.fetchall()
+
+
+def retarget_index(ddl, name, table, new_name, new_table):
+    """
+    A CREATE INDEX statement from table_indexes rewritten to build `new_name`
+    on `new_table`. Indexes of partitioned tables come back as ON ONLY, which
+    would leave the partitions unindexed, so that is dropped too.
+    """
+    for on in (f"INDEX {name} ON ONLY {table} ", f"INDEX {name} ON {table} "):
+        if on in ddl:
+            return ddl.replace(on, f"INDEX {new_name} ON {new_table} ", 1)
+    raise ValueError(f"Unexpected definition for index {name}: {ddl}")
+
+
+def table_constraints(cur, table):
+    """(name, type, definition, referenced table) for keys, unique and foreign key constraints."""
+    cur.execute("""
+        SELECT conname, contype, pg_get_constraintdef(oid), confrelid::regclass::text
+          FROM pg_constraint
+         WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+           AND conparentid = 0
+         ORDER BY contype DESC, conname;
+    """, (table,))
+    return cur.fetchall()
+
+
+def owned_sequences(cur, table):
+    """(sequence, column) for every sequence owned by a column of `table`."""
+    cur.execute("""
+        SELECT s.oid::regclass::text, a.attname
+          FROM pg_depend d
+          JOIN pg_class s     ON s.oid = d.objid AND s.relkind = 'S'
+          JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+         WHERE d.refobjid = %s::regclass AND d.deptype = 'a';
+    """, (table,))
+    return cur.fetchall()
+
+
+def stored_columns(cur, table):
+    """Columns of `table` an INSERT can write: everything but generated columns."""
+    cur.execute("""
+        SELECT attname
+          FROM pg_attribute
+         WHERE attrelid = %s::regclass AND attnum > 0
+           AND NOT attisdropped AND attgenerated = ''
+         ORDER BY attnum;
+    """, (table,))
+    return [row[0] for row in cur.fetchall()]
+
+
+def partition_key(cur, table):
+    """The column `table` is range-partitioned on, or None for a plain table."""
+    cur.execute("""
+        SELECT a.attname
+          FROM pg_partitioned_table p
+          JOIN pg_attribute a ON a.attrelid = p.partrelid AND a.attnum = p.partattrs[0]
+         WHERE p.partrelid = to_regclass(%s) AND p.partstrat = 'r';
+    """, (table,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+_BOUND = re.compile(r"FROM \('(\d{4}-\d{2}-\d{2})[^']*'\) TO \('(\d{4}-\d{2}-\d{2})[^']*'\)")
+
+
+def range_partitions(cur, table):
+    """
+    [(partition, lower, upper)] for the partitions attached to `table`, as
+    dates, in order; the DEFAULT partition comes last with (None, None).
+    """
+    cur.execute("""
+        SELECT c.oid::regclass::text, pg_get_expr(c.relpartbound, c.oid)
+          FROM pg_inherits i
+          JOIN pg_class c ON c.oid = i.inhrelid
+         WHERE i.inhparent = %s::regclass;
+    """, (table,))
+    found, default = [], []
+    for name, bound in cur.fetchall():
+        match = _BOUND.search(bound)
+        if match:
+            found.append((name, date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2))))
+        else:
+            default.append((name, None, None))
+    return sorted(found, key=lambda p: p[1]) + default
@@ -0,0 +1,145 @@
+# elt/change_log.py
+
+import argparse
+
+from config.connection import get_connection, release_connection
+
+# public table → the column its change-log entries are keyed by
+CAPTURED = {
+    'categories': 'category_id',
+    'users':      'user_id',
+    'products':   'product_id',
+    'reviews':    'review_id',
+    'locations':  'location_id',
+}
+
+LOG_FUNCTION = """
+CREATE OR REPLACE FUNCTION staging.log_change() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    -- TG_ARGV[0] is the key column; statement-level, so bulk loads log one
+    -- INSERT ... SELECT per statement instead of one row trigger per row
+    IF TG_OP = 'TRUNCATE' THEN
+        INSERT INTO staging.change_log (table_name, row_key) VALUES (TG_TABLE_NAME, NULL);
+    ELSIF TG_OP = 'INSERT' THEN
+        EXECUTE format('INSERT INTO staging.change_log (table_name, row_key)
+                        SELECT %L, %I::text FROM new_rows', TG_TABLE_NAME, TG_ARGV[0]);
+    ELSIF TG_OP = 'DELETE' THEN
+        EXECUTE format('INSERT INTO staging.change_log (table_name, row_key)
+                        SELECT %L, %I::text FROM old_rows', TG_TABLE_NAME, TG_ARGV[0]);
+    ELSE
+        EXECUTE format('INSERT INTO staging.change_log (table_name, row_key)
+                        SELECT %L, %I::text FROM new_rows
+                        UNION
+                        SELECT %L, %I::text FROM old_rows',
+                       TG_TABLE_NAME, TG_ARGV[0], TG_TABLE_NAME, TG_ARGV[0]);
+    END IF;
+    RETURN NULL;
+END $$;
+"""
+
+
+def is_installed(cur):
+    cur.execute("SELECT to_regclass('staging.change_log') IS NOT NULL;")
+    return cur.fetchone()[0]
+
+
+def install(cur):
+    """
+    Create staging.change_log and the capture triggers on every CAPTURED table.
+    Each INSERT/UPDATE/DELETE logs the affected keys; a TRUNCATE logs a NULL
+    key, which makes the next incremental run diff everything.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS staging.change_log (
+            change_id  bigserial   PRIMARY KEY,
+            table_name text        NOT NULL,
+            row_key    text,
+            logged_at  timestamptz NOT NULL DEFAULT now(),
+            etl_id     integer
+        );
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_change_log_etl_id ON staging.change_log (etl_id);")
+    cur.execute(LOG_FUNCTION)
+    for table, key in CAPTURED.items():
+        for event, tables in (
+            ('INSERT', "REFERENCING NEW TABLE AS new_rows"),
+            ('UPDATE', "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows"),
+            ('DELETE', "REFERENCING OLD TABLE AS old_rows"),
+            ('TRUNCATE', ""),
+        ):
+            trigger = f"change_log_{event.lower()}"
+            cur.execute(f"DROP TRIGGER IF EXISTS {trigger} ON public.{table};")
+            cur.execute(f"""
+                CREATE TRIGGER {trigger}
+                AFTER {event} ON public.{table} {tables}
+                FOR EACH STATEMENT EXECUTE FUNCTION staging.log_change('{key}');
+            """)
+
+
+def uninstall(cur):
+    for table in CAPTURED:
+        for event in ('insert', 'update', 'delete', 'truncate'):
+            cur.execute(f"DROP TRIGGER IF EXISTS change_log_{event} ON public.{table};")
+    cur.execute("DROP FUNCTION IF EXISTS staging.log_change();")
+    cur.execute("DROP TABLE IF EXISTS staging.change_log;")
+
+
+def claim(cur, etl_id):
+    """
+    Tag every unclaimed entry with `etl_id` and return
+    (entries, highest change_id, whether a TRUNCATE was logged).
+
+    Entries are claimed by tagging rather than by change_id range: ids come
+    from a sequence, so a transaction holding a lower id can commit after a
+    higher one has been read. Whatever isn't visible yet stays unclaimed and
+    is picked up by the next run.
+    """
+    cur.execute("""
+        WITH claimed AS (
+            UPDATE staging.change_log
+               SET etl_id = %s
+             WHERE etl_id IS NULL
+         RETURNING change_id, row_key
+        )
+        SELECT count(*), max(change_id), bool_or(row_key IS NULL) FROM claimed;
+    """, (etl_id,))
+    entries, highest, truncated = cur.fetchone()
+    return entries, highest, bool(truncated)
+
+
+def purge(cur, etl_id):
+    """Drop the entries a successful run consumed."""
+    cur.execute("DELETE FROM staging.change_log WHERE etl_id = %s;", (etl_id,))
+
+
+def release(cur, etl_id):
+    """Hand a failed run's entries back to the next run."""
+    cur.execute("UPDATE staging.change_log SET etl_id = NULL WHERE etl_id = %s;", (etl_id,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Install or remove change capture on public.*")
+    parser.add_argument('action', choices=['install', 'uninstall'])
+    args = parser.parse_args()
+
+    conn = get_connection('change_log')
+    try:
+        cur = conn.cursor()
+        if args.action == 'install':
+            install(cur)
+            print("Change capture installed on public." + ", public.".join(CAPTURED))
+        else:
+            uninstall(cur)
+            print("Change capture removed.")
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print("ERROR while changing change capture:", e)
+        conn.rollback()
+    finally:
+        release_connection(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# elt/dim_date.py
+#
+# star.dim_date as a generated calendar: one row per day from
+# CALENDAR['start'] to CALENDAR['days_ahead'] days past today, keyed by
+# date_sk = YYYYMMDD, so the fact loaders compute date_sk from the date
+# instead of looking it up.
+
+from datetime import date, timedelta
+
+from config.settings import CALENDAR
+
+
+def date_sk(expr):
+    """SQL for the date_sk of the date expression `expr`: 2025-03-07 → 20250307."""
+    return (f"(EXTRACT(YEAR FROM {expr}) * 10000 + EXTRACT(MONTH FROM {expr}) * 100 "
+            f"+ EXTRACT(DAY FROM {expr}))::integer")
+
+
+def fill_calendar(cur, first, last):
+    """Add every day from `first` through `last` missing from star.dim_date; returns how many."""
+    cur.execute(f"""
+        INSERT INTO star.dim_date (date_sk, full_date, year, quarter, month, day, day_of_week)
+        SELECT {date_sk('d')},
+               d::date,
+               EXTRACT(YEAR    FROM d),
+               EXTRACT(QUARTER FROM d),
+               EXTRACT(MONTH   FROM d),
+               EXTRACT(DAY     FROM d),
+               EXTRACT(DOW     FROM d)
+          FROM generate_series(%s::date, %s::date, interval '1 day') AS g(d)
+        ON CONFLICT (date_sk) DO NOTHING;
+    """, (first, last))
+    return cur.rowcount
+
+
+def ensure_calendar(cur, first=None, today=None):
+    """
+    Make star.dim_date cover CALENDAR['start'] (or `first`, if earlier)
+    through CALENDAR['days_ahead'] days past today, without gaps. Checked
+    with one MIN/MAX/COUNT over the calendar, so it's cheap to call on
+    every run. Returns the number of days added.
+    """
+    start = date.fromisoformat(CALENDAR['start'])
+    first = min(start, first) if first else start
+    last = (today or date.today()) + timedelta(days=CALENDAR['days_ahead'])
+
+    cur.execute("SELECT MIN(full_date), MAX(full_date), COUNT(*) FROM star.dim_date;")
+    lowest, highest, days = cur.fetchone()
+    if lowest is not None and lowest <= first and highest >= last and days == (highest - lowest).days + 1:
+        return 0
+    added = fill_calendar(cur, min(first, lowest or first), max(last, highest or last))
+    print(f"  dim_date: {added:,} day(s) added, calendar covers {min(first, lowest or first)} .. "
+          f"{max(last, highest or last)}")
+    return added
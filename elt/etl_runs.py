@@ -0,0 +1,154 @@
+# elt/etl_runs.py
+
+import json
+
+from elt import change_log
+from elt.migrations import require_migrated
+
+WAREHOUSE_TABLES = ('categories', 'users', 'products', 'reviews', 'locations', 'exchange_rates')
+WAREHOUSE_LOADERS = ('full_load_warehouse', 'incremental_load_warehouse')
+
+
+def ensure_etl_runs(cur):
+    """
+    Create warehouse.etl_seq and warehouse.etl_runs if they are missing.
+    A registry created before backend_pid/backend_start gets them from
+    migration 010_etl_runs_backend.
+
+    The first time etl_runs is empty, the sequence is moved past every
+    insert_id/update_id already in the warehouse (the old per-run MAX scan),
+    so ids handed out from here on never collide with history.
+    """
+    cur.execute("CREATE SEQUENCE IF NOT EXISTS warehouse.etl_seq START WITH 1;")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS warehouse.etl_runs (
+            etl_id      integer PRIMARY KEY,
+            loader      text        NOT NULL,
+            status      text        NOT NULL DEFAULT 'running',
+            started_at  timestamptz NOT NULL DEFAULT now(),
+            finished_at timestamptz,
+            watermarks  jsonb       NOT NULL DEFAULT '{}'::jsonb,
+            backend_pid   integer,
+            backend_start timestamptz
+        );
+    """)
+    cur.execute("SELECT EXISTS (SELECT 1 FROM warehouse.etl_runs);")
+    if cur.fetchone()[0]:
+        return
+
+    maxes = ",\n".join(
+        f"COALESCE((SELECT MAX({col}) FROM warehouse.{t}), 0)"
+        for t in WAREHOUSE_TABLES for col in ('insert_id', 'update_id')
+    )
+    cur.execute(f"SELECT GREATEST({maxes});")
+    highest = cur.fetchone()[0] or 0
+    cur.execute("SELECT last_value, is_called FROM warehouse.etl_seq;")
+    last_value, is_called = cur.fetchone()
+    next_value = last_value + 1 if is_called else last_value
+    if highest >= next_value:
+        cur.execute("SELECT setval('warehouse.etl_seq', %s, false);", (highest + 1,))
+
+
+def start_run(cur, loader):
+    """
+    Register a new run of `loader` and return its etl_id (insert_id/update_id).
+    Refuses to start one while schema migrations are pending.
+    """
+    require_migrated(cur)
+    ensure_etl_runs(cur)
+    fail_abandoned_runs(cur)
+    cur.execute("""
+        INSERT INTO warehouse.etl_runs (etl_id, loader, backend_pid, backend_start)
+        SELECT nextval('warehouse.etl_seq'), %s, pg_backend_pid(),
+               (SELECT backend_start FROM pg_stat_activity WHERE pid = pg_backend_pid())
+        RETURNING etl_id;
+    """, (loader,))
+    return cur.fetchone()[0]
+
+
+def fail_abandoned_runs(cur):
+    """
+    Mark 'failed' the runs still 'running' whose database session is gone: a
+    loader killed, interrupted (KeyboardInterrupt/SystemExit) or cut off
+    before it could record the failure itself. Left alone they would hold
+    settled_etl_id, and with it the star watermark, back for good. A run is
+    alive while pg_stat_activity still shows its backend (same pid, same
+    start time, which another role's sessions may hide). Runs registered
+    before backend_pid was recorded count as gone. Their change-log entries
+    go back to the next run. Returns the etl_ids marked.
+    """
+    cur.execute("""
+        UPDATE warehouse.etl_runs r
+           SET status = 'failed', finished_at = now()
+         WHERE r.status = 'running'
+           AND NOT EXISTS (
+                SELECT 1 FROM pg_stat_activity a
+                 WHERE a.pid = r.backend_pid
+                   AND (a.backend_start = r.backend_start OR a.backend_start IS NULL))
+        RETURNING r.etl_id, r.loader;
+    """)
+    abandoned = sorted(cur.fetchall())
+    if abandoned and change_log.is_installed(cur):
+        for etl_id, _ in abandoned:
+            change_log.release(cur, etl_id)
+    for etl_id, loader in abandoned:
+        print(f"  etl_run {etl_id} ({loader}) was left running by a session that is gone; marked failed")
+    return [etl_id for etl_id, _ in abandoned]
+
+
+def set_watermark(cur, etl_id, stage, value):
+    """Record what `stage` consumed in this run, e.g. the latest fetched_at."""
+    cur.execute("""
+        UPDATE warehouse.etl_runs
+           SET watermarks = watermarks || jsonb_build_object(%s::text, %s::jsonb)
+         WHERE etl_id = %s;
+    """, (stage, json.dumps(value, default=str), etl_id))
+
+
+def last_watermark(cur, stage):
+    """
+    The `stage` watermark of the latest successful run that recorded one, or
+    None. Read-only, so the --plan dry run can use it before any run exists.
+    """
+    cur.execute("SELECT to_regclass('warehouse.etl_runs') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return None
+    cur.execute("""
+        SELECT watermarks ->> %s
+          FROM warehouse.etl_runs
+         WHERE status = 'succeeded' AND watermarks ? %s
+         ORDER BY etl_id DESC
+         LIMIT 1;
+    """, (stage, stage))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def settled_etl_id(cur, loaders=WAREHOUSE_LOADERS):
+    """
+    The highest etl_id whose rows are final: just below the oldest run of
+    `loaders` still running (their tables commit one by one), or the latest
+    run of `loaders` when none is. Runs whose session died without closing
+    them are marked failed first (fail_abandoned_runs), so they never hold
+    it back.
+    """
+    fail_abandoned_runs(cur)
+    cur.execute("""
+        SELECT COALESCE(
+                 (SELECT MIN(etl_id) - 1
+                    FROM warehouse.etl_runs
+                   WHERE status = 'running' AND loader = ANY(%(loaders)s)),
+                 (SELECT MAX(etl_id)
+                    FROM warehouse.etl_runs
+                   WHERE loader = ANY(%(loaders)s)),
+                 0);
+    """, {'loaders': list(loaders)})
+    return cur.fetchone()[0]
+
+
+def finish_run(cur, etl_id, status='succeeded'):
+    cur.execute("""
+        UPDATE warehouse.etl_runs
+           SET status = %s, finished_at = now()
+         WHERE etl_id = %s;
+    """, (status, etl_id))
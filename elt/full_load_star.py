@@ -1,131 +1,147 @@
 # etl_scripts/full_load_star.py
 
-import psycopg2
-from config.settings import DB_CONFIG
-
-def full_load_star():
+import argparse
+import time
+from config.connection import get_connection, release_connection
+from config.scheduler import run_stages
+from elt.aggregates import AGG_PRICING, agg_pricing_insert
+from elt.dim_date import date_sk, ensure_calendar
+from elt.etl_runs import finish_run, set_watermark, settled_etl_id, start_run
+from elt.partitions import ensure_partitions
+from elt.scheduler import sql_stage
+
+DEFAULT_WORKERS = 4
+
+# {table: (tables it takes SKs from, statement)}; the dimensions only read
+# the warehouse, so they load side by side, the fact follows them and the
+# dashboard aggregate follows the fact. dim_date is a calendar kept by
+# ensure_calendar; the fact's date_sk is its date as YYYYMMDD.
+LOADS = {
+    # current warehouse.categories → dim_category
+    'dim_category': ((), """
+        INSERT INTO star.dim_category (category_id, category_name)
+        SELECT DISTINCT
+          c.category_id,
+          c.category_name
+        FROM warehouse.categories c
+        WHERE c.end_date = '9999-12-31';
+    """),
+    # current warehouse.products → dim_product (product_id + name only)
+    'dim_product': ((), """
+        INSERT INTO star.dim_product (product_id, product_name)
+        SELECT DISTINCT
+          p.product_id,
+          p.product_name
+        FROM warehouse.products p
+        WHERE p.end_date = '9999-12-31';
+    """),
+    # current warehouse.locations → dim_location
+    'dim_location': ((), """
+        INSERT INTO star.dim_location (location_id, country, city)
+        SELECT DISTINCT
+          l.location_id,
+          l.country,
+          l.city
+        FROM warehouse.locations l
+        WHERE l.end_date = '9999-12-31';
+    """),
+    # current products × rate × location → fact_pricing (SKs from the dimensions)
+    'fact_pricing': (('dim_category', 'dim_product', 'dim_location'), f"""
+        INSERT INTO star.fact_pricing
+          (date_sk,
+           full_date,
+           product_sk,
+           category_sk,
+           location_sk,
+           actual_price,
+           discounted_price,
+           discount_percentage,
+           currency,
+           rate_to_base)
+        SELECT
+          {date_sk('GREATEST(er.start_date, pr.start_date)')},
+          CAST(GREATEST(er.start_date, pr.start_date) AS DATE),
+          dp.product_sk,
+          dc.category_sk,
+          dl.location_sk,
+          pr.actual_price,
+          pr.discounted_price,
+          pr.discount_percentage,
+          pr.currency,
+          er.rate_to_base
+        FROM warehouse.products pr
+
+        -- USD rate of the product's currency
+        JOIN warehouse.exchange_rates er
+          ON er.base_currency   = 'USD'
+         AND er.target_currency = pr.currency
+         AND er.end_date        = '9999-12-31'
+
+        -- product SK
+        JOIN star.dim_product dp
+          ON pr.product_id = dp.product_id
+
+        -- category SK from dim_category via natural key
+        JOIN warehouse.categories wc
+          ON pr.category_sk = wc.categories_sk
+         AND wc.end_date = '9999-12-31'
+        JOIN star.dim_category dc
+          ON wc.category_id = dc.category_id
+
+        -- location SK
+        JOIN warehouse.locations wl
+          ON pr.products_sk = wl.product_sk
+         AND wl.end_date   = '9999-12-31'
+        JOIN star.dim_location dl
+          ON wl.location_id = dl.location_id
+
+        WHERE pr.end_date = '9999-12-31';
+    """),
+    # fact_pricing → agg_pricing (sums and counts for the dashboard)
+    'agg_pricing': (('fact_pricing',), agg_pricing_insert()),
+}
+
+
+def full_load_star(workers=DEFAULT_WORKERS):
     conn = None
+    run_etl_id = None
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = get_connection('full_load_star', bulk=True)
         cur = conn.cursor()
 
-        # 1) Truncate all star tables
+        # 1) Register the run; incremental_load_star picks up after the
+        #    warehouse runs this load covers
+        run_etl_id = start_run(cur, 'full_load_star')
+        set_watermark(cur, run_etl_id, 'star', settled_etl_id(cur))
+        conn.commit()
+
+        # 2) Truncate all star tables
         for tbl in (
+            AGG_PRICING,
             "star.fact_pricing",
-            "star.dim_date",
             "star.dim_product",
             "star.dim_category",
             "star.dim_location",
         ):
             cur.execute(f"TRUNCATE {tbl} CASCADE;")
-        conn.commit()
+        ensure_partitions(cur)
 
-        # 2) dim_date
-        cur.execute("""
-            INSERT INTO star.dim_date (full_date, year, quarter, month, day, day_of_week)
-            SELECT
-              d::date,
-              EXTRACT(YEAR   FROM d),
-              EXTRACT(QUARTER FROM d),
-              EXTRACT(MONTH  FROM d),
-              EXTRACT(DAY    FROM d),
-              EXTRACT(DOW    FROM d)
-            FROM (
-              SELECT DISTINCT CAST(start_date AS DATE) AS d
-                FROM warehouse.exchange_rates
-               WHERE end_date = '9999-12-31'
-            ) AS dates
-            ORDER BY d;
-        """)
+        #    the calendar must reach back to the oldest current product version
+        cur.execute("SELECT MIN(CAST(start_date AS DATE)) FROM warehouse.products WHERE end_date = '9999-12-31';")
+        ensure_calendar(cur, cur.fetchone()[0])
         conn.commit()
 
-        # 3) dim_category
-        cur.execute("""
-            INSERT INTO star.dim_category (category_id, category_name)
-            SELECT DISTINCT
-              c.category_id,
-              c.category_name
-            FROM warehouse.categories c
-            WHERE c.end_date = '9999-12-31';
-        """)
-        conn.commit()
-
-        # 4) dim_product  — only product_id + name now
-        cur.execute("""
-            INSERT INTO star.dim_product (product_id, product_name)
-            SELECT DISTINCT
-              p.product_id,
-              p.product_name
-            FROM warehouse.products p
-            WHERE p.end_date = '9999-12-31';
-        """)
-        conn.commit()
-
-        # 5) dim_location
-        cur.execute("""
-            INSERT INTO star.dim_location (location_id, country, city)
-            SELECT DISTINCT
-              l.location_id,
-              l.country,
-              l.city
-            FROM warehouse.locations l
-            WHERE l.end_date = '9999-12-31';
-        """)
-        conn.commit()
-
-        # 6) fact_pricing
-        cur.execute("""
-            INSERT INTO star.fact_pricing
-              (date_sk,
-               product_sk,
-               category_sk,
-               location_sk,
-               actual_price,
-               discounted_price,
-               discount_percentage,
-               currency,
-               rate_to_base)
-            SELECT
-              dd.date_sk,
-              dp.product_sk,
-              dc.category_sk,
-              dl.location_sk,
-              pr.actual_price,
-              pr.discounted_price,
-              pr.discount_percentage,
-              pr.currency,
-              er.rate_to_base
-            FROM warehouse.exchange_rates er
-
-            -- link to product
-            JOIN warehouse.products pr
-              ON er.product_sk = pr.products_sk
-             AND pr.end_date   = '9999-12-31'
-
-            -- date lookup
-            JOIN star.dim_date dd
-              ON CAST(er.start_date AS DATE) = dd.full_date
-
-            -- product SK
-            JOIN star.dim_product dp
-              ON pr.product_id = dp.product_id
-
-            -- category SK from dim_category via natural key
-            JOIN warehouse.categories wc
-              ON pr.category_sk = wc.categories_sk
-             AND wc.end_date = '9999-12-31'
-            JOIN star.dim_category dc
-              ON wc.category_id = dc.category_id
-
-            -- location SK
-            JOIN warehouse.locations wl
-              ON pr.products_sk = wl.product_sk
-             AND wl.end_date   = '9999-12-31'
-            JOIN star.dim_location dl
-              ON wl.location_id = dl.location_id
-
-            WHERE er.end_date = '9999-12-31';
-        """)
+        # 3) Dimensions in parallel on pooled connections, then fact_pricing
+        rows = {}
+        stages = {name: sql_stage(f"full_load_star:{name}", sql, rows=rows, name=name, bulk=True)
+                  for name, (_, sql) in LOADS.items()}
+        started = time.perf_counter()
+        timings = run_stages(stages, {name: deps for name, (deps, _) in LOADS.items()}, max_workers=workers)
+        for name in LOADS:
+            print(f"  {name:<15}{rows[name]:>10,} rows{timings[name]:>8.2f}s")
+        print(f"  {len(timings)} table(s) in {time.perf_counter() - started:.2f}s wall clock "
+              f"({sum(timings.values()):.2f}s of load time, {workers} worker(s))")
+        finish_run(cur, run_etl_id)
         conn.commit()
 
         print("★ Full load into star schema completed successfully.")
@@ -135,9 +151,21 @@ def full_load_star():
         print("ERROR during full load into star schema:", e)
         if conn:
             conn.rollback()
+            if run_etl_id is not None:
+                finish_run(conn.cursor(), run_etl_id, 'failed')
+                conn.commit()
     finally:
         if conn:
-            conn.close()
+            release_connection(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full reload of the star schema from the current warehouse rows")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="tables loaded concurrently, each on its own pooled connection")
+    args = parser.parse_args()
+    full_load_star(workers=args.workers)
+
 
 if __name__ == "__main__":
-    full_load_star()
+    main()
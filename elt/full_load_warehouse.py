@@ -1,51 +1,156 @@
 # etl_scripts/full_load_warehouse.py
 
-import psycopg2
+import argparse
+import time
 from datetime import datetime
-from config.settings import DB_CONFIG
+from config.connection import get_connection, release_connection
+from config.scheduler import run_stages
+from elt import change_log
+from elt.etl_runs import WAREHOUSE_TABLES, finish_run, set_watermark, start_run
+from elt.partitions import ensure_partitions
+from elt.scheduler import sql_stage
+from elt.shadow import create_shadows, drop_shadows, finish_shadows, swap_shadows
 
-def get_next_etl_id(cur):
-    """
-    Ensure a sequence 'warehouse.etl_seq' exists and return the next value.
-    This sequence is used for both insert_id and update_id across ALL warehouse tables.
-    """
-    # 1) Create the sequence if it doesn’t already exist.
-    cur.execute("""
-        CREATE SEQUENCE IF NOT EXISTS warehouse.etl_seq START WITH 1;
-    """)
-
-    # 2) Find the greatest insert_id or update_id currently in any warehouse table.
-    cur.execute("""
-        SELECT GREATEST(
-          COALESCE((SELECT MAX(insert_id) FROM warehouse.categories), 0),
-          COALESCE((SELECT MAX(update_id) FROM warehouse.categories), 0),
-
-          COALESCE((SELECT MAX(insert_id) FROM warehouse.users), 0),
-          COALESCE((SELECT MAX(update_id) FROM warehouse.users), 0),
+DEFAULT_WORKERS = 4
 
-          COALESCE((SELECT MAX(insert_id) FROM warehouse.products), 0),
-          COALESCE((SELECT MAX(update_id) FROM warehouse.products), 0),
+# ------------------------------------------------------------------------------
+# One INSERT ... SELECT per warehouse table: {name: (tables it reads SKs from,
+# statement)}. {categories}, {products}, ... are the tables being loaded
+# (the live ones, or their shadows); the parameters are (start_date, insert_id).
+# ------------------------------------------------------------------------------
+LOADS = {
+    # public.categories → warehouse.categories
+    'categories': ((), """
+        INSERT INTO {categories}
+          (category_id, category_name,
+           start_date, source_id, insert_id, update_id)
+        SELECT
+          c.category_id,
+          c.category_name,
+          %s        AS start_date,
+          1         AS source_id,
+          %s        AS insert_id,
+          NULL      AS update_id
+        FROM public.categories c;
+    """),
+    # public.users → warehouse.users
+    'users': ((), """
+        INSERT INTO {users}
+          (user_id, user_name,
+           start_date, source_id, insert_id, update_id)
+        SELECT
+          u.user_id,
+          u.user_name,
+          %s        AS start_date,
+          1         AS source_id,
+          %s        AS insert_id,
+          NULL      AS update_id
+        FROM public.users u;
+    """),
+    # public.products → warehouse.products
+    # (join to warehouse.categories to get category_sk)
+    'products': (('categories',), """
+        INSERT INTO {products}
+          (product_id, product_name, category_sk,
+           discounted_price, actual_price, discount_percentage,
+           rating, rating_count, about_product, product_link, currency,
+           start_date, source_id, insert_id, update_id)
+        SELECT
+          p.product_id,
+          p.product_name,
+          wc.categories_sk       AS category_sk,
+          p.discounted_price,
+          p.actual_price,
+          p.discount_percentage,
+          p.rating,
+          p.rating_count,
+          p.about_product,
+          p.product_link,
+          p.currency,
+          %s        AS start_date,
+          1         AS source_id,
+          %s        AS insert_id,
+          NULL      AS update_id
+        FROM public.products p
+        JOIN {categories} wc
+          ON p.category_id = wc.category_id
+         AND wc.end_date = '9999-12-31';
+    """),
+    # public.reviews → warehouse.reviews
+    # (join to warehouse.products and warehouse.users to get surrogate keys)
+    'reviews': (('products', 'users'), """
+        INSERT INTO {reviews}
+          (review_id, product_sk, user_sk, review_title, review_content,
+           start_date, source_id, insert_id, update_id)
+        SELECT
+          r.review_id,
+          wp.products_sk       AS product_sk,
+          wu.users_sk          AS user_sk,
+          r.review_title,
+          r.review_content,
+          %s        AS start_date,
+          1         AS source_id,
+          %s        AS insert_id,
+          NULL      AS update_id
+        FROM public.reviews r
+        JOIN {products} wp
+          ON r.product_id = wp.product_id
+         AND wp.end_date = '9999-12-31'
+        JOIN {users} wu
+          ON r.user_id = wu.user_id
+         AND wu.end_date = '9999-12-31';
+    """),
+    # public.locations → warehouse.locations
+    # (join to warehouse.products to get product_sk)
+    'locations': (('products',), """
+        INSERT INTO {locations}
+          (location_id, product_sk, country, city,
+           start_date, source_id, insert_id, update_id)
+        SELECT
+          l.location_id,
+          wp.products_sk       AS product_sk,
+          l.country,
+          l.city,
+          %s        AS start_date,
+          1         AS source_id,
+          %s        AS insert_id,
+          NULL      AS update_id
+        FROM public.locations l
+        JOIN {products} wp
+          ON l.product_id = wp.product_id
+         AND wp.end_date = '9999-12-31';
+    """),
+    # staging.exchange_rates_raw → warehouse.exchange_rates
+    # (latest rate per currency pair; products join it in the star fact)
+    'exchange_rates': ((), """
+        INSERT INTO {exchange_rates}
+          (base_currency, target_currency, fetched_at, rate_to_base,
+           start_date, source_id, insert_id, update_id)
+        SELECT DISTINCT ON (s.base_currency, s.target_currency)
+          s.base_currency,
+          s.target_currency,
+          s.fetched_at          AS fetched_at,
+          s.rate                AS rate_to_base,
+          %s                    AS start_date,
+          2                     AS source_id,
+          %s                    AS insert_id,
+          NULL                  AS update_id
+        FROM staging.exchange_rates_raw s
+        ORDER BY s.base_currency, s.target_currency, s.fetched_at DESC;
+    """),
+}
 
-          COALESCE((SELECT MAX(insert_id) FROM warehouse.reviews), 0),
-          COALESCE((SELECT MAX(update_id) FROM warehouse.reviews), 0),
+SURROGATE_KEYS = {
+    'categories':     'categories_sk',
+    'users':          'users_sk',
+    'products':       'products_sk',
+    'reviews':        'reviews_sk',
+    'locations':      'locations_sk',
+    'exchange_rates': 'exchange_rates_sk',
+}
 
-          COALESCE((SELECT MAX(insert_id) FROM warehouse.locations), 0),
-          COALESCE((SELECT MAX(update_id) FROM warehouse.locations), 0),
 
-          COALESCE((SELECT MAX(insert_id) FROM warehouse.exchange_rates), 0),
-          COALESCE((SELECT MAX(update_id) FROM warehouse.exchange_rates), 0)
-        );
-    """)
-    max_id = cur.fetchone()[0] or 0
-    next_id = max_id + 1
-
-    # 3) Bump the sequence so that nextval(…) will return exactly next_id.
-    cur.execute("SELECT setval('warehouse.etl_seq', %s, false);", (next_id,))
-    cur.execute("SELECT nextval('warehouse.etl_seq');")
-    return cur.fetchone()[0]
-
-
-def full_load_warehouse():
+def full_load_warehouse(shadow=False, workers=DEFAULT_WORKERS):
     """
     Perform a full load from:
       - public.categories, public.products, public.users, public.reviews, public.locations
@@ -54,269 +159,116 @@ def full_load_warehouse():
 
     For this load:
       * We truncate all warehouse tables first.
-      * We call get_next_etl_id() once at the top to get a new “run-level” ETL ID:
+      * We register the run in warehouse.etl_runs to get a new “run-level” ETL ID:
           - That becomes insert_id for every row inserted in this run.
           - update_id remains NULL (because we’re only inserting the first version).
       * source_id = 1 for rows from public.*
       * source_id = 2 for rows from staging.*
       * start_date = load_timestamp (the same for all rows)
       * end_date defaults to '9999-12-31' via the table definitions
+
+    Tables are loaded as a dependency graph (LOADS) on up to `workers`
+    pooled connections, each step committing on its own; the surrogate-key
+    sequences are moved past the loaded SKs once everything is in.
+
+    With `shadow`, nothing is truncated: every table is built into an
+    UNLOGGED warehouse.<table>_shadow copy without indexes, which then gets
+    the live table's indexes and keys, is analyzed, and is swapped in for
+    the live table in the same transaction that closes the run. Readers see
+    the old warehouse until that commit, and a failed load leaves it as it
+    was.
     """
 
     conn = None
+    run_etl_id = None
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = get_connection('full_load_warehouse', bulk=True)
         cur = conn.cursor()
 
         # 1) Capture a single timestamp for start_date on all inserts
         load_ts = datetime.utcnow()
 
-        # 2) Compute a brand-new ETL ID for this entire run
+        # 2) Register the run and take its ETL ID
         #    (this will be used as insert_id for all newly loaded rows)
-        run_etl_id = get_next_etl_id(cur)
+        run_etl_id = start_run(cur, 'full_load_warehouse')
 
-        # ------------------------------------------------------------------------------
-        # 3) Truncate all warehouse tables in dependency order
-        #    (exchange_rates → locations → reviews → products → users → categories)
-        # ------------------------------------------------------------------------------
-        cur.execute("TRUNCATE warehouse.exchange_rates CASCADE;")
-        cur.execute("TRUNCATE warehouse.locations      CASCADE;")
-        cur.execute("TRUNCATE warehouse.reviews        CASCADE;")
-        cur.execute("TRUNCATE warehouse.products       CASCADE;")
-        cur.execute("TRUNCATE warehouse.users          CASCADE;")
-        cur.execute("TRUNCATE warehouse.categories     CASCADE;")
+        #    Everything logged so far is covered by this load, and so are the
+        #    staged rates; record both so the next incremental run starts here
+        if change_log.is_installed(cur):
+            _, highest, _ = change_log.claim(cur, run_etl_id)
+            set_watermark(cur, run_etl_id, 'change_log', highest or 0)
+        cur.execute("SELECT MAX(fetched_at) FROM staging.exchange_rates_raw;")
+        set_watermark(cur, run_etl_id, 'exchange_rates', cur.fetchone()[0])
         conn.commit()
 
         # ------------------------------------------------------------------------------
-        # 4) Load public.categories → warehouse.categories
-        # ------------------------------------------------------------------------------
-        cur.execute(
-            """
-            INSERT INTO warehouse.categories
-              (category_id, category_name,
-               start_date, source_id, insert_id, update_id)
-            SELECT
-              c.category_id,
-              c.category_name,
-              %s        AS start_date,
-              1         AS source_id,
-              %s        AS insert_id,
-              NULL      AS update_id
-            FROM public.categories c;
-            """,
-            (load_ts, run_etl_id)
-        )
-
-        # ------------------------------------------------------------------------------
-        # 5) Load public.users → warehouse.users
-        # ------------------------------------------------------------------------------
-        cur.execute(
-            """
-            INSERT INTO warehouse.users
-              (user_id, user_name,
-               start_date, source_id, insert_id, update_id)
-            SELECT
-              u.user_id,
-              u.user_name,
-              %s        AS start_date,
-              1         AS source_id,
-              %s        AS insert_id,
-              NULL      AS update_id
-            FROM public.users u;
-            """,
-            (load_ts, run_etl_id)
-        )
-
-        # ------------------------------------------------------------------------------
-        # 6) Load public.products → warehouse.products
-        #    (join to warehouse.categories to get category_sk)
+        # 3) Truncate all warehouse tables in dependency order
+        #    (exchange_rates → locations → reviews → products → users → categories),
+        #    or create their shadow copies and load those instead
         # ------------------------------------------------------------------------------
-        cur.execute(
-            """
-            INSERT INTO warehouse.products
-              (product_id, product_name, category_sk,
-               discounted_price, actual_price, discount_percentage,
-               rating, rating_count, about_product, product_link, currency,
-               start_date, source_id, insert_id, update_id)
-            SELECT
-              p.product_id,
-              p.product_name,
-              wc.categories_sk       AS category_sk,
-              p.discounted_price,
-              p.actual_price,
-              p.discount_percentage,
-              p.rating,
-              p.rating_count,
-              p.about_product,
-              p.product_link,
-              p.currency,
-              %s        AS start_date,
-              1         AS source_id,
-              %s        AS insert_id,
-              NULL      AS update_id
-            FROM public.products p
-            JOIN warehouse.categories wc
-              ON p.category_id = wc.category_id
-             AND wc.end_date = '9999-12-31';
-            """,
-            (load_ts, run_etl_id)
-        )
+        #    (partitioned tables get their months up to and ahead of load_ts first)
+        ensure_partitions(cur, load_ts)
+        t = {name: f"warehouse.{name}" for name in WAREHOUSE_TABLES}
+        if shadow:
+            shadows = create_shadows(cur, t.values())
+            t = {name: shadows[table] for name, table in t.items()}
+        else:
+            cur.execute("TRUNCATE warehouse.exchange_rates CASCADE;")
+            cur.execute("TRUNCATE warehouse.locations      CASCADE;")
+            cur.execute("TRUNCATE warehouse.reviews        CASCADE;")
+            cur.execute("TRUNCATE warehouse.products       CASCADE;")
+            cur.execute("TRUNCATE warehouse.users          CASCADE;")
+            cur.execute("TRUNCATE warehouse.categories     CASCADE;")
+        conn.commit()
 
         # ------------------------------------------------------------------------------
-        # 7) Load public.reviews → warehouse.reviews
-        #    (join to warehouse.products and warehouse.users to get surrogate keys)
+        # 4) Load the tables, each as soon as the tables it takes SKs from are in
         # ------------------------------------------------------------------------------
-        cur.execute(
-            """
-            INSERT INTO warehouse.reviews
-              (review_id, product_sk, user_sk, review_title, review_content,
-               start_date, source_id, insert_id, update_id)
-            SELECT
-              r.review_id,
-              wp.products_sk       AS product_sk,
-              wu.users_sk          AS user_sk,
-              r.review_title,
-              r.review_content,
-              %s        AS start_date,
-              1         AS source_id,
-              %s        AS insert_id,
-              NULL      AS update_id
-            FROM public.reviews r
-            JOIN warehouse.products wp
-              ON r.product_id = wp.product_id
-             AND wp.end_date = '9999-12-31'
-            JOIN warehouse.users wu
-              ON r.user_id = wu.user_id
-             AND wu.end_date = '9999-12-31';
-            """,
-            (load_ts, run_etl_id)
-        )
+        rows = {}
+        stages = {
+            name: sql_stage(f"full_load_warehouse:{name}", sql.format(**t), (load_ts, run_etl_id),
+                            rows, name, bulk=True)
+            for name, (_, sql) in LOADS.items()
+        }
+        started = time.perf_counter()
+        timings = run_stages(stages, {name: deps for name, (deps, _) in LOADS.items()}, max_workers=workers)
+        for name in LOADS:
+            print(f"  {name:<15}{rows[name]:>10,} rows{timings[name]:>8.2f}s")
+        print(f"  {len(timings)} table(s) in {time.perf_counter() - started:.2f}s wall clock "
+              f"({sum(timings.values()):.2f}s of load time, {workers} worker(s))")
 
         # ------------------------------------------------------------------------------
-        # 8) Load public.locations → warehouse.locations
-        #    (join to warehouse.products to get product_sk)
-        # ------------------------------------------------------------------------------
-        cur.execute(
-            """
-            INSERT INTO warehouse.locations
-              (location_id, product_sk, country, city,
-               start_date, source_id, insert_id, update_id)
-            SELECT
-              l.location_id,
-              wp.products_sk       AS product_sk,
-              l.country,
-              l.city,
-              %s        AS start_date,
-              1         AS source_id,
-              %s        AS insert_id,
-              NULL      AS update_id
-            FROM public.locations l
-            JOIN warehouse.products wp
-              ON l.product_id = wp.product_id
-             AND wp.end_date = '9999-12-31';
-            """,
-            (load_ts, run_etl_id)
-        )
-
-        conn.commit()
-
-        # ------------------------------------------------------------------------------
-        # 9) Reset the surrogate‐key sequences for all warehouse tables
+        # 5) Reset the surrogate‐key sequences for all warehouse tables
         #    so that future inserts get the correct next SK
         # ------------------------------------------------------------------------------
-        cur.execute(
-            """
-            SELECT setval(
-                     pg_get_serial_sequence('warehouse.categories','categories_sk'),
-                     COALESCE((SELECT MAX(categories_sk) FROM warehouse.categories), 1),
-                     true
-                   );
-            """
-        )
-        cur.execute(
-            """
-            SELECT setval(
-                     pg_get_serial_sequence('warehouse.users','users_sk'),
-                     COALESCE((SELECT MAX(users_sk) FROM warehouse.users), 1),
-                     true
-                   );
-            """
-        )
-        cur.execute(
-            """
-            SELECT setval(
-                     pg_get_serial_sequence('warehouse.products','products_sk'),
-                     COALESCE((SELECT MAX(products_sk) FROM warehouse.products), 1),
-                     true
-                   );
-            """
-        )
-        cur.execute(
-            """
-            SELECT setval(
-                     pg_get_serial_sequence('warehouse.reviews','reviews_sk'),
-                     COALESCE((SELECT MAX(reviews_sk) FROM warehouse.reviews), 1),
-                     true
-                   );
-            """
-        )
-        cur.execute(
-            """
-            SELECT setval(
-                     pg_get_serial_sequence('warehouse.locations','locations_sk'),
-                     COALESCE((SELECT MAX(locations_sk) FROM warehouse.locations), 1),
-                     true
-                   );
-            """
-        )
+        for name, sk in SURROGATE_KEYS.items():
+            cur.execute(
+                f"""
+                SELECT setval(
+                         pg_get_serial_sequence('warehouse.{name}', '{sk}'),
+                         COALESCE((SELECT MAX({sk}) FROM {t[name]}), 1),
+                         true
+                       );
+                """
+            )
         conn.commit()
 
         # ------------------------------------------------------------------------------
-        # 10) Load staging.exchange_rates_raw → warehouse.exchange_rates
-        #     (join to warehouse.products to get product_sk)
+        # 6) Shadow mode: index and analyze the shadows, then swap them in
+        #    in the same transaction that closes the run
         # ------------------------------------------------------------------------------
-        cur.execute(
-            """
-            INSERT INTO warehouse.exchange_rates
-              (product_sk, fetched_at, rate_to_base,
-               start_date, source_id, insert_id, update_id)
-            SELECT
-              wp.products_sk        AS product_sk,
-              s.fetched_at          AS fetched_at,
-              s.rate                AS rate_to_base,
-              %s                    AS start_date,
-              2                     AS source_id,
-              %s                    AS insert_id,
-              NULL                  AS update_id
-            FROM staging.exchange_rates_raw s
-            JOIN public.products p
-              ON s.base_currency    = 'USD'
-             AND s.target_currency  = p.currency
-            JOIN warehouse.products wp
-              ON p.product_id = wp.product_id
-             AND wp.end_date = '9999-12-31';
-            """,
-            (load_ts, run_etl_id)
-        )
-        conn.commit()
+        if shadow:
+            renames = finish_shadows(cur, shadows)
+            conn.commit()
+            swap_shadows(cur, shadows, renames)
 
         # ------------------------------------------------------------------------------
-        # 11) Reset exchange_rates surrogate sequence
+        # 7) Close the run and print the completion message
         # ------------------------------------------------------------------------------
-        cur.execute(
-            """
-            SELECT setval(
-                     pg_get_serial_sequence('warehouse.exchange_rates','exchange_rates_sk'),
-                     COALESCE((SELECT MAX(exchange_rates_sk) FROM warehouse.exchange_rates), 1),
-                     true
-                   );
-            """
-        )
+        if change_log.is_installed(cur):
+            change_log.purge(cur, run_etl_id)
+        finish_run(cur, run_etl_id)
         conn.commit()
-
-        # ------------------------------------------------------------------------------
-        # 12) Completion message
-        # ------------------------------------------------------------------------------
         print("Full warehouse load complete. (All new rows inserted with insert_id =", run_etl_id, ")")
         cur.close()
 
@@ -324,10 +276,28 @@ def full_load_warehouse():
         print("ERROR during full warehouse load:", e)
         if conn:
             conn.rollback()
+            if run_etl_id is not None:
+                cur = conn.cursor()
+                if shadow:
+                    drop_shadows(cur, [f"warehouse.{name}" for name in WAREHOUSE_TABLES])
+                if change_log.is_installed(cur):
+                    change_log.release(cur, run_etl_id)
+                finish_run(cur, run_etl_id, 'failed')
+                conn.commit()
     finally:
         if conn:
-            conn.close()
+            release_connection(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full reload of the warehouse schema from public.* and staging.*")
+    parser.add_argument('--shadow', action='store_true',
+                        help="build UNLOGGED shadow copies and swap them in at the end instead of truncating")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="tables loaded concurrently, each on its own pooled connection")
+    args = parser.parse_args()
+    full_load_warehouse(shadow=args.shadow, workers=args.workers)
 
 
 if __name__ == "__main__":
-    full_load_warehouse()
+    main()
@@ -1,82 +1,161 @@
-import psycopg2
-from config.settings import DB_CONFIG
+from config.connection import get_connection, release_connection
+from elt.aggregates import refresh_agg_pricing
+from elt.dim_date import date_sk, ensure_calendar
+from elt.etl_runs import finish_run, last_watermark, set_watermark, settled_etl_id, start_run
+from elt.partitions import ensure_partitions
+
+
+def changed(alias):
+    """Versions stamped by the warehouse runs this star run consumes."""
+    return f"{alias}.insert_id > %(since)s AND {alias}.insert_id <= %(until)s"
+
+
+def closed(alias):
+    """Versions closed by the warehouse runs this star run consumes."""
+    return f"{alias}.update_id > %(since)s AND {alias}.update_id <= %(until)s"
+
+
+def gone(dim, sk, table, key):
+    """
+    Rows of star `dim` whose natural `key` had a version closed in the window
+    and has no current version left in warehouse `table`: deleted at the source.
+    """
+    return f"""
+        SELECT d.{sk}
+          FROM {dim} d
+         WHERE d.{key} IN (SELECT w.{key} FROM {table} w WHERE {closed('w')})
+           AND NOT EXISTS (
+                 SELECT 1 FROM {table} w
+                  WHERE w.{key} = d.{key} AND w.end_date = '9999-12-31')
+    """
+
 
 def incremental_load_star():
+    """
+    Bring the star schema up to date with the warehouse versions inserted
+    since the previous star run (the 'star' watermark in warehouse.etl_runs),
+    instead of re-deriving every current row and discarding the known ones.
+    Products and locations closed since then with no version replacing them
+    (deleted at the source) leave the fact, the aggregate and the dimensions.
+    """
     conn = None
+    run_etl_id = None
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = get_connection('incremental_load_star')
         cur = conn.cursor()
 
-        # 1) DIM_DATE: add any new dates
-        cur.execute("""
-            INSERT INTO star.dim_date (full_date, year, quarter, month, day, day_of_week)
-            SELECT d::date,
-                   EXTRACT(YEAR   FROM d),
-                   EXTRACT(QUARTER FROM d),
-                   EXTRACT(MONTH  FROM d),
-                   EXTRACT(DAY    FROM d),
-                   EXTRACT(DOW    FROM d)
-              FROM (
-                SELECT DISTINCT CAST(start_date AS DATE) AS d
-                  FROM warehouse.exchange_rates
-                 WHERE end_date = '9999-12-31'
-              ) AS src
-            WHERE NOT EXISTS (
-              SELECT 1 FROM star.dim_date dst
-               WHERE dst.full_date = src.d
-            )
-            ORDER BY d;
-        """)
+        # 0) Partitioned fact: months up to and ahead of today
+        ensure_partitions(cur)
         conn.commit()
 
-        # 2) DIM_CATEGORY: new categories
-        cur.execute("""
+        # 1) Register the run and take the warehouse runs it consumes: everything
+        #    stamped after the last star run's watermark, up to the latest run
+        #    whose rows are final
+        run_etl_id = start_run(cur, 'incremental_load_star')
+        since = int(last_watermark(cur, 'star') or 0)
+        until = settled_etl_id(cur)
+        set_watermark(cur, run_etl_id, 'star', until)
+        conn.commit()
+        window = {'since': since, 'until': until}
+        print(f"  warehouse runs {since + 1}..{until}" if until > since else "  no new warehouse runs")
+
+        # 2) Current product/rate pairs touched by those runs: a new product
+        #    version, a new rate for its currency, or a new version of one of
+        #    its locations or of its category. A closed version adds nothing
+        #    by itself: the version replacing it is new, and one with no
+        #    replacement is a delete, handled in step 8.
+        cur.execute(f"""
+            CREATE TEMP TABLE star_changes AS
+            SELECT pr.products_sk,
+                   pr.product_id,
+                   pr.category_sk,
+                   pr.actual_price,
+                   pr.discounted_price,
+                   pr.discount_percentage,
+                   pr.currency,
+                   er.rate_to_base,
+                   CAST(GREATEST(er.start_date, pr.start_date) AS DATE) AS full_date
+              FROM warehouse.products pr
+              JOIN warehouse.exchange_rates er
+                ON er.base_currency   = 'USD'
+               AND er.target_currency = pr.currency
+               AND er.end_date        = '9999-12-31'
+             WHERE pr.end_date = '9999-12-31'
+               AND ({changed('pr')}
+                    OR {changed('er')}
+                    OR pr.products_sk IN (
+                         SELECT wl.product_sk FROM warehouse.locations wl
+                          WHERE wl.end_date = '9999-12-31' AND {changed('wl')})
+                    OR pr.category_sk IN (
+                         SELECT wc.categories_sk FROM warehouse.categories wc
+                          WHERE wc.end_date = '9999-12-31' AND {changed('wc')}));
+        """, window)
+        print(f"  {cur.rowcount:,} changed product/rate pair(s)")
+
+        # 3) DIM_DATE: make sure the calendar covers every changed pair's date
+        cur.execute("SELECT MIN(full_date) FROM star_changes;")
+        ensure_calendar(cur, cur.fetchone()[0])
+        conn.commit()
+
+        # 4) DIM_CATEGORY: new categories
+        cur.execute(f"""
             INSERT INTO star.dim_category (category_id, category_name)
             SELECT c.category_id, c.category_name
               FROM warehouse.categories c
              WHERE c.end_date = '9999-12-31'
+               AND {changed('c')}
                AND NOT EXISTS (
                  SELECT 1 FROM star.dim_category dc
                   WHERE dc.category_id = c.category_id
                );
-        """)
+        """, window)
         conn.commit()
 
-        # 3) DIM_PRODUCT: new products
-        cur.execute("""
+        # 5) DIM_PRODUCT: new products
+        cur.execute(f"""
             INSERT INTO star.dim_product (product_id, product_name)
             SELECT p.product_id, p.product_name
               FROM warehouse.products p
              WHERE p.end_date = '9999-12-31'
+               AND {changed('p')}
                AND NOT EXISTS (
                  SELECT 1 FROM star.dim_product dp
                   WHERE dp.product_id = p.product_id
                );
-        """)
+        """, window)
         conn.commit()
 
-        # 4) DIM_LOCATION: new locations
-        cur.execute("""
+        # 6) DIM_LOCATION: new locations
+        cur.execute(f"""
             INSERT INTO star.dim_location (location_id, country, city)
             SELECT l.location_id, l.country, l.city
               FROM warehouse.locations l
              WHERE l.end_date = '9999-12-31'
+               AND {changed('l')}
                AND NOT EXISTS (
                  SELECT 1 FROM star.dim_location dl
                   WHERE dl.location_id = l.location_id
                );
-        """)
+        """, window)
         conn.commit()
 
-        # 5) FACT_PRICING: only new (date,product,location),
-        #    now pulling category_sk via warehouse.categories → star.dim_category
-        cur.execute("""
-            INSERT INTO star.fact_pricing
-              (date_sk, product_sk, category_sk, location_sk,
+        # 7) FACT_PRICING: upsert on the (date, product, location) grain,
+        #    now pulling category_sk via warehouse.categories → star.dim_category;
+        #    a price corrected within the same date updates its row in place;
+        #    the (date, product) slices written are kept for step 8
+        cur.execute("CREATE TEMP TABLE star_touched (date_sk integer, product_sk integer);")
+        cur.execute(f"""
+            WITH before AS (
+              SELECT COALESCE(MAX(pricing_sk), 0) AS last_sk FROM star.fact_pricing
+            ),
+            upserted AS (
+            INSERT INTO star.fact_pricing AS fp
+              (date_sk, full_date, product_sk, category_sk, location_sk,
                actual_price, discounted_price, discount_percentage,
                currency, rate_to_base)
             SELECT
-              dd.date_sk,
+              {date_sk('pr.full_date')},
+              pr.full_date,
               dp.product_sk,
               dc.category_sk,
               dl.location_sk,
@@ -84,15 +163,8 @@ def incremental_load_star():
               pr.discounted_price,
               pr.discount_percentage,
               pr.currency,
-              er.rate_to_base
-            FROM warehouse.exchange_rates er
-            JOIN warehouse.products      pr
-              ON er.product_sk = pr.products_sk
-             AND pr.end_date   = '9999-12-31'
-
-            -- map to star.dim_date
-            JOIN star.dim_date          dd
-              ON CAST(er.start_date AS DATE) = dd.full_date
+              pr.rate_to_base
+            FROM star_changes            pr
 
             -- map to star.dim_product
             JOIN star.dim_product       dp
@@ -112,15 +184,68 @@ def incremental_load_star():
             JOIN star.dim_location      dl
               ON wl.location_id = dl.location_id
 
-            WHERE er.end_date = '9999-12-31'
-              AND NOT EXISTS (
-                SELECT 1
-                  FROM star.fact_pricing fp
-                 WHERE fp.date_sk     = dd.date_sk
-                   AND fp.product_sk  = dp.product_sk
-                   AND fp.location_sk = dl.location_sk
-              );
+            ON CONFLICT ON CONSTRAINT fact_pricing_grain DO UPDATE
+               SET category_sk         = EXCLUDED.category_sk,
+                   actual_price        = EXCLUDED.actual_price,
+                   discounted_price    = EXCLUDED.discounted_price,
+                   discount_percentage = EXCLUDED.discount_percentage,
+                   currency            = EXCLUDED.currency,
+                   rate_to_base        = EXCLUDED.rate_to_base
+             WHERE (fp.category_sk, fp.actual_price, fp.discounted_price, fp.discount_percentage,
+                    fp.currency, fp.rate_to_base)
+                   IS DISTINCT FROM
+                   (EXCLUDED.category_sk, EXCLUDED.actual_price, EXCLUDED.discounted_price,
+                    EXCLUDED.discount_percentage, EXCLUDED.currency, EXCLUDED.rate_to_base)
+            RETURNING pricing_sk, date_sk, product_sk
+            ),
+            touched AS (
+              INSERT INTO star_touched (date_sk, product_sk)
+              SELECT DISTINCT date_sk, product_sk FROM upserted
+            )
+            -- new rows draw SKs past the last one; updated rows keep theirs
+            SELECT COUNT(*) FILTER (WHERE u.pricing_sk >  b.last_sk),
+                   COUNT(*) FILTER (WHERE u.pricing_sk <= b.last_sk)
+              FROM upserted u CROSS JOIN before b;
         """)
+        inserted, updated = cur.fetchone()
+        print(f"  fact_pricing: {inserted:,} inserted, {updated:,} updated")
+
+        # 8) Deletes: products and locations whose last version was closed by
+        #    these runs with nothing replacing it lose their fact rows (their
+        #    slices are rebuilt in step 9) and their dimension rows
+        cur.execute(f"CREATE TEMP TABLE star_gone_products AS "
+                    f"{gone('star.dim_product', 'product_sk', 'warehouse.products', 'product_id')};", window)
+        cur.execute(f"CREATE TEMP TABLE star_gone_locations AS "
+                    f"{gone('star.dim_location', 'location_sk', 'warehouse.locations', 'location_id')};", window)
+        cur.execute("""
+            WITH removed AS (
+              DELETE FROM star.fact_pricing fp
+               WHERE fp.product_sk  IN (SELECT product_sk  FROM star_gone_products)
+                  OR fp.location_sk IN (SELECT location_sk FROM star_gone_locations)
+              RETURNING fp.date_sk, fp.product_sk
+            ),
+            touched AS (
+              INSERT INTO star_touched (date_sk, product_sk)
+              SELECT DISTINCT r.date_sk, r.product_sk
+                FROM removed r
+               WHERE NOT EXISTS (SELECT 1 FROM star_touched t
+                                  WHERE t.date_sk = r.date_sk AND t.product_sk = r.product_sk)
+            )
+            SELECT COUNT(*) FROM removed;
+        """)
+        removed = cur.fetchone()[0]
+        cur.execute("DELETE FROM star.dim_product  WHERE product_sk  IN (SELECT product_sk  FROM star_gone_products);")
+        products = cur.rowcount
+        cur.execute("DELETE FROM star.dim_location WHERE location_sk IN (SELECT location_sk FROM star_gone_locations);")
+        print(f"  deleted at the source: {products:,} product(s), {cur.rowcount:,} location(s), "
+              f"{removed:,} fact row(s)")
+
+        # 9) AGG_PRICING: rebuild the slices of the fact rows just written or
+        #    deleted, in the same transaction as the fact changes
+        print(f"  agg_pricing: {refresh_agg_pricing(cur, 'star_touched'):,} rows rebuilt")
+
+        cur.execute("DROP TABLE star_changes, star_touched, star_gone_products, star_gone_locations;")
+        finish_run(cur, run_etl_id)
         conn.commit()
 
         print("✔ Incremental load into star.schema completed.")
@@ -130,10 +255,13 @@ def incremental_load_star():
         print("ERROR during incremental load into star.schema:", e)
         if conn:
             conn.rollback()
+            if run_etl_id is not None:
+                finish_run(conn.cursor(), run_etl_id, 'failed')
+                conn.commit()
 
     finally:
         if conn:
-            conn.close()
+            release_connection(conn)
 
 if __name__ == "__main__":
     incremental_load_star()
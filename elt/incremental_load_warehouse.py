@@ -1,412 +1,355 @@
 # etl_scripts/incremental_load_warehouse.py
 
-import psycopg2
+import argparse
+import time
 from datetime import datetime
-from config.settings import DB_CONFIG
-
-def get_next_etl_id(cur):
+from config.connection import connection, get_connection, release_connection
+from config.scheduler import StagesFailed, run_stages
+from elt import change_log
+from elt.etl_runs import finish_run, last_watermark, set_watermark, start_run
+from elt.migrations import require_migrated
+from elt.partitions import ensure_partitions
+from elt.scd2 import (
+    Lookup, SCD2Table, build_keymaps, build_scopes, dependency_order, merge_scd2, plan_scd2, scope_name,
+    stage_deps, stream_merge_scd2
+)
+
+DEFAULT_WORKERS = 4
+DEFAULT_BATCH_SIZE = 10000
+
+# ------------------------------------------------------------------------------
+# One SCD2 spec per warehouse table, in dependency order (parents first, so
+# that the lookups see this run's new versions).
+# ------------------------------------------------------------------------------
+CATEGORY_SK = Lookup('category_sk', 'warehouse.categories', 'categories_sk', 'category_id', 'category_id')
+PRODUCT_SK  = Lookup('product_sk',  'warehouse.products',   'products_sk',   'product_id',  'product_id')
+USER_SK     = Lookup('user_sk',     'warehouse.users',      'users_sk',      'user_id',     'user_id')
+
+WAREHOUSE_TABLES = (
+    SCD2Table(
+        name='categories', table='warehouse.categories', sk='categories_sk',
+        source='public.categories', change_log='categories',
+        key=('category_id',), tracked=('category_name',),
+    ),
+    SCD2Table(
+        name='users', table='warehouse.users', sk='users_sk',
+        source='public.users', change_log='users',
+        key=('user_id',), tracked=('user_name',),
+    ),
+    SCD2Table(
+        name='products', table='warehouse.products', sk='products_sk',
+        source='public.products', change_log='products',
+        key=('product_id',),
+        tracked=('product_name', 'category_sk', 'discounted_price', 'actual_price',
+                 'discount_percentage', 'rating', 'rating_count', 'about_product',
+                 'product_link', 'currency'),
+        lookups=(CATEGORY_SK,),
+    ),
+    SCD2Table(
+        name='reviews', table='warehouse.reviews', sk='reviews_sk',
+        source='public.reviews', change_log='reviews',
+        key=('review_id',), tracked=('product_sk', 'user_sk', 'review_title', 'review_content'),
+        lookups=(PRODUCT_SK, USER_SK),
+    ),
+    SCD2Table(
+        name='locations', table='warehouse.locations', sk='locations_sk',
+        source='public.locations', change_log='locations',
+        key=('location_id',), tracked=('product_sk', 'country', 'city'),
+        lookups=(PRODUCT_SK,),
+    ),
+    # Latest rate per currency pair; joined to products only in the star fact
+    SCD2Table(
+        name='exchange_rates', table='warehouse.exchange_rates', sk='exchange_rates_sk',
+        source="""(
+            SELECT DISTINCT ON (base_currency, target_currency)
+                   base_currency, target_currency, fetched_at, rate AS rate_to_base
+              FROM staging.exchange_rates_raw
+             ORDER BY base_currency, target_currency, fetched_at DESC
+        )""",
+        key=('base_currency', 'target_currency'), tracked=('fetched_at', 'rate_to_base'),
+        source_id=2,
+    ),
+)
+
+
+def merge_stage(spec, load_ts, run_etl_id, keymap, results, streaming=False,
+                batch_size=DEFAULT_BATCH_SIZE, scope=None):
+    """One table's merge on its own pooled connection, committed on success."""
+    def run():
+        with connection(f"incremental_load_warehouse:{spec.name}") as conn:
+            cur = conn.cursor()
+            if streaming:
+                results[spec.name] = stream_merge_scd2(cur, spec, load_ts, run_etl_id, keymap=keymap,
+                                                       batch_size=batch_size, scope=scope)
+            else:
+                results[spec.name] = merge_scd2(cur, spec, load_ts, run_etl_id,
+                                                keymap=keymap, scope=scope)
+            conn.commit()
+            cur.close()
+    return run
+
+
+def change_scopes(cur, run_etl_id, full_diff=False):
     """
-    Ensure a sequence 'warehouse.etl_seq' exists and return the next value.
-    Accounts for both insert_id AND update_id, so that the sequence
-    always increments beyond any previously used ID.
+    Claim the pending staging.change_log entries for this run and return
+    {table name: scope query}. Returns None (diff everything) when change
+    capture is not installed, with `full_diff`, when no earlier run consumed
+    the log (the warehouse may not match the source yet), or when a TRUNCATE
+    was logged. Tables build_scopes can't scope (exchange_rates, which is
+    a handful of currency pairs) map to None and are diffed in full.
+
+    With `run_etl_id` None (the --plan dry run) nothing is claimed: the
+    unclaimed entries are only read, and the scopes are temp tables.
     """
-    cur.execute("CREATE SEQUENCE IF NOT EXISTS warehouse.etl_seq START WITH 1;")
-    cur.execute("""
-        SELECT GREATEST(
-          COALESCE((SELECT MAX(insert_id)   FROM warehouse.categories), 0),
-          COALESCE((SELECT MAX(update_id)   FROM warehouse.categories), 0),
-          COALESCE((SELECT MAX(insert_id)   FROM warehouse.users),      0),
-          COALESCE((SELECT MAX(update_id)   FROM warehouse.users),      0),
-          COALESCE((SELECT MAX(insert_id)   FROM warehouse.products),   0),
-          COALESCE((SELECT MAX(update_id)   FROM warehouse.products),   0),
-          COALESCE((SELECT MAX(insert_id)   FROM warehouse.reviews),    0),
-          COALESCE((SELECT MAX(update_id)   FROM warehouse.reviews),    0),
-          COALESCE((SELECT MAX(insert_id)   FROM warehouse.locations),  0),
-          COALESCE((SELECT MAX(update_id)   FROM warehouse.locations),  0),
-          COALESCE((SELECT MAX(insert_id)   FROM warehouse.exchange_rates), 0),
-          COALESCE((SELECT MAX(update_id)   FROM warehouse.exchange_rates), 0)
-        );
-    """)
-    max_id = cur.fetchone()[0] or 0
-    next_id = max_id + 1
-    # Advance the sequence so nextval returns next_id
-    cur.execute("SELECT setval('warehouse.etl_seq', %s, false);", (next_id,))
-    cur.execute("SELECT nextval('warehouse.etl_seq');")
-    return cur.fetchone()[0]
-
-
-def process_table_categories(cur, load_ts, run_etl_id):
-    # Fetch current
-    cur.execute("""
-        SELECT categories_sk, category_id, category_name
-          FROM warehouse.categories
-         WHERE end_date = '9999-12-31';
-    """)
-    wh = {row[1]:(row[0],row[2]) for row in cur.fetchall()}
-
-    # Fetch source
-    cur.execute("SELECT category_id, category_name FROM public.categories;")
-    src = {row[0]:row[1] for row in cur.fetchall()}
-
-    # INSERT new
-    for cid, cname in src.items():
-        if cid not in wh:
-            cur.execute("""
-                INSERT INTO warehouse.categories
-                  (category_id, category_name, start_date, source_id, insert_id, update_id)
-                VALUES (%s,%s,%s,1,%s,NULL);
-            """, (cid,cname,load_ts,run_etl_id))
-
-    # UPDATE changed
-    for cid, cname in src.items():
-        if cid in wh and wh[cid][1] != cname:
-            sk,_ = wh[cid]
-            cur.execute("""
-                UPDATE warehouse.categories
-                   SET end_date=%s, update_id=%s
-                 WHERE categories_sk=%s AND end_date='9999-12-31';
-            """, (load_ts,run_etl_id,sk))
-            cur.execute("""
-                INSERT INTO warehouse.categories
-                  (category_id, category_name, start_date, source_id, insert_id, update_id)
-                VALUES (%s,%s,%s,1,%s,NULL);
-            """, (cid,cname,load_ts,run_etl_id))
-
-    # DELETEd
-    for cid,(sk,_) in wh.items():
-        if cid not in src:
-            cur.execute("""
-                UPDATE warehouse.categories
-                   SET end_date=%s, update_id=%s
-                 WHERE categories_sk=%s AND end_date='9999-12-31';
-            """, (load_ts,run_etl_id,sk))
-
-
-def process_table_users(cur, load_ts, run_etl_id):
-    cur.execute("""
-        SELECT users_sk, user_id, user_name
-          FROM warehouse.users
-         WHERE end_date = '9999-12-31';
-    """)
-    wh = {row[1]:(row[0],row[2]) for row in cur.fetchall()}
-
-    cur.execute("SELECT user_id, user_name FROM public.users;")
-    src = {row[0]:row[1] for row in cur.fetchall()}
-
-    for uid,uname in src.items():
-        if uid not in wh:
-            cur.execute("""
-                INSERT INTO warehouse.users
-                  (user_id,user_name,start_date,source_id,insert_id,update_id)
-                VALUES (%s,%s,%s,1,%s,NULL);
-            """,(uid,uname,load_ts,run_etl_id))
-
-    for uid,uname in src.items():
-        if uid in wh and wh[uid][1]!=uname:
-            sk,_=wh[uid]
-            cur.execute("""
-                UPDATE warehouse.users
-                   SET end_date=%s, update_id=%s
-                 WHERE users_sk=%s AND end_date='9999-12-31';
-            """,(load_ts,run_etl_id,sk))
-            cur.execute("""
-                INSERT INTO warehouse.users
-                  (user_id,user_name,start_date,source_id,insert_id,update_id)
-                VALUES (%s,%s,%s,1,%s,NULL);
-            """,(uid,uname,load_ts,run_etl_id))
-
-    for uid,(sk,_) in wh.items():
-        if uid not in src:
-            cur.execute("""
-                UPDATE warehouse.users
-                   SET end_date=%s, update_id=%s
-                 WHERE users_sk=%s AND end_date='9999-12-31';
-            """,(load_ts,run_etl_id,sk))
-
-
-def process_table_products(cur, load_ts, run_etl_id):
-    cur.execute("""
-        SELECT p.products_sk, p.product_id, p.product_name, p.category_sk,
-               p.discounted_price, p.actual_price, p.discount_percentage,
-               p.rating, p.rating_count, p.about_product, p.product_link, p.currency
-          FROM warehouse.products p
-         WHERE p.end_date = '9999-12-31';
-    """)
-    wh = {r[1]:{
-        'sk':r[0],'product_name':r[2],'category_sk':r[3],
-        'discounted_price':r[4],'actual_price':r[5],
-        'discount_percentage':r[6],'rating':r[7],
-        'rating_count':r[8],'about_product':r[9],
-        'product_link':r[10],'currency':r[11]
-    } for r in cur.fetchall()}
-
-    cur.execute("""
-        SELECT product_id,product_name,category_id,
-               discounted_price,actual_price,discount_percentage,
-               rating,rating_count,about_product,product_link,currency
-          FROM public.products;
-    """)
-    src = {r[0]:r[1:] for r in cur.fetchall()}
-
-    for pid,vals in src.items():
-        pname,cat_id,dp,ap,d_pct,r_cnt_r,rc,about,link,curr = vals
-        # lookup category_sk
+    if not change_log.is_installed(cur):
+        return None
+    previous = last_watermark(cur, 'change_log')
+    if run_etl_id is None:
         cur.execute("""
-            SELECT categories_sk
-              FROM warehouse.categories
-             WHERE category_id=%s AND end_date='9999-12-31';
-        """,(cat_id,))
-        row=cur.fetchone()
-        if not row: continue
-        category_sk=row[0]
-
-        if pid not in wh:
-            cur.execute("""
-                INSERT INTO warehouse.products
-                  (product_id,product_name,category_sk,
-                   discounted_price,actual_price,discount_percentage,
-                   rating,rating_count,about_product,product_link,currency,
-                   start_date,source_id,insert_id,update_id)
-                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,1,%s,NULL);
-            """,(pid,pname,category_sk,dp,ap,d_pct,r_cnt_r,rc,about,link,curr,load_ts,run_etl_id))
-        else:
-            old=wh[pid]
-            if (
-                old['product_name']!=pname or
-                old['category_sk']!=category_sk or
-                old['discounted_price']!=dp or
-                old['actual_price']!=ap or
-                old['discount_percentage']!=d_pct or
-                old['rating']!=r_cnt_r or
-                old['rating_count']!=rc or
-                old['about_product']!=about or
-                old['product_link']!=link or
-                old['currency']!=curr
-            ):
-                sk=old['sk']
-                cur.execute("""
-                    UPDATE warehouse.products
-                       SET end_date=%s, update_id=%s
-                     WHERE products_sk=%s AND end_date='9999-12-31';
-                """,(load_ts,run_etl_id,sk))
-                cur.execute("""
-                    INSERT INTO warehouse.products
-                      (product_id,product_name,category_sk,
-                       discounted_price,actual_price,discount_percentage,
-                       rating,rating_count,about_product,product_link,currency,
-                       start_date,source_id,insert_id,update_id)
-                    VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,1,%s,NULL);
-                """,(pid,pname,category_sk,dp,ap,d_pct,r_cnt_r,rc,about,link,curr,load_ts,run_etl_id))
-
-    for pid,old in wh.items():
-        if pid not in src:
-            cur.execute("""
-                UPDATE warehouse.products
-                   SET end_date=%s, update_id=%s
-                 WHERE products_sk=%s AND end_date='9999-12-31';
-            """,(load_ts,run_etl_id,old['sk']))
-
-
-def process_table_reviews(cur, load_ts, run_etl_id):
-    cur.execute("""
-        SELECT reviews_sk, review_id, product_sk, user_sk, review_title, review_content
-          FROM warehouse.reviews
-         WHERE end_date='9999-12-31';
-    """)
-    wh = {r[1]:{'sk':r[0],'product_sk':r[2],'user_sk':r[3],'review_title':r[4],'review_content':r[5]}
-          for r in cur.fetchall()}
-
-    cur.execute("SELECT review_id,product_id,user_id,review_title,review_content FROM public.reviews;")
-    src = {r[0]:(r[1],r[2],r[3],r[4]) for r in cur.fetchall()}
-
-    for rid,(prod_id,usr_id,title,content) in src.items():
-        # lookup product_sk
-        cur.execute("SELECT products_sk FROM warehouse.products WHERE product_id=%s AND end_date='9999-12-31';",(prod_id,))
-        prow=cur.fetchone();
-        if not prow: continue
-        product_sk=prow[0]
-        # lookup user_sk
-        cur.execute("SELECT users_sk FROM warehouse.users WHERE user_id=%s AND end_date='9999-12-31';",(usr_id,))
-        urow=cur.fetchone();
-        if not urow: continue
-        user_sk=urow[0]
-
-        if rid not in wh:
-            cur.execute("""
-                INSERT INTO warehouse.reviews
-                  (review_id,product_sk,user_sk,review_title,review_content,
-                   start_date,source_id,insert_id,update_id)
-                VALUES (%s,%s,%s,%s,%s,%s,1,%s,NULL);
-            """,(rid,product_sk,user_sk,title,content,load_ts,run_etl_id))
-        else:
-            old=wh[rid]
-            if (
-                old['product_sk']!=product_sk or
-                old['user_sk']!=user_sk or
-                old['review_title']!=title or
-                old['review_content']!=content
-            ):
-                sk=old['sk']
-                cur.execute("""
-                    UPDATE warehouse.reviews
-                       SET end_date=%s, update_id=%s
-                     WHERE reviews_sk=%s AND end_date='9999-12-31';
-                """,(load_ts,run_etl_id,sk))
-                cur.execute("""
-                    INSERT INTO warehouse.reviews
-                      (review_id,product_sk,user_sk,review_title,review_content,
-                       start_date,source_id,insert_id,update_id)
-                    VALUES (%s,%s,%s,%s,%s,%s,1,%s,NULL);
-                """,(rid,product_sk,user_sk,title,content,load_ts,run_etl_id))
-
-    for rid,old in wh.items():
-        if rid not in src:
-            cur.execute("""
-                UPDATE warehouse.reviews
-                   SET end_date=%s, update_id=%s
-                 WHERE reviews_sk=%s AND end_date='9999-12-31';
-            """,(load_ts,run_etl_id,old['sk']))
-
-
-def process_table_locations(cur, load_ts, run_etl_id):
-    cur.execute("""
-        SELECT locations_sk, location_id, product_sk, country, city
-          FROM warehouse.locations
-         WHERE end_date='9999-12-31';
-    """)
-    wh = {r[1]:{'sk':r[0],'product_sk':r[2],'country':r[3],'city':r[4]}
-          for r in cur.fetchall()}
-
-    cur.execute("SELECT location_id,product_id,country,city FROM public.locations;")
-    src = {r[0]:(r[1],r[2],r[3]) for r in cur.fetchall()}
-
-    for lid,(prod_id,country,city) in src.items():
-        cur.execute("SELECT products_sk FROM warehouse.products WHERE product_id=%s AND end_date='9999-12-31';",(prod_id,))
-        prow=cur.fetchone();
-        if not prow: continue
-        product_sk=prow[0]
-
-        if lid not in wh:
-            cur.execute("""
-                INSERT INTO warehouse.locations
-                  (location_id,product_sk,country,city,start_date,source_id,insert_id,update_id)
-                VALUES (%s,%s,%s,%s,%s,1,%s,NULL);
-            """,(lid,product_sk,country,city,load_ts,run_etl_id))
-        else:
-            old=wh[lid]
-            if (
-                old['product_sk']!=product_sk or
-                old['country']!=country or
-                old['city']!=city
-            ):
-                sk=old['sk']
-                cur.execute("""
-                    UPDATE warehouse.locations
-                       SET end_date=%s, update_id=%s
-                     WHERE locations_sk=%s AND end_date='9999-12-31';
-                """,(load_ts,run_etl_id,sk))
-                cur.execute("""
-                    INSERT INTO warehouse.locations
-                      (location_id,product_sk,country,city,start_date,source_id,insert_id,update_id)
-                    VALUES (%s,%s,%s,%s,%s,1,%s,NULL);
-                """,(lid,product_sk,country,city,load_ts,run_etl_id))
-
-    for lid,old in wh.items():
-        if lid not in src:
-            cur.execute("""
-                UPDATE warehouse.locations
-                   SET end_date=%s, update_id=%s
-                 WHERE locations_sk=%s AND end_date='9999-12-31';
-            """,(load_ts,run_etl_id,old['sk']))
-
-
-def process_table_exchange_rates(cur, load_ts, run_etl_id):
-    cur.execute("""
-        SELECT p.product_id, s.fetched_at, s.rate
-          FROM (
-                SELECT target_currency, MAX(fetched_at) AS max_fetched
-                  FROM staging.exchange_rates_raw
-                 WHERE base_currency='USD'
-                 GROUP BY target_currency
-               ) AS latest
-          JOIN staging.exchange_rates_raw s
-            ON s.target_currency=latest.target_currency
-           AND s.fetched_at=latest.max_fetched
-          JOIN public.products p
-            ON s.target_currency=p.currency;
-    """)
-    src={r[0]:(r[1],r[2]) for r in cur.fetchall()}
-
-    cur.execute("""
-        SELECT exchange_rates_sk, product_sk, fetched_at, rate_to_base
-          FROM warehouse.exchange_rates
-         WHERE end_date='9999-12-31';
-    """)
-    wh={r[1]:(r[0],r[2],r[3]) for r in cur.fetchall()}
-
-    for prod_id,(fetched_at,rate) in src.items():
-        cur.execute("SELECT products_sk FROM warehouse.products WHERE product_id=%s AND end_date='9999-12-31';",(prod_id,))
-        prow=cur.fetchone();
-        if not prow: continue
-        product_sk=prow[0]
-
-        if product_sk not in wh:
-            cur.execute("""
-                INSERT INTO warehouse.exchange_rates
-                  (product_sk,fetched_at,rate_to_base,start_date,source_id,insert_id,update_id)
-                VALUES (%s,%s,%s,%s,2,%s,NULL);
-            """,(product_sk,fetched_at,rate,load_ts,run_etl_id))
-        else:
-            old_sk,old_fetched,old_rate=wh[product_sk]
-            if old_fetched!=fetched_at or old_rate!=rate:
-                cur.execute("""
-                    UPDATE warehouse.exchange_rates
-                       SET end_date=%s, update_id=%s
-                     WHERE exchange_rates_sk=%s AND end_date='9999-12-31';
-                """,(load_ts,run_etl_id,old_sk))
-                cur.execute("""
-                    INSERT INTO warehouse.exchange_rates
-                      (product_sk,fetched_at,rate_to_base,start_date,source_id,insert_id,update_id)
-                    VALUES (%s,%s,%s,%s,2,%s,NULL);
-                """,(product_sk,fetched_at,rate,load_ts,run_etl_id))
-
-    for product_sk,(old_sk,_,_) in wh.items():
-        cur.execute("SELECT product_id FROM warehouse.products WHERE products_sk=%s;",(product_sk,))
-        prod_id=cur.fetchone()[0]
-        if prod_id not in src:
-            cur.execute("""
-                UPDATE warehouse.exchange_rates
-                   SET end_date=%s, update_id=%s
-                 WHERE exchange_rates_sk=%s AND end_date='9999-12-31';
-            """,(load_ts,run_etl_id,old_sk))
-
-
-def incremental_load_warehouse():
-    conn = psycopg2.connect(**DB_CONFIG)
+            SELECT count(*), bool_or(row_key IS NULL)
+              FROM staging.change_log
+             WHERE etl_id IS NULL;
+        """)
+        entries, truncated = cur.fetchone()
+        verb = "pending"
+    else:
+        entries, highest, truncated = change_log.claim(cur, run_etl_id)
+        set_watermark(cur, run_etl_id, 'change_log', highest if highest is not None else int(previous or 0))
+        verb = "claimed"
+    if full_diff or previous is None or truncated:
+        reason = ("--full-diff" if full_diff else
+                  "first run on the change log" if previous is None else "a TRUNCATE was logged")
+        print(f"  change log: {entries:,} entries {verb}, diffing everything ({reason})")
+        return None
+
+    sizes = build_scopes(cur, WAREHOUSE_TABLES, run_etl_id)
+    plan = run_etl_id is None
+    scopes = {
+        spec.name: f"SELECT k FROM {scope_name(spec.table, plan)}" if sizes[spec.name] is not None else None
+        for spec in WAREHOUSE_TABLES
+    }
+    print(f"  change log: {entries:,} entries {verb}, applying changed keys only")
+    print("  scopes: " + ", ".join(
+        f"{spec.name} {'all' if sizes[spec.name] is None else f'{sizes[spec.name]:,}'}" for spec in WAREHOUSE_TABLES
+    ))
+    return scopes
+
+
+def plan_stages(cur, keymaps, scopes):
+    """
+    {table name: (changed, deleted, inserted, current rows)} for the run that
+    `scopes` describes, counted with plan_scd2 table by table on `cur`.
+    `keymaps` holds the tables other tables look surrogate keys up in.
+    Only temp tables are written.
+    """
+    planned = {}
+    plan = {
+        spec.name: plan_scd2(cur, spec, planned, keymap=spec.table in keymaps,
+                             scope=scopes and scopes[spec.name])
+        for spec in dependency_order(WAREHOUSE_TABLES)
+    }
+    for table in planned.values():
+        cur.execute(f"DROP TABLE {table};")
+    return plan
+
+
+def report_plan(plan, max_churn=None):
+    """
+    Print the plan and return the tables whose churn (current rows closed,
+    as a % of the current rows) is over their `max_churn` limit.
+    """
+    max_churn = max_churn or {}
+    over = []
+    print(f"  {'table':<15}{'new':>9}{'changed':>9}{'deleted':>9}{'rows written':>14}{'churn':>9}")
+    for spec in WAREHOUSE_TABLES:
+        changed, deleted, inserted, current = plan[spec.name]
+        churn = 100.0 * (changed + deleted) / current if current else 0.0
+        limit = max_churn.get(spec.name, max_churn.get('*'))
+        flag = ""
+        if limit is not None and churn > limit:
+            over.append(spec.name)
+            flag = f"  > {limit:g}% limit"
+        print(f"  {spec.name:<15}{inserted - changed:>9,}{changed:>9,}{deleted:>9,}"
+              f"{inserted + changed + deleted:>14,}{churn:>8.2f}%{flag}")
+    return over
+
+
+def plan_incremental_load_warehouse(full_diff=False, max_churn=None):
+    """
+    Dry run: work out what incremental_load_warehouse would write, print it
+    and roll everything back. Returns True when no table is over its
+    `max_churn` limit.
+
+    Read-only apart from temp tables: no run is registered, the change log
+    is read but not claimed, and the warehouse key maps and scope tables are
+    left alone, so a real run going on at the same time never waits on it.
+    """
+    conn = get_connection('incremental_load_warehouse:plan')
+    cur = conn.cursor()
     try:
-        cur = conn.cursor()
+        started = time.perf_counter()
+        require_migrated(cur)
+        lookup_targets = {l.table for spec in WAREHOUSE_TABLES for l in spec.lookups}
+        scopes = change_scopes(cur, None, full_diff)
+        over = report_plan(plan_stages(cur, lookup_targets, scopes), max_churn)
+        print(f"Plan computed in {time.perf_counter() - started:.2f}s; nothing was written.")
+        if over:
+            print("Churn over the limit in: " + ", ".join(over))
+        return not over
+    except Exception as e:
+        print("ERROR while planning the incremental warehouse load:", e)
+        return False
+    finally:
+        conn.rollback()
+        cur.close()
+        release_connection(conn)
 
-        # 1) Capture timestamp
-        load_ts = datetime.utcnow()
 
-        # 2) Reserve one ETL ID for all inserts/updates this run
-        run_etl_id = get_next_etl_id(cur)
+def incremental_load_warehouse(workers=DEFAULT_WORKERS, streaming=False, batch_size=DEFAULT_BATCH_SIZE,
+                               full_diff=False, max_churn=None):
+    """
+    Merge every warehouse table from its source under one run_etl_id/load_ts.
+
+    Tables run as a dependency graph (a table waits for the tables it looks
+    surrogate keys up in) on up to `workers` pooled connections. Each table
+    commits on its own. If one fails, the tables depending on it are skipped,
+    the independent ones still finish, and the run is marked 'failed'.
+
+    With `streaming`, each table is diffed as a sorted merge over server-side
+    cursors and written `batch_size` rows at a time (stream_merge_scd2)
+    instead of with three set-based statements.
 
-        # 3) Apply each table’s logic with the same run_etl_id
-        process_table_categories(cur, load_ts, run_etl_id); conn.commit()
-        process_table_users(cur, load_ts, run_etl_id);      conn.commit()
-        process_table_products(cur, load_ts, run_etl_id);   conn.commit()
-        process_table_reviews(cur, load_ts, run_etl_id);    conn.commit()
-        process_table_locations(cur, load_ts, run_etl_id);  conn.commit()
-        process_table_exchange_rates(cur, load_ts, run_etl_id); conn.commit()
+    When change capture is installed (elt/change_log.py) only the keys logged
+    since the last run, and the rows depending on them, are diffed, unless
+    `full_diff` is set.
 
-        print("Incremental load completed successfully.")
+    With `max_churn` ({table name or '*': %}), the run is planned first and
+    aborted before any table is touched if a table would close more than
+    that share of its current rows. Returns True if the run succeeded.
+    """
+    conn = get_connection('incremental_load_warehouse')
+    cur = conn.cursor()
+    run_etl_id = None
+    try:
+        # 1) Capture timestamp
+        load_ts = datetime.utcnow()
+
+        # 2) Register the run; its etl_id is the insert_id/update_id for all of it
+        run_etl_id = start_run(cur, 'incremental_load_warehouse')
+        conn.commit()
+
+        # 3) Load the natural key → SK maps of every parent table once
+        keymaps = build_keymaps(cur, WAREHOUSE_TABLES)
+        conn.commit()
+        print("  key maps: " + ", ".join(f"{t} {n:,}" for t, n in keymaps.items()))
+
+        # 4) Decide what to diff: the changed keys from the change log, or everything
+        cur.execute("SELECT MAX(fetched_at) FROM staging.exchange_rates_raw;")
+        set_watermark(cur, run_etl_id, 'exchange_rates', cur.fetchone()[0])
+        scopes = change_scopes(cur, run_etl_id, full_diff)
+        conn.commit()
+
+        #    Optionally refuse to run when the plan churns too much
+        if max_churn:
+            over = report_plan(plan_stages(cur, keymaps, scopes), max_churn)
+            if over:
+                raise RuntimeError(f"churn over the --max-churn limit in {', '.join(over)}; nothing was merged")
+
+        # 5) Merge the tables, independent ones in parallel
+        #    (into monthly partitions created ahead of load_ts, if enabled)
+        ensure_partitions(cur, load_ts)
+        conn.commit()
+        results = {}
+        stages = {
+            spec.name: merge_stage(spec, load_ts, run_etl_id, spec.table in keymaps, results,
+                                   streaming=streaming, batch_size=batch_size,
+                                   scope=scopes and scopes[spec.name])
+            for spec in WAREHOUSE_TABLES
+        }
+        started = time.perf_counter()
+        try:
+            timings = run_stages(stages, stage_deps(WAREHOUSE_TABLES),
+                                 max_workers=workers, keep_going=True)
+            failure = None
+        except StagesFailed as e:
+            timings, failure = e.timings, e
+        elapsed = time.perf_counter() - started
+
+        resolved = 0
+        for spec in WAREHOUSE_TABLES:
+            if spec.name in results:
+                changed, deleted, inserted, lookups = results[spec.name]
+                resolved += lookups
+                print(f"  {spec.name:<15}{changed:>8,} changed{deleted:>8,} deleted"
+                      f"{inserted:>8,} new versions{timings[spec.name]:>8.2f}s")
+            elif failure and spec.name in failure.errors:
+                print(f"  {spec.name:<15}FAILED: {failure.errors[spec.name]}")
+            else:
+                print(f"  {spec.name:<15}skipped")
+        print(f"  {resolved:,} surrogate-key lookups resolved from key maps (no per-row queries)")
+        print(f"  {len(timings)} stage(s) in {elapsed:.2f}s wall clock "
+              f"({sum(timings.values()):.2f}s of stage time, {workers} worker(s))")
+        if failure:
+            raise failure
+
+        # 6) Drop the consumed change-log entries and close the run
+        if change_log.is_installed(cur):
+            change_log.purge(cur, run_etl_id)
+        finish_run(cur, run_etl_id)
+        conn.commit()
+
+        print(f"Incremental load completed successfully. (etl_id = {run_etl_id})")
+        return True
     except Exception as e:
         conn.rollback()
         print("ERROR during incremental warehouse load:", e)
+        if run_etl_id is not None:
+            if change_log.is_installed(cur):
+                change_log.release(cur, run_etl_id)
+            finish_run(cur, run_etl_id, 'failed')
+            conn.commit()
+        return False
     finally:
         cur.close()
-        conn.close()
+        release_connection(conn)
+
+
+def churn_limit(value):
+    """'products=5' → ('products', 5.0); '5' → ('*', 5.0)"""
+    name, _, pct = value.rpartition('=')
+    if name and name not in {spec.name for spec in WAREHOUSE_TABLES}:
+        raise argparse.ArgumentTypeError(f"unknown table {name!r}")
+    try:
+        return name or '*', float(pct)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a percentage: {pct!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental SCD2 load of the warehouse schema")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="tables merged concurrently, each on its own pooled connection")
+    parser.add_argument('--streaming', action='store_true',
+                        help="diff each table as a sorted merge over server-side cursors")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="rows fetched and written per batch in --streaming mode")
+    parser.add_argument('--full-diff', action='store_true',
+                        help="diff every row even when change capture is installed")
+    parser.add_argument('--plan', action='store_true',
+                        help="only count what the run would insert, change and delete, then roll back")
+    parser.add_argument('--max-churn', action='append', type=churn_limit, metavar='[TABLE=]PCT',
+                        help="fail (before merging anything) if a table would close more than PCT%% of its "
+                             "current rows; without TABLE= it applies to every table. Repeatable.")
+    args = parser.parse_args()
+    max_churn = dict(args.max_churn or ())
+    if args.plan:
+        ok = plan_incremental_load_warehouse(full_diff=args.full_diff, max_churn=max_churn)
+    else:
+        ok = incremental_load_warehouse(workers=args.workers, streaming=args.streaming,
+                                        batch_size=args.batch_size, full_diff=args.full_diff,
+                                        max_churn=max_churn)
+    raise SystemExit(0 if ok else 1)
+
 
 if __name__ == "__main__":
-    incremental_load_warehouse()
+    main()
@@ -0,0 +1,464 @@
+# elt/migrations.py
+
+import argparse
+
+from config.connection import get_connection, release_connection
+
+# (id, description, statements), applied in order and recorded in
+# warehouse.schema_migrations. Never edit a migration that has shipped;
+# add a new one instead.
+MIGRATIONS = [
+    (
+        '001_current_row_indexes',
+        "partial unique indexes on the current row of every natural key, "
+        "covering the SK-resolution joins",
+        [
+            # natural key → SK of the current row: the lookups in
+            # full_load_warehouse, the key maps and the star dimensions
+            # (exchange_rates gets its own in 002, on its currency-pair key)
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_categories_current
+                ON warehouse.categories (category_id) INCLUDE (categories_sk)
+             WHERE end_date = '9999-12-31';
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_users_current
+                ON warehouse.users (user_id) INCLUDE (users_sk)
+             WHERE end_date = '9999-12-31';
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_products_current
+                ON warehouse.products (product_id) INCLUDE (products_sk, category_sk)
+             WHERE end_date = '9999-12-31';
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_reviews_current
+                ON warehouse.reviews (review_id) INCLUDE (reviews_sk)
+             WHERE end_date = '9999-12-31';
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_locations_current
+                ON warehouse.locations (location_id) INCLUDE (locations_sk, product_sk)
+             WHERE end_date = '9999-12-31';
+            """,
+            # SK → current child rows: the star fact join on locations and the
+            # change-log scopes that follow a product to its reviews/locations
+            """
+            CREATE INDEX IF NOT EXISTS idx_locations_product_current
+                ON warehouse.locations (product_sk) INCLUDE (location_id)
+             WHERE end_date = '9999-12-31';
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_reviews_product_current
+                ON warehouse.reviews (product_sk) INCLUDE (review_id)
+             WHERE end_date = '9999-12-31';
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_products_category_current
+                ON warehouse.products (category_sk) INCLUDE (product_id)
+             WHERE end_date = '9999-12-31';
+            """,
+        ],
+    ),
+    (
+        '002_exchange_rates_currency_grain',
+        "warehouse.exchange_rates keyed by (base_currency, target_currency) "
+        "instead of one row per product",
+        [
+            # products.currency is varchar(10) but the rate key is character(3),
+            # which would silently truncate a longer code and merge two series
+            """
+            DO $$
+            DECLARE
+              bad text;
+            BEGIN
+              SELECT string_agg(DISTINCT quote_literal(wp.currency), ', ') INTO bad
+                FROM warehouse.exchange_rates er
+                JOIN warehouse.products wp
+                  ON wp.products_sk = er.product_sk
+               WHERE length(wp.currency) <> 3;
+              IF bad IS NOT NULL THEN
+                RAISE EXCEPTION 'exchange rates held for currencies that are not 3-letter codes: %; '
+                                'correct warehouse.products.currency before migrating', bad;
+              END IF;
+            END
+            $$;
+            """,
+            # every product-grain row becomes its currency's rate version:
+            # rows sharing currency, fetched_at and rate collapse into one,
+            # current if any of them was; an older fetch left current next to
+            # a newer one is closed when the newer one starts
+            """
+            CREATE TEMP TABLE exchange_rate_versions ON COMMIT DROP AS
+            SELECT v.*,
+                   CASE WHEN v.end_date = '9999-12-31'
+                         AND v.fetched_at < MAX(v.fetched_at) FILTER (WHERE v.end_date = '9999-12-31')
+                                              OVER (PARTITION BY v.target_currency)
+                        THEN MAX(v.start_date) FILTER (WHERE v.end_date = '9999-12-31')
+                                              OVER (PARTITION BY v.target_currency)
+                        ELSE v.end_date
+                   END AS closed_at
+              FROM (
+                    SELECT 'USD'::character(3)       AS base_currency,
+                           wp.currency::character(3) AS target_currency,
+                           er.fetched_at,
+                           er.rate_to_base,
+                           MIN(er.start_date) AS start_date,
+                           MAX(er.end_date)   AS end_date,
+                           MIN(er.source_id)  AS source_id,
+                           MIN(er.insert_id)  AS insert_id,
+                           MAX(er.update_id)  AS update_id
+                      FROM warehouse.exchange_rates er
+                      JOIN warehouse.products wp
+                        ON wp.products_sk = er.product_sk
+                     WHERE wp.currency IS NOT NULL
+                     GROUP BY wp.currency, er.fetched_at, er.rate_to_base
+                   ) AS v;
+            """,
+            "TRUNCATE warehouse.exchange_rates;",
+            # dropping product_sk also drops its foreign key and any index on it
+            """
+            ALTER TABLE warehouse.exchange_rates
+              DROP COLUMN product_sk,
+              ADD COLUMN base_currency   character(3) NOT NULL,
+              ADD COLUMN target_currency character(3) NOT NULL;
+            """,
+            """
+            INSERT INTO warehouse.exchange_rates
+              (base_currency, target_currency, fetched_at, rate_to_base,
+               start_date, end_date, source_id, insert_id, update_id)
+            SELECT base_currency, target_currency, fetched_at, rate_to_base,
+                   start_date, closed_at, source_id, insert_id,
+                   CASE WHEN closed_at = '9999-12-31' THEN NULL ELSE update_id END
+              FROM exchange_rate_versions
+             ORDER BY target_currency, start_date;
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_exchange_rates_natural
+                ON warehouse.exchange_rates (base_currency, target_currency);
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS ux_exchange_rates_current
+                ON warehouse.exchange_rates (base_currency, target_currency) INCLUDE (rate_to_base, start_date)
+             WHERE end_date = '9999-12-31';
+            """,
+        ],
+    ),
+    (
+        '003_fact_pricing_full_date',
+        "star.fact_pricing carries its date, so it can be range-partitioned "
+        "and date filters need no dim_date join",
+        [
+            "ALTER TABLE star.fact_pricing ADD COLUMN full_date date;",
+            """
+            UPDATE star.fact_pricing fp
+               SET full_date = dd.full_date
+              FROM star.dim_date dd
+             WHERE dd.date_sk = fp.date_sk;
+            """,
+            "ALTER TABLE star.fact_pricing ALTER COLUMN full_date SET NOT NULL;",
+        ],
+    ),
+    (
+        '004_fact_pricing_grain',
+        "one star.fact_pricing row per (date_sk, product_sk, location_sk), "
+        "so incremental_load_star can upsert",
+        [
+            # keep the newest row of any duplicate the old NOT EXISTS check let through
+            """
+            DELETE FROM star.fact_pricing fp
+             USING star.fact_pricing newer
+             WHERE newer.date_sk     = fp.date_sk
+               AND newer.product_sk  = fp.product_sk
+               AND newer.location_sk = fp.location_sk
+               AND newer.pricing_sk  > fp.pricing_sk;
+            """,
+            # a partitioned fact (elt/partitions.py) needs its partition key in
+            # the key too; full_date follows from date_sk, so the grain is the same
+            """
+            DO $$
+            BEGIN
+              IF (SELECT relkind FROM pg_class WHERE oid = 'star.fact_pricing'::regclass) = 'p' THEN
+                ALTER TABLE star.fact_pricing ADD CONSTRAINT fact_pricing_grain
+                  UNIQUE (date_sk, product_sk, location_sk, full_date);
+              ELSE
+                ALTER TABLE star.fact_pricing ADD CONSTRAINT fact_pricing_grain
+                  UNIQUE (date_sk, product_sk, location_sk);
+              END IF;
+            END
+            $$;
+            """,
+        ],
+    ),
+    (
+        '005_current_rows_by_insert_id',
+        "current warehouse versions by the run that inserted them, for the "
+        "watermark-driven incremental_load_star",
+        [
+            """
+            CREATE INDEX IF NOT EXISTS idx_categories_insert_id_current
+                ON warehouse.categories (insert_id)
+             WHERE end_date = '9999-12-31';
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_products_insert_id_current
+                ON warehouse.products (insert_id)
+             WHERE end_date = '9999-12-31';
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_locations_insert_id_current
+                ON warehouse.locations (insert_id)
+             WHERE end_date = '9999-12-31';
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_exchange_rates_insert_id_current
+                ON warehouse.exchange_rates (insert_id)
+             WHERE end_date = '9999-12-31';
+            """,
+        ],
+    ),
+    (
+        '006_agg_pricing',
+        "star.agg_pricing: fact sums and counts by date, category, product, "
+        "country and city for the dashboard",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS star.agg_pricing (
+                date_sk                   integer NOT NULL,
+                full_date                 date    NOT NULL,
+                category_sk               integer,
+                product_sk                integer NOT NULL,
+                country                   character varying(100),
+                city                      character varying(100),
+                fact_rows                 integer NOT NULL,
+                actual_price_sum          numeric,
+                actual_price_count        integer NOT NULL,
+                discount_percentage_sum   numeric,
+                discount_percentage_count integer NOT NULL,
+                rate_to_base_sum          numeric,
+                rate_to_base_count        integer NOT NULL,
+                CONSTRAINT agg_pricing_grain
+                  UNIQUE NULLS NOT DISTINCT (date_sk, product_sk, category_sk, country, city)
+            );
+            """,
+            # date-range filters of the dashboard
+            """
+            CREATE INDEX IF NOT EXISTS idx_agg_pricing_full_date
+                ON star.agg_pricing (full_date);
+            """,
+            """
+            INSERT INTO star.agg_pricing
+              (date_sk, full_date, category_sk, product_sk, country, city,
+               fact_rows, actual_price_sum, actual_price_count,
+               discount_percentage_sum, discount_percentage_count,
+               rate_to_base_sum, rate_to_base_count)
+            SELECT fp.date_sk, fp.full_date, fp.category_sk, fp.product_sk, dl.country, dl.city,
+                   COUNT(*), SUM(fp.actual_price), COUNT(fp.actual_price),
+                   SUM(fp.discount_percentage), COUNT(fp.discount_percentage),
+                   SUM(fp.rate_to_base), COUNT(fp.rate_to_base)
+              FROM star.fact_pricing fp
+              JOIN star.dim_location dl
+                ON dl.location_sk = fp.location_sk
+             GROUP BY fp.date_sk, fp.full_date, fp.category_sk, fp.product_sk, dl.country, dl.city;
+            """,
+        ],
+    ),
+    (
+        '007_dim_date_yyyymmdd',
+        "star.dim_date.date_sk is the date as YYYYMMDD instead of a sequence, "
+        "so loaders compute it without a lookup",
+        [
+            # the fact follows through its ON UPDATE CASCADE foreign keys;
+            # old sequence values are far below any YYYYMMDD, so keys never collide
+            """
+            UPDATE star.dim_date
+               SET date_sk = (EXTRACT(YEAR FROM full_date) * 10000 + EXTRACT(MONTH FROM full_date) * 100 + EXTRACT(DAY FROM full_date))::integer;
+            """,
+            """
+            UPDATE star.agg_pricing
+               SET date_sk = (EXTRACT(YEAR FROM full_date) * 10000 + EXTRACT(MONTH FROM full_date) * 100 + EXTRACT(DAY FROM full_date))::integer;
+            """,
+            "ALTER TABLE star.dim_date ALTER COLUMN date_sk DROP DEFAULT;",
+            "DROP SEQUENCE IF EXISTS star.dim_date_date_sk_seq;",
+            """
+            ALTER TABLE star.dim_date ADD CONSTRAINT dim_date_sk_yyyymmdd
+              CHECK (date_sk = (EXTRACT(YEAR FROM full_date) * 10000 + EXTRACT(MONTH FROM full_date) * 100 + EXTRACT(DAY FROM full_date))::integer);
+            """,
+        ],
+    ),
+    (
+        '008_fact_pricing_page_index',
+        "star.fact_pricing index in the dashboard's detail-table order, so a "
+        "page is read in order instead of sorting the whole date range",
+        [
+            """
+            CREATE INDEX IF NOT EXISTS idx_fact_pricing_page
+                ON star.fact_pricing (full_date, pricing_sk);
+            """,
+            "ANALYZE star.fact_pricing;",
+        ],
+    ),
+    (
+        '009_warehouse_row_hash',
+        "stored row_hash of the tracked columns on every warehouse SCD2 table, "
+        "compared by the incremental merge instead of the columns themselves",
+        [
+            # must stay equal to elt.scd2.row_hash_sql for the table's spec
+            # (tests/test_migrations.py); every ADD COLUMN rewrites its table
+            r"""
+            ALTER TABLE warehouse.categories ADD COLUMN IF NOT EXISTS row_hash uuid
+              GENERATED ALWAYS AS (md5(COALESCE((category_name)::text, '\N'))::uuid) STORED;
+            """,
+            r"""
+            ALTER TABLE warehouse.users ADD COLUMN IF NOT EXISTS row_hash uuid
+              GENERATED ALWAYS AS (md5(COALESCE((user_name)::text, '\N'))::uuid) STORED;
+            """,
+            r"""
+            ALTER TABLE warehouse.products ADD COLUMN IF NOT EXISTS row_hash uuid
+              GENERATED ALWAYS AS (md5(COALESCE((product_name)::text, '\N')
+                || chr(31) || COALESCE((category_sk)::text, '\N')
+                || chr(31) || COALESCE((discounted_price)::text, '\N')
+                || chr(31) || COALESCE((actual_price)::text, '\N')
+                || chr(31) || COALESCE((discount_percentage)::text, '\N')
+                || chr(31) || COALESCE((rating)::text, '\N')
+                || chr(31) || COALESCE((rating_count)::text, '\N')
+                || chr(31) || COALESCE((about_product)::text, '\N')
+                || chr(31) || COALESCE((product_link)::text, '\N')
+                || chr(31) || COALESCE((currency)::text, '\N'))::uuid) STORED;
+            """,
+            r"""
+            ALTER TABLE warehouse.reviews ADD COLUMN IF NOT EXISTS row_hash uuid
+              GENERATED ALWAYS AS (md5(COALESCE((product_sk)::text, '\N')
+                || chr(31) || COALESCE((user_sk)::text, '\N')
+                || chr(31) || COALESCE((review_title)::text, '\N')
+                || chr(31) || COALESCE((review_content)::text, '\N'))::uuid) STORED;
+            """,
+            r"""
+            ALTER TABLE warehouse.locations ADD COLUMN IF NOT EXISTS row_hash uuid
+              GENERATED ALWAYS AS (md5(COALESCE((product_sk)::text, '\N')
+                || chr(31) || COALESCE((country)::text, '\N')
+                || chr(31) || COALESCE((city)::text, '\N'))::uuid) STORED;
+            """,
+            # timestamps through their epoch: timestamp::text depends on DateStyle
+            r"""
+            ALTER TABLE warehouse.exchange_rates ADD COLUMN IF NOT EXISTS row_hash uuid
+              GENERATED ALWAYS AS (md5(COALESCE((date_part('epoch', fetched_at))::text, '\N')
+                || chr(31) || COALESCE((rate_to_base)::text, '\N'))::uuid) STORED;
+            """,
+        ],
+    ),
+    (
+        '010_etl_runs_backend',
+        "warehouse.etl_runs records the session of each run, so a run whose "
+        "session is gone can be marked failed",
+        [
+            # a registry created later by ensure_etl_runs already has them
+            """
+            ALTER TABLE IF EXISTS warehouse.etl_runs
+              ADD COLUMN IF NOT EXISTS backend_pid   integer,
+              ADD COLUMN IF NOT EXISTS backend_start timestamptz;
+            """,
+        ],
+    ),
+]
+
+
+# Migrations that rewrite, delete or backfill rows instead of only adding
+# indexes: timing queries across them compares different data, so
+# elt/benchmark_migrations.py refuses to apply them
+REWRITES_DATA = {
+    '002_exchange_rates_currency_grain',
+    '003_fact_pricing_full_date',
+    '004_fact_pricing_grain',
+    '006_agg_pricing',
+    '007_dim_date_yyyymmdd',
+    '009_warehouse_row_hash',
+}
+
+
+def ensure_schema_migrations(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS warehouse.schema_migrations (
+            migration_id text        PRIMARY KEY,
+            description  text        NOT NULL,
+            applied_at   timestamptz NOT NULL DEFAULT now()
+        );
+    """)
+
+
+def applied(cur):
+    """
+    Ids of the migrations already recorded in warehouse.schema_migrations.
+    Read-only: a database that never ran a migration has none.
+    """
+    cur.execute("SELECT to_regclass('warehouse.schema_migrations') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return set()
+    cur.execute("SELECT migration_id FROM warehouse.schema_migrations;")
+    return {row[0] for row in cur.fetchall()}
+
+
+def pending(cur):
+    done = applied(cur)
+    return [m for m in MIGRATIONS if m[0] not in done]
+
+
+def require_migrated(cur):
+    """
+    Raise if any migration is pending. The loaders write the migrated schema
+    (e.g. currency-pair exchange rates), so on a freshly restored amazon.sql
+    they stop here instead of failing halfway through a load.
+    """
+    todo = [m[0] for m in pending(cur)]
+    if todo:
+        raise RuntimeError(f"the database schema is behind: {len(todo)} pending migration(s) "
+                           f"({', '.join(todo)}); run python -m elt.migrations first")
+
+
+def migrate(cur, only=None):
+    """
+    Apply every pending migration (or just the pending ones listed in `only`)
+    on `cur` and return their ids. Nothing is committed here, so the caller
+    decides whether the whole batch sticks.
+    """
+    ensure_schema_migrations(cur)
+    ran = []
+    for migration_id, description, statements in pending(cur):
+        if only is not None and migration_id not in only:
+            continue
+        for sql in statements:
+            cur.execute(sql)
+        cur.execute(
+            "INSERT INTO warehouse.schema_migrations (migration_id, description) VALUES (%s, %s);",
+            (migration_id, description)
+        )
+        ran.append(migration_id)
+    return ran
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending warehouse schema migrations")
+    parser.add_argument('--list', action='store_true', help="show every migration and whether it is applied")
+    args = parser.parse_args()
+
+    conn = get_connection('migrations')
+    try:
+        cur = conn.cursor()
+        if args.list:
+            done = applied(cur)
+            for migration_id, description, _ in MIGRATIONS:
+                print(f"  [{'x' if migration_id in done else ' '}] {migration_id}: {description}")
+        else:
+            ran = migrate(cur)
+            print("Applied: " + ", ".join(ran) if ran else "Schema is up to date.")
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print("ERROR while migrating the warehouse schema:", e)
+        conn.rollback()
+    finally:
+        release_connection(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# elt/partitions.py
+#
+# Optional monthly range partitioning for the two tables that grow every day.
+# `python -m elt.partitions enable` converts them in place; from then on the
+# loaders create partitions ahead of the load date (ensure_partitions), and
+# `retire` drops old months by detaching their partitions instead of a DELETE.
+
+import argparse
+from datetime import date
+
+from config.connection import get_connection, release_connection
+from config.settings import PARTITIONS
+from elt.catalog import (bare, owned_sequences, partition_key, range_partitions, renamed, retarget_index,
+                         stored_columns, table_constraints, table_indexes)
+
+# table → the date column its partitions are ranged on
+PARTITIONED = {
+    'warehouse.exchange_rates': 'start_date',
+    'star.fact_pricing':        'full_date',
+}
+
+# Rows that must stay attached however old they are: a current warehouse
+# version keeps its start_date for as long as it stays current
+PINNED = {
+    'warehouse.exchange_rates': "end_date = '9999-12-31'",
+}
+
+# Tables derived from a partitioned one, by the same date column: retiring
+# months of the source also deletes them here
+DERIVED = {
+    'star.fact_pricing': ('star.agg_pricing',),
+}
+
+UNPARTITIONED = '_unpartitioned'
+
+
+def month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    """star.fact_pricing, 2025-03-01 → star.fact_pricing_p202503"""
+    return renamed(table, f"_p{month:%Y%m}")
+
+
+def create_partitions(cur, table, first, last, name=partition_name):
+    """One partition of `table` per month from `first` through `last`; returns their names."""
+    created = []
+    month = month_start(first)
+    while month <= last:
+        partition = name(table, month)
+        cur.execute(f"""
+            CREATE TABLE {partition} PARTITION OF {table}
+               FOR VALUES FROM (%s) TO (%s);
+        """, (month, add_months(month, 1)))
+        created.append(partition)
+        month = add_months(month, 1)
+    return created
+
+
+def _with_key_column(definition, column):
+    """
+    'UNIQUE (a, b) ...' → 'UNIQUE (a, b, column) ...': unique keys must include
+    the partition key. Only the first parenthesized list is the key; it may
+    hold expressions with parentheses of their own, e.g. (lower(name), b).
+    """
+    start = definition.index('(')
+    depth, item, items = 0, start + 1, []
+    for end in range(start, len(definition)):
+        if definition[end] == '(':
+            depth += 1
+        elif definition[end] == ')':
+            depth -= 1
+            if depth == 0:
+                break
+        elif definition[end] == ',' and depth == 1:
+            items.append(definition[item:end])
+            item = end + 1
+    items.append(definition[item:end])
+    if column in [c.strip() for c in items]:
+        return definition
+    return f"{definition[:end]}, {column}{definition[end:]}"
+
+
+def _partitioned_index(ddl, name, table, column):
+    """
+    The CREATE INDEX statement for index `name` of `table` (from
+    table_indexes) once `table` is partitioned on `column`: a unique index
+    gets `column` appended to its key columns, but not to INCLUDE or WHERE.
+    """
+    ddl = retarget_index(ddl, name, table, name, table)
+    if not ddl.startswith("CREATE UNIQUE"):
+        return ddl
+    using = ddl.index(" USING ")
+    return ddl[:using] + _with_key_column(ddl[using:], column)
+
+
+def enable(cur, table, column, today=None, ahead=None):
+    """
+    Rebuild `table` as a table partitioned by month on `column`, holding the
+    same rows, defaults, sequences, indexes and keys. Unique indexes and keys
+    get `column` appended, since PostgreSQL only enforces uniqueness within a
+    partition. Creates a partition for every month from the oldest row through
+    `ahead` months past today, plus a DEFAULT partition for anything older
+    than the oldest partition. Returns False if `table` already is partitioned.
+    """
+    if partition_key(cur, table):
+        return False
+    today = today or date.today()
+    ahead = PARTITIONS['months_ahead'] if ahead is None else ahead
+    old = renamed(table, UNPARTITIONED)
+
+    indexes = table_indexes(cur, table)
+    constraints = table_constraints(cur, table)
+    sequences = owned_sequences(cur, table)
+    columns = ", ".join(stored_columns(cur, table))
+
+    cur.execute(f"ALTER TABLE {table} RENAME TO {bare(old)};")
+    cur.execute(f"""
+        CREATE TABLE {table}
+          (LIKE {old} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS)
+          PARTITION BY RANGE ({column});
+    """)
+    for sequence, owner in sequences:
+        cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.{owner};")
+
+    cur.execute(f"SELECT MIN({column}) FROM {old};")
+    first = cur.fetchone()[0] or today
+    create_partitions(cur, table, first, add_months(month_start(today), ahead))
+    cur.execute(f"CREATE TABLE {renamed(table, '_default')} PARTITION OF {table} DEFAULT;")
+
+    cur.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {old};")
+    cur.execute(f"DROP TABLE {old};")
+
+    # the old table's indexes and keys went with it, so their names are free again
+    for name, ddl in indexes:
+        cur.execute(_partitioned_index(ddl, name, table, column) + ";")
+    for name, kind, definition, _ in constraints:
+        if kind in ('p', 'u'):
+            definition = _with_key_column(definition, column)
+        cur.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition};")
+    cur.execute(f"ANALYZE {table};")
+    return True
+
+
+def ensure_partitions(cur, day=None, ahead=None):
+    """
+    Called by the loaders before they write: make sure every partitioned table
+    in PARTITIONED has partitions through `ahead` months past `day`. New
+    months are only ever added after the newest partition, so the DEFAULT
+    partition never holds rows for a month about to be created. Returns the
+    partitions created.
+    """
+    day = day or date.today()
+    ahead = PARTITIONS['months_ahead'] if ahead is None else ahead
+    created = []
+    for table in PARTITIONED:
+        if not partition_key(cur, table):
+            continue
+        months = [p for p in range_partitions(cur, table) if p[1] is not None]
+        first = months[-1][2] if months else month_start(day)
+        created += create_partitions(cur, table, first, add_months(month_start(day), ahead))
+    if created:
+        print(f"  partitions: created {', '.join(created)}")
+    return created
+
+
+def retire(cur, keep_months=None, drop=False, today=None):
+    """
+    Detach (or with `drop`, drop) the monthly partitions that end before the
+    first of the `keep_months` months kept, and delete the same old rows from
+    the DEFAULT partitions and the DERIVED tables. A warehouse partition still holding a current
+    version (PINNED) stays attached. Returns the partitions retired.
+    """
+    keep_months = PARTITIONS['keep_months'] if keep_months is None else keep_months
+    cutoff = add_months(month_start(today or date.today()), -keep_months)
+    retired = []
+    for table, column in PARTITIONED.items():
+        if not partition_key(cur, table):
+            continue
+        pinned = PINNED.get(table)
+        for partition, lower, upper in range_partitions(cur, table):
+            if lower is None:
+                cur.execute(f"""
+                    DELETE FROM {partition}
+                     WHERE {column} < %s {f'AND NOT ({pinned})' if pinned else ''};
+                """, (cutoff,))
+                continue
+            if upper > cutoff:
+                continue
+            if pinned:
+                cur.execute(f"SELECT EXISTS (SELECT 1 FROM {partition} WHERE {pinned});")
+                if cur.fetchone()[0]:
+                    print(f"  {partition}: holds current rows, kept")
+                    continue
+            cur.execute(f"ALTER TABLE {table} DETACH PARTITION {partition};")
+            if drop:
+                cur.execute(f"DROP TABLE {partition};")
+            retired.append(partition)
+        for derived in DERIVED.get(table, ()):
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (derived,))
+            if cur.fetchone()[0]:
+                cur.execute(f"DELETE FROM {derived} WHERE {column} < %s;", (cutoff,))
+    return retired
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monthly range partitioning of " + " and ".join(PARTITIONED))
+    parser.add_argument('action', choices=['enable', 'ensure', 'retire', 'list'])
+    parser.add_argument('--keep-months', type=int, default=PARTITIONS['keep_months'],
+                        help="retire: months of history kept attached")
+    parser.add_argument('--drop', action='store_true', help="retire: drop detached partitions instead of keeping them")
+    args = parser.parse_args()
+
+    conn = get_connection('partitions', bulk=True)
+    try:
+        cur = conn.cursor()
+        if args.action == 'enable':
+            for table, column in PARTITIONED.items():
+                print(f"  {table}: {'partitioned by ' + column if enable(cur, table, column) else 'already partitioned'}")
+        elif args.action == 'ensure':
+            if not ensure_partitions(cur):
+                print("Partitions are up to date.")
+        elif args.action == 'retire':
+            retired = retire(cur, args.keep_months, args.drop)
+            print(f"{'Dropped' if args.drop else 'Detached'}: {', '.join(retired) or 'nothing'}")
+        else:
+            for table in PARTITIONED:
+                column = partition_key(cur, table)
+                print(f"  {table}: {'partitioned by ' + column if column else 'not partitioned'}")
+                for partition, lower, upper in range_partitions(cur, table) if column else ():
+                    print(f"    {partition:<40}{f'{lower} .. {upper}' if lower else 'DEFAULT'}")
+        conn.commit()
+        cur.close()
+    except Exception as e:
+        print("ERROR while managing partitions:", e)
+        conn.rollback()
+    finally:
+        release_connection(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,8 @@
 # etl_scripts/pull_exchange_rates.py
 import os
 import requests
-import psycopg2
 from datetime import datetime
-from config.settings import DB_CONFIG
+from config.connection import get_connection, release_connection
 from dotenv import load_dotenv
 
 
@@ -45,7 +44,7 @@ def pull_and_stage_rates():
 
     conn = None
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
+        conn = get_connection('pull_exchange_rates')
         cur = conn.cursor()
 
         # 2) For each (target_currency, rate_value) pair, insert one row
@@ -68,7 +67,7 @@ def pull_and_stage_rates():
             conn.rollback()
     finally:
         if conn:
-            conn.close()
+            release_connection(conn)
 
 if __name__ == "__main__":
     pull_and_stage_rates()
@@ -0,0 +1,586 @@
+# elt/scd2.py
+
+from dataclasses import dataclass
+
+from psycopg2.extras import execute_values
+
+from elt.migrations import require_migrated
+
+CURRENT = "'9999-12-31'"
+ROW_HASH = 'row_hash'
+
+
+@dataclass(frozen=True)
+class Lookup:
+    """
+    Resolve a natural key from the source to the surrogate key of the current
+    row of a warehouse parent table, e.g. category_id → categories_sk.
+    """
+    column: str   # FK column in the target table, e.g. 'category_sk'
+    table: str    # warehouse parent table, e.g. 'warehouse.categories'
+    sk: str       # surrogate key of the parent, e.g. 'categories_sk'
+    key: str      # natural key of the parent, e.g. 'category_id'
+    source: str   # source column holding that natural key
+
+
+@dataclass(frozen=True)
+class SCD2Table:
+    """
+    Everything merge_scd2 needs to know about one warehouse table.
+
+      source  : table or parenthesised query with the natural key, the plain
+                tracked columns and every Lookup.source column
+      key     : columns identifying a row (may include Lookup columns)
+      tracked : columns compared to decide whether a new version is needed
+      change_log : table name the source's changes are logged under in
+                   staging.change_log, for runs scoped by it (see scope_sql)
+    """
+    name: str
+    table: str
+    sk: str
+    source: str
+    key: tuple
+    tracked: tuple
+    lookups: tuple = ()
+    source_id: int = 1
+    change_log: str = None
+
+    @property
+    def columns(self):
+        """Key and tracked columns in insert order, without duplicates."""
+        return tuple(dict.fromkeys(self.key + self.tracked))
+
+    @property
+    def scope_key(self):
+        """Column a change-log scope is expressed in."""
+        return self.key[0]
+
+
+def column_types(cur, table):
+    """{column: formatted type} for a table, from the catalog."""
+    cur.execute("""
+        SELECT attname, format_type(atttypid, atttypmod)
+          FROM pg_attribute
+         WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped;
+    """, (table,))
+    return dict(cur.fetchall())
+
+
+def row_hash_sql(spec, types, alias=''):
+    """
+    md5 of the tracked columns as a uuid. Each value is rendered as text with
+    NULL as \\N and the values are joined by chr(31). Timestamps go through
+    their epoch because timestamp::text depends on DateStyle and would not be
+    allowed in a generated column.
+    """
+    parts = []
+    for c in spec.tracked:
+        col = f"{alias}{c}"
+        if types[c].startswith('timestamp'):
+            col = f"date_part('epoch', {col})"
+        parts.append(f"COALESCE(({col})::text, '\\N')")
+    return f"md5({' || chr(31) || '.join(parts)})::uuid"
+
+
+def row_hash_types(cur, spec):
+    """
+    Column types of `spec.table`, which has to carry the stored row_hash
+    (migration 009_warehouse_row_hash); without it the merge stops here
+    instead of rewriting the table in the middle of a run.
+    """
+    types = column_types(cur, spec.table)
+    if ROW_HASH not in types:
+        require_migrated(cur)
+        raise RuntimeError(f"{spec.table} has no {ROW_HASH} column")
+    return types
+
+
+def stage_deps(specs):
+    """{name: names of the specs it looks surrogate keys up in}, for run_stages."""
+    by_table = {spec.table: spec.name for spec in specs}
+    return {
+        spec.name: tuple(dict.fromkeys(by_table[l.table] for l in spec.lookups if l.table in by_table))
+        for spec in specs
+    }
+
+
+def dependency_order(specs):
+    """`specs` ordered so every spec comes after the ones it looks surrogate keys up in."""
+    deps = stage_deps(specs)
+    ordered, done = [], set()
+    while len(ordered) < len(specs):
+        ready = [spec for spec in specs if spec.name not in done and set(deps[spec.name]) <= done]
+        if not ready:
+            raise ValueError(f"Circular lookups between {sorted(set(deps) - done)}")
+        ordered += ready
+        done |= {spec.name for spec in ready}
+    return ordered
+
+
+def scope_name(table, plan=False):
+    """
+    warehouse.products → warehouse.scope_products, or the temp table
+    plan_scope_products for a plan
+    """
+    schema, name = table.split('.')
+    return f"plan_scope_{name}" if plan else f"{schema}.scope_{name}"
+
+
+def scope_sql(cur, spec, specs, etl_id):
+    """
+    Query for the scope_key values `spec` has to look at in a run that only
+    applies the change-log entries claimed by `etl_id` (the unclaimed ones
+    when `etl_id` is None, for a plan):
+
+      - its own logged keys
+      - source rows pointing at a parent key in the parent's scope (they may
+        have been unresolvable until now)
+      - current warehouse rows pointing at any version of such a parent, whose
+        surrogate key is about to change
+
+    Parent scopes are read from their scope tables, so build_scopes has to
+    materialise the parents first.
+    """
+    by_table = {s.table: s for s in specs}
+    key = spec.scope_key
+    parts = []
+    plan = etl_id is None
+    if spec.change_log:
+        key_type = column_types(cur, spec.table)[key]
+        claimed = "etl_id IS NULL" if plan else f"etl_id = {int(etl_id)}"
+        parts.append(f"""
+            SELECT row_key::{key_type} FROM staging.change_log
+             WHERE {claimed} AND table_name = '{spec.change_log}'
+        """)
+    for l in spec.lookups:
+        if l.table not in by_table:
+            continue
+        parent = f"SELECT k FROM {scope_name(l.table, plan)}"
+        parts.append(f"SELECT s.{key} FROM {spec.source} s WHERE s.{l.source} IN ({parent})")
+        parts.append(f"""
+            SELECT w.{key} FROM {spec.table} w
+             WHERE w.end_date = {CURRENT}
+               AND w.{l.column} IN (SELECT {l.sk} FROM {l.table} WHERE {l.key} IN ({parent}))
+        """)
+    return " UNION ".join(parts)
+
+
+def build_scopes(cur, specs, etl_id):
+    """
+    (Re)build one UNLOGGED warehouse.scope_<table> per spec holding the keys
+    scope_sql finds for it, parents before children so every parent scope is
+    computed once rather than re-derived inside each child's query.
+    A spec with neither a change_log nor a scoped parent can't be scoped and
+    is diffed in full. With `etl_id` None (a plan) the scopes are temp
+    tables (scope_name(table, plan=True)) over the unclaimed entries.
+    Returns {name: keys in scope, or None if unscoped}.
+    """
+    deps = stage_deps(specs)
+    sizes = {}
+    for spec in dependency_order(specs):
+        sql = scope_sql(cur, spec, specs, etl_id)
+        if not sql or any(sizes[d] is None for d in deps[spec.name]):
+            sizes[spec.name] = None
+            continue
+        scope = scope_name(spec.table, plan=etl_id is None)
+        cur.execute(f"DROP TABLE IF EXISTS {scope};")
+        cur.execute(f"""
+            CREATE {'TEMP' if etl_id is None else 'UNLOGGED'} TABLE {scope} AS
+            SELECT DISTINCT k FROM ({sql}) x(k);
+        """)
+        sizes[spec.name] = cur.rowcount
+        cur.execute(f"ANALYZE {scope};")
+    return sizes
+
+
+def keymap_name(table):
+    """warehouse.products → warehouse.keymap_products"""
+    schema, name = table.split('.')
+    return f"{schema}.keymap_{name}"
+
+
+def build_keymaps(cur, specs):
+    """
+    (Re)build one UNLOGGED warehouse.keymap_<table> per parent table that a
+    Lookup in `specs` points at: natural key → surrogate key of the current
+    row, nothing else. They are rebuilt once per run, then kept in step by
+    merge_scd2, so every later lookup joins a small keyed table instead of
+    filtering the full SCD2 history for end_date = '9999-12-31'.
+    Returns {parent table: keys loaded}.
+    """
+    parents = {}
+    for spec in specs:
+        for l in spec.lookups:
+            parents[l.table] = (l.key, l.sk)
+
+    sizes = {}
+    for table, (key, sk) in parents.items():
+        keymap = keymap_name(table)
+        # built without the index and keyed afterwards, which is much cheaper
+        cur.execute(f"DROP TABLE IF EXISTS {keymap};")
+        cur.execute(f"""
+            CREATE UNLOGGED TABLE {keymap} AS
+            SELECT {key}, {sk} FROM {table} WHERE end_date = {CURRENT};
+        """)
+        sizes[table] = cur.rowcount
+        cur.execute(f"ALTER TABLE {keymap} ADD PRIMARY KEY ({key});")
+        cur.execute(f"ANALYZE {keymap};")
+    return sizes
+
+
+def stage_snapshot(cur, spec, types, scope=None, keymaps=None):
+    """
+    Copy the source into a temp table with the lookups already resolved and
+    the row_hash computed the same way as the warehouse column. Lookups join
+    the parents' key maps (see build_keymaps). `resolved` is false when a
+    parent has no current warehouse row; such rows are left alone (no
+    close-out, no insert) but still count as present.
+
+    With `scope` (a query for the keys to look at, e.g. from a build_scopes
+    table), its keys are staged in scd2_scope and only the matching source
+    rows are snapshotted. `keymaps` ({parent table: relation}) swaps in
+    other key maps, as plan_scd2 does with its planned ones.
+    Returns the number of key lookups that found an SK.
+    """
+    lookup_cols = {l.column for l in spec.lookups}
+    plain = [c for c in spec.columns if c not in lookup_cols]
+    sources = [l.source for l in spec.lookups if l.source not in plain]
+    select = [f"s.{c}" for c in plain + sources]
+    joins = []
+    for i, l in enumerate(spec.lookups):
+        select.append(f"l{i}.{l.sk} AS {l.column}")
+        keymap = (keymaps or {}).get(l.table, keymap_name(l.table))
+        joins.append(f"LEFT JOIN {keymap} l{i} ON l{i}.{l.key} = s.{l.source}")
+    resolved = " AND ".join(f"l{i}.{l.sk} IS NOT NULL" for i, l in enumerate(spec.lookups)) or "true"
+
+    where = ""
+    cur.execute("DROP TABLE IF EXISTS scd2_scope;")
+    if scope:
+        cur.execute(f"CREATE TEMP TABLE scd2_scope AS SELECT DISTINCT k FROM ({scope}) x(k);")
+        cur.execute("ANALYZE scd2_scope;")
+        where = f"WHERE s.{spec.scope_key} IN (SELECT k FROM scd2_scope)"
+
+    cur.execute("DROP TABLE IF EXISTS scd2_snapshot;")
+    cur.execute(f"""
+        CREATE TEMP TABLE scd2_snapshot AS
+        SELECT s.*, {row_hash_sql(spec, types, 's.')} AS {ROW_HASH}
+          FROM (
+                SELECT {', '.join(select)}, {resolved} AS resolved
+                  FROM {spec.source} s
+                  {' '.join(joins)}
+                 {where}
+               ) s;
+    """)
+    cur.execute("ANALYZE scd2_snapshot;")
+    if not spec.lookups:
+        return 0
+    # a lookup resolved where its key map gave an SK, whether or not the row's other lookups did
+    cur.execute(f"SELECT {' + '.join(f'COUNT({l.column})' for l in spec.lookups)} FROM scd2_snapshot;")
+    return cur.fetchone()[0]
+
+
+def in_scope(spec, scope):
+    """Condition limiting warehouse rows `w` to the staged scope, if any."""
+    return f"AND w.{spec.scope_key} IN (SELECT k FROM scd2_scope)" if scope else ""
+
+
+def merge_scd2(cur, spec, load_ts, run_etl_id, keymap=False, scope=None):
+    """
+    Bring `spec.table` in line with its source in three set-based statements:
+
+      1) close out current rows whose row_hash differs from the hash of the
+         source row
+      2) close out current rows whose key is gone from the source
+      3) insert a new current version for every resolved source row that has
+         no current row (new keys plus the ones closed in step 1)
+
+    Closed rows get end_date = load_ts and update_id = run_etl_id; new rows get
+    start_date = load_ts and insert_id = run_etl_id. With `keymap`, the
+    table's key map is updated by the same statements, so the next stage
+    resolves against this run's new SKs. With `scope`, only the keys it
+    returns are compared (the rest of the table is known to be unchanged).
+    Returns (changed, deleted, inserted, lookups resolved).
+    """
+    types = row_hash_types(cur, spec)
+    lookups = stage_snapshot(cur, spec, types, scope)
+
+    key_match = " AND ".join(f"w.{k} = s.{k}" for k in spec.key)
+    params = {'ts': load_ts, 'etl_id': run_etl_id}
+    if keymap:
+        keymap = keymap_name(spec.table)
+        (key,) = spec.key
+
+    def close(where):
+        sql = f"""
+            UPDATE {spec.table} w
+               SET end_date = %(ts)s, update_id = %(etl_id)s
+             {where}
+        """
+        if not keymap:
+            cur.execute(sql, params)
+            return cur.rowcount
+        cur.execute(f"""
+            WITH closed AS ({sql} RETURNING w.{key}),
+                 unmapped AS (DELETE FROM {keymap} k USING closed c WHERE k.{key} = c.{key})
+            SELECT count(*) FROM closed;
+        """, params)
+        return cur.fetchone()[0]
+
+    # 1) Close-out: current version differs from the source
+    changed = close(f"""
+          FROM scd2_snapshot s
+         WHERE s.resolved
+           AND w.end_date = {CURRENT}
+           AND {key_match}
+           AND w.{ROW_HASH} <> s.{ROW_HASH}
+    """)
+
+    # 2) Soft delete: current version has no source row any more
+    deleted = close(f"""
+         WHERE w.end_date = {CURRENT}
+           {in_scope(spec, scope)}
+           AND NOT EXISTS (SELECT 1 FROM scd2_snapshot s WHERE {key_match})
+    """)
+
+    # 3) New versions: resolved source rows without a current version
+    columns = ", ".join(spec.columns)
+    if keymap:
+        current = f"SELECT 1 FROM {keymap} w WHERE {key_match}"
+    else:
+        current = f"SELECT 1 FROM {spec.table} w WHERE w.end_date = {CURRENT} AND {key_match}"
+    insert = f"""
+        INSERT INTO {spec.table}
+          ({columns}, start_date, source_id, insert_id, update_id)
+        SELECT {', '.join(f's.{c}' for c in spec.columns)},
+               %(ts)s, {spec.source_id}, %(etl_id)s, NULL
+          FROM scd2_snapshot s
+         WHERE s.resolved
+           AND NOT EXISTS ({current})
+    """
+    if keymap:
+        cur.execute(f"""
+            WITH added AS ({insert} RETURNING {key}, {spec.sk})
+            INSERT INTO {keymap} ({key}, {spec.sk})
+            SELECT {key}, {spec.sk} FROM added
+            ON CONFLICT ({key}) DO UPDATE SET {spec.sk} = EXCLUDED.{spec.sk};
+        """, params)
+    else:
+        cur.execute(insert, params)
+    inserted = cur.rowcount
+
+    cur.execute("DROP TABLE scd2_snapshot;")
+    cur.execute("DROP TABLE IF EXISTS scd2_scope;")
+    return changed, deleted, inserted, lookups
+
+
+def plan_scd2(cur, spec, planned, keymap=False, scope=None):
+    """
+    What merge_scd2 would do to `spec.table`, counted without writing to it:
+    (changed, deleted, inserted, current rows before the run).
+
+    `planned` ({parent table: temp key map}) starts empty and is filled in
+    as the parents are planned; lookups resolve against it instead of the
+    real key maps. With `keymap` (the table is a Lookup target), its planned
+    key map is the current one without the keys the plan closes, plus the
+    changed and new keys under negative placeholder SKs, so the children
+    see the SK changes the real run would give them. Only temp tables are
+    written, and key maps are taken from `planned` alone.
+    """
+    types = row_hash_types(cur, spec)
+    stage_snapshot(cur, spec, types, scope, planned)
+    key_match = " AND ".join(f"w.{k} = s.{k}" for k in spec.key)
+    keys = ", ".join(f"w.{k}" for k in spec.key)
+
+    cur.execute("DROP TABLE IF EXISTS scd2_plan;")
+    cur.execute(f"""
+        CREATE TEMP TABLE scd2_plan AS
+        SELECT {', '.join(f's.{k}' for k in spec.key)},
+               CASE WHEN w.{spec.sk} IS NULL THEN 'new' ELSE 'changed' END AS action
+          FROM scd2_snapshot s
+          LEFT JOIN {spec.table} w
+            ON w.end_date = {CURRENT}
+           AND {key_match}
+         WHERE s.resolved
+           AND (w.{spec.sk} IS NULL OR w.{ROW_HASH} <> s.{ROW_HASH})
+        UNION ALL
+        SELECT {keys}, 'deleted'
+          FROM {spec.table} w
+         WHERE w.end_date = {CURRENT}
+           {in_scope(spec, scope)}
+           AND NOT EXISTS (SELECT 1 FROM scd2_snapshot s WHERE {key_match});
+    """)
+    cur.execute("SELECT action, count(*) FROM scd2_plan GROUP BY action;")
+    counts = dict(cur.fetchall())
+    changed, deleted, new = (counts.get(a, 0) for a in ('changed', 'deleted', 'new'))
+    cur.execute(f"SELECT count(*) FROM {spec.table} WHERE end_date = {CURRENT};")
+    current = cur.fetchone()[0]
+
+    if keymap:
+        (key,) = spec.key
+        plan_keymap = f"plan_{keymap_name(spec.table).split('.')[1]}"
+        cur.execute(f"DROP TABLE IF EXISTS {plan_keymap};")
+        cur.execute(f"""
+            CREATE TEMP TABLE {plan_keymap} AS
+            SELECT w.{key}, w.{spec.sk}
+              FROM {spec.table} w
+             WHERE w.end_date = {CURRENT}
+               AND NOT EXISTS (SELECT 1 FROM scd2_plan p WHERE p.{key} = w.{key})
+            UNION ALL
+            SELECT p.{key}, -row_number() OVER ()
+              FROM scd2_plan p
+             WHERE p.action <> 'deleted';
+        """)
+        cur.execute(f"ANALYZE {plan_keymap};")
+        planned[spec.table] = plan_keymap
+
+    cur.execute("DROP TABLE scd2_plan;")
+    cur.execute("DROP TABLE scd2_snapshot;")
+    cur.execute("DROP TABLE IF EXISTS scd2_scope;")
+    return changed, deleted, new + changed, current
+
+
+# ------------------------------------------------------------------------------
+# Streaming variant: walk the snapshot and the current warehouse rows as a
+# sorted merge over two server-side cursors and write in batches. Produces the
+# same rows as merge_scd2; memory stays bounded by batch_size on both sides.
+# ------------------------------------------------------------------------------
+
+def order_by(spec, types, alias=''):
+    """
+    ORDER BY on the key that agrees with Python's comparison of the fetched
+    values: text in byte order (COLLATE "C"), everything else natively.
+    """
+    return ", ".join(
+        f'{alias}{k} COLLATE "C"' if types[k].startswith(('character', 'text')) else f"{alias}{k}"
+        for k in spec.key
+    )
+
+
+class BatchWriter:
+    """Buffers close-outs and new versions and writes them batch_size at a time."""
+
+    def __init__(self, cur, spec, load_ts, run_etl_id, keymap, batch_size):
+        self.cur = cur
+        self.spec = spec
+        self.load_ts = load_ts
+        self.run_etl_id = run_etl_id
+        self.keymap = keymap_name(spec.table) if keymap else None
+        self.batch_size = batch_size
+        self.closes = []
+        self.inserts = []
+
+    def close(self, sk, key):
+        self.closes.append((sk, key))
+        if len(self.closes) >= self.batch_size:
+            self.flush()
+
+    def insert(self, values):
+        self.inserts.append(values + (self.load_ts, self.spec.source_id, self.run_etl_id))
+        if len(self.inserts) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        spec, cur = self.spec, self.cur
+        # close-outs first, so a re-inserted key never has two current rows
+        if self.closes:
+            cur.execute(f"""
+                UPDATE {spec.table}
+                   SET end_date = %s, update_id = %s
+                 WHERE {spec.sk} = ANY(%s);
+            """, (self.load_ts, self.run_etl_id, [sk for sk, _ in self.closes]))
+            if self.keymap:
+                (key,) = spec.key
+                cur.execute(f"DELETE FROM {self.keymap} WHERE {key} = ANY(%s);",
+                            ([k[0] for _, k in self.closes],))
+            self.closes = []
+        if self.inserts:
+            columns = ", ".join(spec.columns)
+            insert = f"""
+                INSERT INTO {spec.table}
+                  ({columns}, start_date, source_id, insert_id, update_id)
+                VALUES %s
+            """
+            template = f"({', '.join(['%s'] * (len(spec.columns) + 3))}, NULL)"
+            if self.keymap:
+                (key,) = spec.key
+                insert = f"""
+                    WITH added AS ({insert} RETURNING {key}, {spec.sk})
+                    INSERT INTO {self.keymap} ({key}, {spec.sk})
+                    SELECT {key}, {spec.sk} FROM added
+                    ON CONFLICT ({key}) DO UPDATE SET {spec.sk} = EXCLUDED.{spec.sk}
+                """
+            execute_values(cur, insert, self.inserts, template=template, page_size=self.batch_size)
+            self.inserts = []
+
+
+def _stream(conn, name, sql, batch_size):
+    """Rows of `sql` from a named (server-side) cursor, batch_size at a time."""
+    cur = conn.cursor(name=name)
+    cur.itersize = batch_size
+    cur.execute(sql)
+    try:
+        yield from cur
+    finally:
+        cur.close()
+
+
+def stream_merge_scd2(cur, spec, load_ts, run_etl_id, keymap=False, batch_size=10000, scope=None):
+    """
+    Same result as merge_scd2, computed as a sorted-merge join in Python:
+
+      source only          → insert (if resolved)
+      both, hash differs   → close-out + insert (if resolved)
+      warehouse only       → soft delete
+
+    Both sides are read through server-side cursors ordered by the natural
+    key, and writes go through a BatchWriter. `scope` works as in merge_scd2.
+    Returns (changed, deleted, inserted, lookups resolved).
+    """
+    types = row_hash_types(cur, spec)
+    lookups = stage_snapshot(cur, spec, types, scope)
+    conn = cur.connection
+
+    cols = spec.columns
+    key_idx = [cols.index(k) for k in spec.key]
+    n_key = len(spec.key)
+    src = _stream(conn, 'scd2_source', f"""
+        SELECT {', '.join(cols)}, resolved, {ROW_HASH}
+          FROM scd2_snapshot
+         WHERE {' AND '.join(f'{k} IS NOT NULL' for k in spec.key)}
+         ORDER BY {order_by(spec, types)};
+    """, batch_size)
+    wh = _stream(conn, 'scd2_current', f"""
+        SELECT {', '.join(f'w.{k}' for k in spec.key)}, w.{spec.sk}, w.{ROW_HASH}
+          FROM {spec.table} w
+         WHERE w.end_date = {CURRENT}
+           {in_scope(spec, scope)}
+         ORDER BY {order_by(spec, types, 'w.')};
+    """, batch_size)
+
+    writer = BatchWriter(cur, spec, load_ts, run_etl_id, keymap, batch_size)
+    changed = deleted = inserted = 0
+    s, w = next(src, None), next(wh, None)
+    while s is not None or w is not None:
+        s_key = tuple(s[i] for i in key_idx) if s is not None else None
+        w_key = w[:n_key] if w is not None else None
+        if w is None or (s is not None and s_key < w_key):
+            if s[-2]:
+                writer.insert(s[:len(cols)])
+                inserted += 1
+            s = next(src, None)
+        elif s is None or w_key < s_key:
+            writer.close(w[n_key], w_key)
+            deleted += 1
+            w = next(wh, None)
+        else:
+            if s[-2] and s[-1] != w[-1]:
+                writer.close(w[n_key], w_key)
+                writer.insert(s[:len(cols)])
+                changed += 1
+                inserted += 1
+            s, w = next(src, None), next(wh, None)
+    writer.flush()
+
+    cur.execute("DROP TABLE scd2_snapshot;")
+    cur.execute("DROP TABLE IF EXISTS scd2_scope;")
+    return changed, deleted, inserted, lookups
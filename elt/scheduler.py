@@ -0,0 +1,21 @@
+# elt/scheduler.py
+#
+# SQL stages for config.scheduler.run_stages.
+
+from config.connection import connection
+
+
+def sql_stage(stage, sql, params=None, rows=None, name=None, bulk=False):
+    """
+    A run_stages stage that runs one statement on its own pooled connection
+    and commits it, recording the affected row count in rows[name].
+    """
+    def run():
+        with connection(stage, bulk=bulk) as conn:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            if rows is not None:
+                rows[name] = cur.rowcount
+            conn.commit()
+            cur.close()
+    return run
@@ -0,0 +1,105 @@
+# elt/shadow.py
+#
+# Build replacement copies of a set of tables next to the live ones and swap
+# them in with renames in one transaction, so readers see either the old
+# contents or the new ones, never an empty or half-loaded table.
+
+from elt.catalog import (bare, owned_sequences, partition_key, range_partitions, renamed, retarget_index,
+                         table_constraints, table_indexes)
+
+SUFFIX = '_shadow'
+RETIRED = '_retired'
+
+
+def shadow_name(table):
+    return renamed(table, SUFFIX)
+
+
+def create_shadows(cur, tables):
+    """
+    Create an empty UNLOGGED copy of each table (columns, defaults, generated
+    columns, NOT NULL and CHECK constraints, but no indexes or keys, so the
+    bulk load doesn't maintain any). SK defaults still draw from the live
+    tables' sequences. A partitioned table gets a partitioned copy with
+    the same partitions, which are the UNLOGGED part. Returns {table: shadow}.
+    """
+    drop_shadows(cur, tables)
+    shadows = {}
+    for table in tables:
+        shadow = shadow_name(table)
+        column = partition_key(cur, table)
+        cur.execute(f"""
+            CREATE {'' if column else 'UNLOGGED '}TABLE {shadow}
+              (LIKE {table} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING CONSTRAINTS)
+              {f'PARTITION BY RANGE ({column})' if column else ''};
+        """)
+        for partition, lower, upper in range_partitions(cur, table) if column else ():
+            bound = "FOR VALUES FROM (%s) TO (%s)" if lower else "DEFAULT"
+            cur.execute(f"CREATE UNLOGGED TABLE {shadow_name(partition)} PARTITION OF {shadow} {bound};",
+                        (lower, upper) if lower else None)
+        shadows[table] = shadow
+    return shadows
+
+
+def drop_shadows(cur, tables):
+    """Drop whatever is left of an earlier, interrupted shadow build."""
+    cur.execute(f"DROP TABLE IF EXISTS {', '.join(shadow_name(t) for t in tables)} CASCADE;")
+
+
+def finish_shadows(cur, shadows):
+    """
+    Make the loaded shadows match their live tables: SET LOGGED, then the
+    live tables' indexes and primary/unique/foreign keys (foreign keys to
+    another table being swapped point at its shadow), then ANALYZE.
+    Everything gets a temporary _shadow name that swap_shadows renames back,
+    partitions included.
+    Returns [(kind, table, temporary name, final name)] for swap_shadows.
+    """
+    renames = []
+    for table, shadow in shadows.items():
+        if partition_key(cur, table):
+            for partition, _, _ in range_partitions(cur, table):
+                cur.execute(f"ALTER TABLE {shadow_name(partition)} SET LOGGED;")
+                renames.append(('partition', table, bare(shadow_name(partition)), bare(partition)))
+        else:
+            cur.execute(f"ALTER TABLE {shadow} SET LOGGED;")
+        for name, ddl in table_indexes(cur, table):
+            tmp = f"{name[:63 - len(SUFFIX)]}{SUFFIX}"
+            cur.execute(retarget_index(ddl, name, table, tmp, shadow) + ";")
+            renames.append(('index', table, tmp, name))
+        for name, kind, definition, references in table_constraints(cur, table):
+            tmp = f"{name[:63 - len(SUFFIX)]}{SUFFIX}"
+            if kind == 'f' and references in shadows:
+                definition = definition.replace(f"REFERENCES {references}(",
+                                                f"REFERENCES {shadows[references]}(", 1)
+            cur.execute(f"ALTER TABLE {shadow} ADD CONSTRAINT {tmp} {definition};")
+            renames.append(('constraint', table, tmp, name))
+        cur.execute(f"ANALYZE {shadow};")
+    return renames
+
+
+def swap_shadows(cur, shadows, renames):
+    """
+    Swap every shadow in for its live table: rename the live tables out of
+    the way, rename the shadows into place, hand the SK sequences over, drop
+    the old tables and give indexes and constraints their usual names. Run
+    it inside one transaction and commit once; readers wait for the swap's
+    locks and then see the new tables.
+    """
+    sequences = {table: owned_sequences(cur, table) for table in shadows}
+    for table in shadows:
+        cur.execute(f"ALTER TABLE {table} RENAME TO {bare(renamed(table, RETIRED))};")
+    for table, shadow in shadows.items():
+        cur.execute(f"ALTER TABLE {shadow} RENAME TO {bare(table)};")
+        for sequence, column in sequences[table]:
+            cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.{column};")
+    cur.execute(f"DROP TABLE {', '.join(renamed(t, RETIRED) for t in shadows)};")
+
+    schemas = {table: table.split('.')[0] for table in shadows}
+    for kind, table, tmp, name in renames:
+        if kind == 'index':
+            cur.execute(f"ALTER INDEX {schemas[table]}.{tmp} RENAME TO {name};")
+        elif kind == 'partition':
+            cur.execute(f"ALTER TABLE {schemas[table]}.{tmp} RENAME TO {name};")
+        else:
+            cur.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {tmp} TO {name};")
@@ -0,0 +1,147 @@
+# models/cleaning.py
+
+import pandas as pd
+
+MAX_VARCHAR = 255
+
+def safe_trunc(s: str, length: int = MAX_VARCHAR):
+    """Trim s to at most length characters (if it’s a string)."""
+    if s is None:
+        return None
+    s = str(s)
+    return s if len(s) <= length else s[:length]
+
+# ------------------------------------------------------------------------------
+# Column-wise cleaners. Each takes a raw Series from the CSV and returns a typed
+# Series; anything unparseable becomes NA instead of raising.
+# ------------------------------------------------------------------------------
+
+def text(series):
+    """As a string column, with blanks turned into NA."""
+    s = series.astype('string')
+    return s.mask(s.str.strip() == '')
+
+def present(series):
+    """Mask of cells that are neither NA nor blank."""
+    return text(series).notna()
+
+def truncate(series, length=MAX_VARCHAR):
+    """Vectorized safe_trunc."""
+    return series.astype('string').str.slice(0, length)
+
+def by_value(series, parse):
+    """
+    Run a column cleaner once per distinct value and broadcast the result back;
+    prices, ratings and categories repeat across rows far more than they vary.
+    """
+    codes, uniques = pd.factorize(series.astype('string'))
+    parsed = parse(pd.Series(uniques, dtype='string')).array
+    return pd.Series(parsed.take(codes, allow_fill=True), index=series.index)
+
+def _money(s):
+    return pd.to_numeric(s.str.replace(r'[₹,\s]', '', regex=True), errors='coerce').astype('float64')
+
+def _percentage(s):
+    return pd.to_numeric(s.str.replace(r'[%\s]', '', regex=True), errors='coerce').astype('float64')
+
+def _rating(s):
+    return pd.to_numeric(s.str.strip(), errors='coerce').astype('float64')
+
+def _count(s):
+    s = s.str.replace(r'[,\s]', '', regex=True)
+    s = s.where(s.str.fullmatch(r'\d+').fillna(False))
+    return pd.to_numeric(s, errors='coerce').astype('Int64')
+
+def _main_category(s):
+    return text(s.str.split('|', n=1).str[0].str.strip())
+
+def money(series):
+    """'₹1,099' → 1099.0"""
+    return by_value(series, _money)
+
+def percentage(series):
+    """'64%' → 64.0"""
+    return by_value(series, _percentage)
+
+def rating(series):
+    """'4.2' → 4.2; junk such as '|' → NA"""
+    return by_value(series, _rating)
+
+def count(series):
+    """'24,269' → 24269; anything that isn't all digits → NA"""
+    return by_value(series, _count)
+
+def main_category(series):
+    """Only the first category before any '|'."""
+    return by_value(series, _main_category)
+
+# ------------------------------------------------------------------------------
+# Per-table frames, filtered and de-duplicated the way public.* expects them
+# (first row wins on each primary key).
+# ------------------------------------------------------------------------------
+
+def clean_categories(df):
+    cats = truncate(main_category(df['category'])).dropna().drop_duplicates()
+    return pd.DataFrame({'category_name': cats.values})
+
+def clean_products(df):
+    p = df[present(df['actual_price'])]
+    products = pd.DataFrame({
+        'product_id':          truncate(p['product_id'], 255),
+        'product_name':        truncate(p['product_name'], 255),
+        'category_name':       truncate(main_category(p['category']), 255),
+        'discounted_price':    money(p['discounted_price']),
+        'actual_price':        money(p['actual_price']),
+        'discount_percentage': percentage(p['discount_percentage']),
+        'rating':              rating(p['rating']),
+        'rating_count':        count(p['rating_count']),
+        'about_product':       text(p['about_product']),
+        'product_link':        text(p['product_link']),
+        'currency':            truncate(p['currency'], 10),
+    })
+    return products.drop_duplicates(subset='product_id').reset_index(drop=True)
+
+def clean_users(df):
+    u = df[['user_id', 'user_name']].drop_duplicates()
+    u = u[present(u['user_id']) & present(u['user_name'])]
+    users = pd.DataFrame({
+        'user_id':   truncate(u['user_id'], 255),
+        'user_name': truncate(u['user_name'], 255),
+    })
+    return users.drop_duplicates(subset='user_id').reset_index(drop=True)
+
+def clean_reviews(df):
+    r = df[['review_id', 'product_id', 'user_id', 'review_title', 'review_content']].drop_duplicates()
+    r = r[present(r['review_id']) & present(r['product_id']) & present(r['user_id'])]
+    reviews = pd.DataFrame({
+        'review_id':      truncate(r['review_id'], 255),
+        'product_id':     truncate(r['product_id'], 255),
+        'user_id':        truncate(r['user_id'], 255),
+        'review_title':   truncate(r['review_title'], 255),
+        'review_content': text(r['review_content']),
+    })
+    return reviews.drop_duplicates(subset='review_id').reset_index(drop=True)
+
+def clean_locations(df):
+    l = df[['product_id', 'country', 'city']].drop_duplicates()
+    l = l[present(l['product_id'])]
+    return pd.DataFrame({
+        'product_id': truncate(l['product_id'], 255),
+        'country':    truncate(l['country'], 100),
+        'city':       truncate(l['city'], 100),
+    }).reset_index(drop=True)
+
+def clean_frames(df):
+    """One cleaned, typed frame per public table, in load order."""
+    return {
+        'categories': clean_categories(df),
+        'products':   clean_products(df),
+        'users':      clean_users(df),
+        'reviews':    clean_reviews(df),
+        'locations':  clean_locations(df),
+    }
+
+def records(frame):
+    """Row tuples with NA as None, ready for cursor.execute parameters."""
+    obj = frame.astype(object)
+    return obj.where(frame.notna(), None).itertuples(index=False, name=None)
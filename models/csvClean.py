@@ -1,5 +1,13 @@
+# models/csvClean.py
+
+import argparse
 import csv
-import random
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 # Define countries and their cities
 country_cities = {
@@ -14,32 +22,163 @@ country_cities = {
     "Brazil": ["Sao Paulo", "Rio de Janeiro", "Brasilia"],
     "China": ["Beijing", "Shanghai", "Shenzhen"]
 }
+COUNTRIES = list(country_cities)
+
+CURRENCY = 'USD'
+DEFAULT_SEED = 0
+ADDED_FIELDS = ['currency', 'country', 'city']
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INPUT = os.path.join(THIS_DIR, 'amazon_products.csv')
+DEFAULT_OUTPUT = os.path.join(THIS_DIR, 'amazon_products_cleaned.csv')
+
+
+def assign_location(product_id, seed=DEFAULT_SEED):
+    """Pick (country, city) for a product from a hash of its id and the seed."""
+    digest = hashlib.blake2b(f"{seed}:{product_id}".encode('utf-8'), digest_size=8).digest()
+    h = int.from_bytes(digest, 'big')
+    country = COUNTRIES[h % len(COUNTRIES)]
+    cities = country_cities[country]
+    return country, cities[(h // len(COUNTRIES)) % len(cities)]
+
+
+def enrich_frame(df, seed=DEFAULT_SEED):
+    """
+    In-memory version of the cleaner for a pandas frame of amazon_products.csv:
+    adds the same currency/country/city columns the CSV output gets, so
+    models/database.py can clean and load in one pass.
+    """
+    df = df.copy()
+    locations = {pid: assign_location(pid, seed) for pid in df['product_id'].dropna().unique()}
+    df['currency'] = CURRENCY
+    df['country'] = df['product_id'].map(lambda pid: locations.get(pid, (None, None))[0])
+    df['city'] = df['product_id'].map(lambda pid: locations.get(pid, (None, None))[1])
+    return df
+
+
+def split_ranges(path, parts):
+    """
+    Split the data rows of a CSV into at most `parts` byte ranges that each
+    start and end on a record boundary. Quoted fields may contain newlines, so
+    a newline only ends a record when the number of quotes seen so far is even.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()  # header
+        pos = f.tell()
+        points = [pos]
+        targets = [pos + (size - pos) * i // parts for i in range(1, parts)]
+        in_quotes = False
+        for line in f:
+            pos += len(line)
+            in_quotes ^= bool(line.count(b'"') & 1)
+            if targets and not in_quotes and pos >= targets[0]:
+                points.append(pos)
+                targets = [t for t in targets if t > pos]
+    if points[-1] != size:
+        points.append(size)
+    return list(zip(points, points[1:]))
+
+
+def _lines(path, start, end):
+    """Decoded lines of `path` between two byte offsets on line boundaries."""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line.decode('utf-8')
+
+
+def clean_range(path, start, end, fieldnames, out_path, seed=DEFAULT_SEED, batch_size=10000):
+    """Clean one byte range of the input into `out_path`; returns rows written."""
+    pid_idx = fieldnames.index('product_id')
+    width = len(fieldnames)
+    written = 0
+    with open(out_path, mode='w', newline='', encoding='utf-8') as outfile:
+        writer = csv.writer(outfile)
+        batch = []
+        for row in csv.reader(_lines(path, start, end)):
+            if not row:
+                continue
+            row = (row + [''] * width)[:width]
+            batch.append(row + [CURRENCY, *assign_location(row[pid_idx], seed)])
+            if len(batch) >= batch_size:
+                writer.writerows(batch)
+                written += len(batch)
+                batch = []
+        writer.writerows(batch)
+        written += len(batch)
+    return written
+
+
+def _clean_range_job(args):
+    return clean_range(*args)
+
 
-# Read the input file
-input_filename = 'amazon_products.csv'
-output_filename = 'amazon_products_cleaned.csv'
+def clean_csv(input_filename=DEFAULT_INPUT, output_filename=DEFAULT_OUTPUT,
+              seed=DEFAULT_SEED, workers=None, batch_size=10000):
+    """
+    Add currency/country/city to every row of `input_filename`, splitting the
+    file across a process pool by byte range. The output is the same for a
+    given seed no matter how many workers are used.
+    """
+    workers = workers or os.cpu_count() or 1
+    started = time.perf_counter()
 
-with open(input_filename, mode='r', encoding='utf-8') as infile, \
-        open(output_filename, mode='w', newline='', encoding='utf-8') as outfile:
-    reader = csv.DictReader(infile)
+    with open(input_filename, mode='r', newline='', encoding='utf-8') as infile:
+        fieldnames = next(csv.reader(infile))
+    ranges = split_ranges(input_filename, workers)
 
-    # Add new fields to fieldnames
-    fieldnames = reader.fieldnames + ['currency', 'country', 'city']
+    out_dir = os.path.dirname(os.path.abspath(output_filename))
+    tmp_dir = tempfile.mkdtemp(prefix='csvclean-', dir=out_dir)
+    try:
+        jobs = [
+            (input_filename, start, end, fieldnames,
+             os.path.join(tmp_dir, f"part-{i:04d}.csv"), seed, batch_size)
+            for i, (start, end) in enumerate(ranges)
+        ]
+        if len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                counts = list(pool.map(_clean_range_job, jobs))
+        else:
+            counts = [_clean_range_job(job) for job in jobs]
 
-    writer = csv.DictWriter(outfile, fieldnames=fieldnames)
-    writer.writeheader()
+        # stitch the parts back together in input order
+        with open(output_filename, mode='w', newline='', encoding='utf-8') as outfile:
+            csv.writer(outfile).writerow(fieldnames + ADDED_FIELDS)
+            for job in jobs:
+                with open(job[4], mode='r', newline='', encoding='utf-8') as part:
+                    shutil.copyfileobj(part, outfile)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
-    for row in reader:
-        # Assign USD as currency
-        row['currency'] = 'USD'
+    rows = sum(counts)
+    elapsed = time.perf_counter() - started
+    mb = os.path.getsize(input_filename) / 1e6
+    print(f"Processed {rows:,} rows ({mb:,.1f} MB) with {len(jobs)} worker(s) in {elapsed:.2f}s "
+          f"({rows / elapsed if elapsed else 0:,.0f} rows/s, {mb / elapsed if elapsed else 0:,.1f} MB/s)")
+    print(f"Processed file saved as {output_filename}")
+    return rows
 
-        # Randomly select a country and city
-        country = random.choice(list(country_cities.keys()))
-        city = random.choice(country_cities[country])
 
-        row['country'] = country
-        row['city'] = city
+def main():
+    parser = argparse.ArgumentParser(description="Add currency/country/city to amazon_products.csv")
+    parser.add_argument('--input', default=DEFAULT_INPUT)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                        help="seed for the product → country/city assignment")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="processes to split the input across (default: CPU count)")
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help="rows buffered per write")
+    args = parser.parse_args()
+    clean_csv(args.input, args.output, seed=args.seed,
+              workers=args.workers, batch_size=args.batch_size)
 
-        writer.writerow(row)
 
-print(f"Processed file saved as {output_filename}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
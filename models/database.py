@@ -1,22 +1,18 @@
 # models/database.py
 
+import argparse
+import io
 import os
-import psycopg2
+import time
 import pandas as pd
-from config.settings import DB_CONFIG
-
-MAX_VARCHAR = 255
-
-def safe_trunc(s: str, length: int = MAX_VARCHAR):
-    """Trim s to at most length characters (if it’s a string)."""
-    if s is None:
-        return None
-    s = str(s)
-    return s if len(s) <= length else s[:length]
+from config.connection import connection, get_connection, release_connection
+from config.scheduler import run_stages
+from models.cleaning import clean_frames, records
+from models.csvClean import DEFAULT_SEED, enrich_frame
 
 def create_database_connection():
     try:
-        return psycopg2.connect(**DB_CONFIG)
+        return get_connection('source_load', bulk=True)
     except Exception as e:
         print(f"Error connecting to database: {e}")
         return None
@@ -34,6 +30,10 @@ def clear_data(conn):
         RESTART IDENTITY
         CASCADE;
     """)
+    # a full reload invalidates the fingerprints used by --refresh
+    cur.execute("SELECT to_regclass('public.source_fingerprints');")
+    if cur.fetchone()[0]:
+        cur.execute("TRUNCATE source_fingerprints;")
     conn.commit()
     cur.close()
 
@@ -82,7 +82,25 @@ def create_tables(conn):
             country VARCHAR(100),
             city VARCHAR(100)
         );
+        """,
         """
+        CREATE TABLE IF NOT EXISTS source_fingerprints (
+            table_name VARCHAR(32) NOT NULL,
+            natural_key TEXT NOT NULL,
+            row_hash BIGINT NOT NULL,
+            PRIMARY KEY (table_name, natural_key)
+        );
+        """,
+        # locations have no key column; --refresh looks them up by KEY_SQL
+        f"""
+        CREATE INDEX IF NOT EXISTS idx_locations_natural_key
+            ON locations (({location_key('locations')}));
+        """,
+        # the FK columns, so deleting a product or user (--refresh, mock.py)
+        # finds its reviews and locations without scanning them
+        "CREATE INDEX IF NOT EXISTS idx_reviews_product_id ON reviews (product_id);",
+        "CREATE INDEX IF NOT EXISTS idx_reviews_user_id ON reviews (user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_locations_product_id ON locations (product_id);",
     )
     cur = conn.cursor()
     for cmd in commands:
@@ -90,62 +108,178 @@ def create_tables(conn):
     conn.commit()
     cur.close()
 
-def insert_data_from_csv(conn, csv_file_path):
-    df = pd.read_csv(csv_file_path).where(pd.notnull(pd.read_csv(csv_file_path)), None)
+def read_csv_chunks(csv_file_path, chunksize=None):
+    """Yield the CSV as one frame, or as frames of at most `chunksize` rows."""
+    if chunksize:
+        yield from pd.read_csv(csv_file_path, dtype=str, chunksize=chunksize)
+    else:
+        yield pd.read_csv(csv_file_path, dtype=str)
 
-    # only take the first category before any '|'
-    df['main_category'] = df['category'].apply(
-        lambda c: c.split('|')[0].strip() if c else None
-    )
+def location_hashes(locations):
+    return pd.util.hash_pandas_object(locations, index=False).tolist()
 
-    cur = conn.cursor()
+def drop_seen_locations(locations, seen):
+    """
+    Locations have no natural key in the database, so de-duplication across
+    chunks is tracked here: drop rows an earlier chunk already loaded (see
+    remember_locations). Only a 64-bit hash per row is kept, so the state stays
+    small next to the chunks themselves.
+    """
+    keys = location_hashes(locations)
+    return locations[[k not in seen for k in keys]].reset_index(drop=True)
+
+def remember_locations(locations, seen):
+    """Record locations once they are loaded, not before."""
+    seen.update(location_hashes(locations))
 
-    # 1) categories
-    for cat in df['main_category'].dropna().unique():
-        cat = safe_trunc(cat)
+# Child rows and the parent keys they reference: (column, parent table)
+CHILD_PARENTS = {
+    'reviews':   (('product_id', 'products'), ('user_id', 'users')),
+    'locations': (('product_id', 'products'),),
+}
+
+def defer_orphans(frames, deferred, loaded):
+    """
+    Hold back the reviews and locations whose product (or user) is neither
+    loaded yet nor in this chunk: a product's only row with a price can come in
+    a later chunk than its reviews. Rows held back from the previous chunk go
+    first, so the first occurrence of a key still wins. `loaded` holds the
+    parent keys loaded so far; `deferred` is refilled with what is held back.
+    """
+    available = {parent: loaded[parent] | set(frames[parent][col].dropna())
+                 for parent, col in (('products', 'product_id'), ('users', 'user_id'))}
+    for name, refs in CHILD_PARENTS.items():
+        rows = pd.concat([deferred[name], frames[name]], ignore_index=True) \
+            if name in deferred else frames[name]
+        rows = rows.drop_duplicates(subset='review_id' if name == 'reviews' else None)
+        ready = pd.Series(True, index=rows.index)
+        for col, parent in refs:
+            ready &= rows[col].isin(available[parent])
+        frames[name] = rows[ready].reset_index(drop=True)
+        deferred[name] = rows[~ready].reset_index(drop=True)
+
+# Load order within a batch. users don't need anything, reviews need their
+# product and user, locations only their product.
+PHASES = ('categories', 'products', 'users', 'reviews', 'locations')
+PHASE_DEPS = {
+    'categories': (),
+    'products':   ('categories',),
+    'users':      (),
+    'reviews':    ('products', 'users'),
+    'locations':  ('products',),
+}
+
+def insert_data_from_csv(conn, csv_file_path, bulk=False, chunksize=None, workers=1,
+                         raw=False, seed=DEFAULT_SEED):
+    """
+    Load the cleaned CSV into public.*. With `chunksize`, the file is read and
+    loaded `chunksize` rows at a time so memory stays bounded; the result is the
+    same as loading it in one go (the primary keys de-duplicate across chunks
+    through ON CONFLICT, locations through `seen_locations`, and reviews and
+    locations wait for a chunk that brings their product). With `workers` > 1
+    independent phases run concurrently on pooled connections. With `raw`, the
+    file is the untouched amazon_products.csv and csvClean's enrichment is
+    applied to each chunk on the way in.
+    """
+    seen_locations = set()
+    loaded = {'products': set(), 'users': set()}
+    deferred = {}
+    stats = {}
+    phase_secs = dict.fromkeys(PHASES, 0.0)
+
+    def load(frames):
+        frames['locations'] = drop_seen_locations(frames['locations'], seen_locations)
+        for name, secs in load_frames(conn, frames, bulk, stats, workers).items():
+            phase_secs[name] += secs
+        remember_locations(frames['locations'], seen_locations)
+
+    for n, chunk in enumerate(read_csv_chunks(csv_file_path, chunksize), 1):
+        if raw:
+            chunk = enrich_frame(chunk, seed)
+        frames = clean_frames(chunk)
+        defer_orphans(frames, deferred, loaded)
+        load(frames)
+        loaded['products'].update(frames['products']['product_id'].dropna())
+        loaded['users'].update(frames['users']['user_id'].dropna())
+        if chunksize:
+            print(f"  chunk {n}: {len(chunk):,} CSV rows loaded")
+        del chunk
+
+    # children whose parent never came: load them anyway, so they fail or are
+    # skipped exactly as in a single-shot load
+    if any(len(rows) for rows in deferred.values()):
+        load({name: deferred[name] if name in deferred else frames[name].iloc[:0]
+              for name in PHASES})
+        print(f"  {sum(len(rows) for rows in deferred.values()):,} reviews/locations "
+              f"without a loaded product or user")
+
+    for name, secs in phase_secs.items():
+        print(f"  phase {name:<10} {secs:7.2f}s")
+    if bulk:
+        report_bulk_stats(stats)
+    print("Data inserted successfully!")
+
+def load_frames(conn, frames, bulk, stats, workers=1):
+    """
+    Load one batch of cleaned frames, phase by phase. Returns wall-clock
+    seconds per phase.
+    """
+    def load(c, name):
+        if bulk:
+            copied, inserted, secs = bulk_load_table(c, name, frames[name])
+            total = stats.setdefault(name, [0, 0, 0.0])
+            total[0] += copied
+            total[1] += inserted
+            total[2] += secs
+        else:
+            ROW_LOADERS[name](c, frames[name])
+
+    if workers <= 1:
+        timings = {}
+        for name in PHASES:
+            start = time.perf_counter()
+            load(conn, name)
+            timings[name] = time.perf_counter() - start
+        return timings
+
+    def on_pooled_connection(name):
+        def run():
+            with connection(f"source_load:{name}", bulk=True) as c:
+                load(c, name)
+        return run
+
+    return run_stages({name: on_pooled_connection(name) for name in PHASES},
+                      PHASE_DEPS, max_workers=workers)
+
+# ------------------------------------------------------------------------------
+# Row-by-row INSERTs, one function per public table
+# ------------------------------------------------------------------------------
+
+def insert_categories(conn, frame):
+    cur = conn.cursor()
+    for (cat,) in records(frame):
         cur.execute("""
             INSERT INTO categories (category_name)
             VALUES (%s)
             ON CONFLICT (category_name) DO NOTHING
         """, (cat,))
     conn.commit()
+    cur.close()
 
-    # 2) products
-    def clean_money(x):
-        if not x: return None
-        s = str(x).replace('₹','').replace(',','').strip()
-        return float(s) if s else None
-
-    for _, row in df.iterrows():
-        if not row['actual_price']:
-            continue
+def insert_products(conn, frame):
+    cur = conn.cursor()
+    for row in records(frame):
+        (pid, pname, cat_name, dp, ap, disc_pct,
+         rating, rc, about, link, currency) = row
 
         # lookup category_id
-        if row['main_category']:
+        if cat_name:
             cur.execute("SELECT category_id FROM categories WHERE category_name = %s",
-                        (safe_trunc(row['main_category']),))
+                        (cat_name,))
             cat_id = cur.fetchone()[0]
         else:
             cat_id = None
 
-        dp = clean_money(row['discounted_price'])
-        ap = clean_money(row['actual_price'])
-
-        disc_pct = None
-        if row['discount_percentage']:
-            pct = str(row['discount_percentage']).replace('%','').strip()
-            disc_pct = float(pct) if pct else None
-
-        try:
-            rating = float(row['rating']) if row['rating'] else None
-        except:
-            rating = None
-
-        rc = None
-        if row['rating_count']:
-            tmp = str(row['rating_count']).replace(',','').strip()
-            rc = int(tmp) if tmp.isdigit() else None
-
         cur.execute("""
             INSERT INTO products (
                 product_id, product_name, category_id,
@@ -155,83 +289,507 @@ def insert_data_from_csv(conn, csv_file_path):
             ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
             ON CONFLICT (product_id) DO NOTHING
         """, (
-            safe_trunc(row['product_id'], 255),
-            safe_trunc(row['product_name'], 255),
-            cat_id,
+            pid, pname, cat_id,
             dp, ap,
             disc_pct,
             rating, rc,
-            row['about_product'],   # TEXT, no truncation needed
-            row['product_link'],    # TEXT
-            safe_trunc(row['currency'], 10)
+            about,      # TEXT, no truncation needed
+            link,       # TEXT
+            currency
         ))
     conn.commit()
+    cur.close()
 
-    # 3) users
-    for _, r in df[['user_id','user_name']].drop_duplicates().iterrows():
-        if r['user_id'] and r['user_name']:
-            cur.execute("""
-                INSERT INTO users (user_id, user_name)
-                VALUES (%s,%s)
-                ON CONFLICT (user_id) DO NOTHING
-            """, (
-                safe_trunc(r['user_id'], 255),
-                safe_trunc(r['user_name'], 255),
-            ))
+def insert_users(conn, frame):
+    cur = conn.cursor()
+    for row in records(frame):
+        cur.execute("""
+            INSERT INTO users (user_id, user_name)
+            VALUES (%s,%s)
+            ON CONFLICT (user_id) DO NOTHING
+        """, row)
     conn.commit()
+    cur.close()
 
-    # 4) reviews
-    for _, r in df[['review_id','product_id','user_id','review_title','review_content']].drop_duplicates().iterrows():
-        if r['review_id'] and r['product_id'] and r['user_id']:
-            cur.execute("""
-                INSERT INTO reviews
-                  (review_id, product_id, user_id, review_title, review_content)
-                VALUES (%s,%s,%s,%s,%s)
-                ON CONFLICT (review_id) DO NOTHING
-            """, (
-                safe_trunc(r['review_id'],255),
-                safe_trunc(r['product_id'],255),
-                safe_trunc(r['user_id'],255),
-                safe_trunc(r['review_title'],255),
-                r['review_content']  # TEXT
-            ))
+def insert_reviews(conn, frame):
+    cur = conn.cursor()
+    for row in records(frame):
+        cur.execute("""
+            INSERT INTO reviews
+              (review_id, product_id, user_id, review_title, review_content)
+            VALUES (%s,%s,%s,%s,%s)
+            ON CONFLICT (review_id) DO NOTHING
+        """, row)
     conn.commit()
+    cur.close()
 
-    # 5) locations
-    for _, r in df[['product_id','country','city']].drop_duplicates().iterrows():
-        if not r['product_id']:
-            continue
-        cur.execute("SELECT 1 FROM products WHERE product_id = %s", (r['product_id'],))
+def insert_locations(conn, frame):
+    cur = conn.cursor()
+    for pid, country, city in records(frame):
+        cur.execute("SELECT 1 FROM products WHERE product_id = %s", (pid,))
         if cur.fetchone():
             cur.execute("""
                 INSERT INTO locations (product_id, country, city)
                 VALUES (%s,%s,%s)
-            """, (
-                safe_trunc(r['product_id'],255),
-                safe_trunc(r['country'],100),
-                safe_trunc(r['city'],100),
-            ))
+            """, (pid, country, city))
     conn.commit()
+    cur.close()
+
+ROW_LOADERS = {
+    'categories': insert_categories,
+    'products':   insert_products,
+    'users':      insert_users,
+    'reviews':    insert_reviews,
+    'locations':  insert_locations,
+}
+
+# ------------------------------------------------------------------------------
+# Bulk ingest: COPY each cleaned frame into a temp table, then merge it into
+# public.* with one INSERT ... SELECT per table.
+# ------------------------------------------------------------------------------
+
+# temp-table layout per target; `seq` keeps CSV order so SERIAL ids and
+# "first row wins" match the row-by-row loader
+BULK_STAGING = {
+    'categories': """
+        seq BIGINT,
+        category_name VARCHAR(255)
+    """,
+    'products': """
+        seq BIGINT,
+        product_id VARCHAR(255),
+        product_name VARCHAR(255),
+        category_name VARCHAR(255),
+        discounted_price DECIMAL(10,2),
+        actual_price DECIMAL(10,2),
+        discount_percentage DECIMAL(5,2),
+        rating DECIMAL(3,2),
+        rating_count INTEGER,
+        about_product TEXT,
+        product_link TEXT,
+        currency VARCHAR(10)
+    """,
+    'users': """
+        seq BIGINT,
+        user_id VARCHAR(255),
+        user_name VARCHAR(255)
+    """,
+    'reviews': """
+        seq BIGINT,
+        review_id VARCHAR(255),
+        product_id VARCHAR(255),
+        user_id VARCHAR(255),
+        review_title VARCHAR(255),
+        review_content TEXT
+    """,
+    'locations': """
+        seq BIGINT,
+        product_id VARCHAR(255),
+        country VARCHAR(100),
+        city VARCHAR(100)
+    """,
+}
+
+BULK_MERGE = {
+    'categories': """
+        INSERT INTO categories (category_name)
+        SELECT t.category_name
+          FROM tmp_categories t
+         ORDER BY t.seq
+        ON CONFLICT (category_name) DO NOTHING
+    """,
+    'products': """
+        INSERT INTO products (
+            product_id, product_name, category_id,
+            discounted_price, actual_price,
+            discount_percentage, rating, rating_count,
+            about_product, product_link, currency
+        )
+        SELECT t.product_id, t.product_name, c.category_id,
+               t.discounted_price, t.actual_price,
+               t.discount_percentage, t.rating, t.rating_count,
+               t.about_product, t.product_link, t.currency
+          FROM tmp_products t
+          LEFT JOIN categories c
+            ON c.category_name = t.category_name
+         ORDER BY t.seq
+        ON CONFLICT (product_id) DO NOTHING
+    """,
+    'users': """
+        INSERT INTO users (user_id, user_name)
+        SELECT t.user_id, t.user_name
+          FROM tmp_users t
+         ORDER BY t.seq
+        ON CONFLICT (user_id) DO NOTHING
+    """,
+    # reviews/locations whose product (or user) never made it in are skipped
+    'reviews': """
+        INSERT INTO reviews
+          (review_id, product_id, user_id, review_title, review_content)
+        SELECT t.review_id, t.product_id, t.user_id, t.review_title, t.review_content
+          FROM tmp_reviews t
+         WHERE EXISTS (SELECT 1 FROM products p WHERE p.product_id = t.product_id)
+           AND EXISTS (SELECT 1 FROM users u WHERE u.user_id = t.user_id)
+         ORDER BY t.seq
+        ON CONFLICT (review_id) DO NOTHING
+    """,
+    'locations': """
+        INSERT INTO locations (product_id, country, city)
+        SELECT t.product_id, t.country, t.city
+          FROM tmp_locations t
+         WHERE EXISTS (SELECT 1 FROM products p WHERE p.product_id = t.product_id)
+         ORDER BY t.seq
+    """,
+}
+
+def copy_frame(cur, table, frame):
+    """Stream `frame` into `table` with COPY FROM STDIN (CSV, \\N for NULL)."""
+    buf = io.StringIO()
+    frame.to_csv(buf, index=False, header=False, na_rep='\\N')
+    buf.seek(0)
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(frame.columns)}) "
+        f"FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        buf
+    )
+
+def bulk_load_table(conn, name, frame, merge_sql=None, commit=True):
+    """
+    COPY one cleaned frame into tmp_<name> and merge it into public.<name>
+    (with BULK_MERGE[name] unless `merge_sql` is given).
+    Returns (rows copied, rows merged, seconds).
+    """
+    start = time.perf_counter()
+    frame = frame.copy()
+    frame.insert(0, 'seq', range(len(frame)))
 
+    cur = conn.cursor()
+    cur.execute(f"CREATE TEMP TABLE tmp_{name} ({BULK_STAGING[name]});")
+    copy_frame(cur, f"tmp_{name}", frame)
+    cur.execute(merge_sql or BULK_MERGE[name])
+    merged = cur.rowcount
+    cur.execute(f"DROP TABLE tmp_{name};")
+    if commit:
+        conn.commit()
     cur.close()
-    print("Data inserted successfully!")
+    return len(frame), merged, time.perf_counter() - start
+
+def report_bulk_stats(stats):
+    for name in PHASES:
+        copied, inserted, secs = stats.get(name, (0, 0, 0.0))
+        rate = copied / secs if secs else 0
+        print(f"  {name:<10} {copied:>9,} copied  {inserted:>9,} inserted  "
+              f"{secs:7.2f}s  {rate:>11,.0f} rows/s")
+
+# ------------------------------------------------------------------------------
+# Incremental refresh: hash every incoming row by natural key, compare with the
+# fingerprints stored by the previous refresh, and write only what changed.
+# Rows are upserted in place, so category_id/location_id never get renumbered.
+# ------------------------------------------------------------------------------
+
+NATURAL_KEYS = {
+    'categories': ('category_name',),
+    'products':   ('product_id',),
+    'users':      ('user_id',),
+    'reviews':    ('review_id',),
+    'locations':  ('product_id', 'country', 'city'),
+}
+
+def location_key(alias):
+    """
+    A location's natural key in SQL, matching fingerprint(). Spelled with ||
+    rather than concat_ws (which is only STABLE) so idx_locations_natural_key
+    can index it.
+    """
+    return (f"coalesce({alias}.product_id, '') || chr(31) || coalesce({alias}.country, '')"
+            f" || chr(31) || coalesce({alias}.city, '')")
+
+# SQL spelling of the natural key, matching fingerprint() below
+KEY_SQL = {
+    'categories': "t.category_name",
+    'products':   "t.product_id",
+    'users':      "t.user_id",
+    'reviews':    "t.review_id",
+    'locations':  location_key('t'),
+}
+
+REFRESH_UPSERT = {
+    'categories': BULK_MERGE['categories'],
+    'products': """
+        INSERT INTO products (
+            product_id, product_name, category_id,
+            discounted_price, actual_price,
+            discount_percentage, rating, rating_count,
+            about_product, product_link, currency
+        )
+        SELECT t.product_id, t.product_name, c.category_id,
+               t.discounted_price, t.actual_price,
+               t.discount_percentage, t.rating, t.rating_count,
+               t.about_product, t.product_link, t.currency
+          FROM tmp_products t
+          LEFT JOIN categories c
+            ON c.category_name = t.category_name
+         ORDER BY t.seq
+        ON CONFLICT (product_id) DO UPDATE
+           SET product_name        = EXCLUDED.product_name,
+               category_id         = EXCLUDED.category_id,
+               discounted_price    = EXCLUDED.discounted_price,
+               actual_price        = EXCLUDED.actual_price,
+               discount_percentage = EXCLUDED.discount_percentage,
+               rating              = EXCLUDED.rating,
+               rating_count        = EXCLUDED.rating_count,
+               about_product       = EXCLUDED.about_product,
+               product_link        = EXCLUDED.product_link,
+               currency            = EXCLUDED.currency
+    """,
+    'users': """
+        INSERT INTO users (user_id, user_name)
+        SELECT t.user_id, t.user_name
+          FROM tmp_users t
+         ORDER BY t.seq
+        ON CONFLICT (user_id) DO UPDATE
+           SET user_name = EXCLUDED.user_name
+    """,
+    'reviews': """
+        INSERT INTO reviews
+          (review_id, product_id, user_id, review_title, review_content)
+        SELECT t.review_id, t.product_id, t.user_id, t.review_title, t.review_content
+          FROM tmp_reviews t
+         WHERE EXISTS (SELECT 1 FROM products p WHERE p.product_id = t.product_id)
+           AND EXISTS (SELECT 1 FROM users u WHERE u.user_id = t.user_id)
+         ORDER BY t.seq
+        ON CONFLICT (review_id) DO UPDATE
+           SET product_id     = EXCLUDED.product_id,
+               user_id        = EXCLUDED.user_id,
+               review_title   = EXCLUDED.review_title,
+               review_content = EXCLUDED.review_content
+    """,
+    # a location's key is its whole content: it is only ever added or removed
+    'locations': f"""
+        INSERT INTO locations (product_id, country, city)
+        SELECT t.product_id, t.country, t.city
+          FROM tmp_locations t
+         WHERE EXISTS (SELECT 1 FROM products p WHERE p.product_id = t.product_id)
+           AND NOT EXISTS (SELECT 1 FROM locations l
+                            WHERE {location_key('l')} = {location_key('t')})
+         ORDER BY t.seq
+    """,
+}
+
+PRIMARY_KEYS = {
+    'categories': 'category_id',
+    'products':   'product_id',
+    'users':      'user_id',
+}
+
+# What deleting a parent does to the rows still referencing it. Rows inserted
+# outside the refresh (models/mock.py) or skipped by an FK filter above have
+# no fingerprint, so nothing else would delete them: reviews and locations go
+# with their product or user, and a product just loses its category, as the
+# upsert does for a category it doesn't know. {gone} selects the parent keys.
+# Every row hit here loses its fingerprint, so the next refresh rewrites it
+# from the CSV.
+ON_PARENT_DELETE = {
+    'categories': (('products',  "UPDATE products t SET category_id = NULL WHERE t.category_id IN ({gone})"),),
+    'products':   (('reviews',   "DELETE FROM reviews   t WHERE t.product_id IN ({gone})"),
+                   ('locations', "DELETE FROM locations t WHERE t.product_id IN ({gone})")),
+    'users':      (('reviews',   "DELETE FROM reviews   t WHERE t.user_id    IN ({gone})"),),
+}
+
+def fingerprint(name, frame):
+    """(natural_key, row_hash) for every row of a cleaned frame."""
+    cols = NATURAL_KEYS[name]
+    keys = frame[cols[0]].astype('string').fillna('')
+    for col in cols[1:]:
+        keys = keys + '\x1f' + frame[col].astype('string').fillna('')
+    hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy().view('int64')
+    return pd.DataFrame({'natural_key': keys.to_numpy(), 'row_hash': hashes})
+
+def diff_frame(conn, name, frame):
+    """
+    Record this batch's keys in incoming_<name> and return only the rows that
+    are new or whose hash differs from the stored fingerprint. A key already
+    seen in an earlier batch keeps its first row, as in a full load.
+    """
+    fp = fingerprint(name, frame)
+    cur = conn.cursor()
+    cur.execute("TRUNCATE batch_fingerprints;")
+    copy_frame(cur, "batch_fingerprints", fp)
+    cur.execute(f"""
+        WITH added AS (
+            INSERT INTO incoming_{name} (natural_key, row_hash, changed)
+            SELECT b.natural_key, b.row_hash, f.row_hash IS DISTINCT FROM b.row_hash
+              FROM batch_fingerprints b
+              LEFT JOIN source_fingerprints f
+                ON f.table_name  = %s
+               AND f.natural_key = b.natural_key
+            ON CONFLICT (natural_key) DO NOTHING
+            RETURNING natural_key, changed
+        )
+        SELECT natural_key FROM added WHERE changed;
+    """, (name,))
+    changed = {row[0] for row in cur.fetchall()}
+    cur.close()
+    return frame[fp['natural_key'].isin(changed).to_numpy()]
+
+def refresh_data_from_csv(conn, csv_file_path, chunksize=None, raw=False, seed=DEFAULT_SEED):
+    """
+    Bring public.* in line with the CSV by applying only inserts, updates and
+    deletes, all in one transaction. Rows that were never fingerprinted (e.g.
+    the first refresh after a full load) are upserted, never duplicated.
+    """
+    start = time.perf_counter()
+    cur = conn.cursor()
+    cur.execute("CREATE TEMP TABLE batch_fingerprints (natural_key TEXT, row_hash BIGINT);")
+    for name in PHASES:
+        cur.execute(f"""
+            CREATE TEMP TABLE incoming_{name} (
+                natural_key TEXT PRIMARY KEY,
+                row_hash BIGINT NOT NULL,
+                changed BOOLEAN NOT NULL
+            );
+        """)
+
+    written = dict.fromkeys(PHASES, 0)
+    for chunk in read_csv_chunks(csv_file_path, chunksize):
+        if raw:
+            chunk = enrich_frame(chunk, seed)
+        frames = clean_frames(chunk)
+        for name in PHASES:
+            changed = diff_frame(conn, name, frames[name])
+            if len(changed):
+                _, merged, _ = bulk_load_table(conn, name, changed,
+                                               merge_sql=REFRESH_UPSERT[name], commit=False)
+                written[name] += merged
+        del chunk, frames
+
+    # keys that were fingerprinted last time but are no longer in the CSV;
+    # children go first so the FKs never see an orphan, including children
+    # that have no fingerprint of their own (ON_PARENT_DELETE). Rows hit
+    # through a parent are collected in refresh_touched.
+    cur.execute("""
+        CREATE TEMP TABLE refresh_gone (
+            table_name VARCHAR(32), natural_key TEXT, PRIMARY KEY (table_name, natural_key));
+        CREATE TEMP TABLE refresh_touched (
+            table_name VARCHAR(32), natural_key TEXT, PRIMARY KEY (table_name, natural_key));
+    """)
+    deleted = dict.fromkeys(PHASES, 0)
+    for name in reversed(PHASES):
+        cur.execute(f"""
+            INSERT INTO refresh_gone (table_name, natural_key)
+            SELECT f.table_name, f.natural_key
+              FROM source_fingerprints f
+             WHERE f.table_name = %(name)s
+               AND NOT EXISTS (SELECT 1 FROM incoming_{name} i
+                                WHERE i.natural_key = f.natural_key);
+        """, {'name': name})
+        gone = "SELECT g.natural_key FROM refresh_gone g WHERE g.table_name = %(name)s"
+        for child, sql in ON_PARENT_DELETE.get(name, ()):
+            parents = f"SELECT t.{PRIMARY_KEYS[name]} FROM {name} t WHERE {KEY_SQL[name]} IN ({gone})"
+            cur.execute(f"""
+                WITH hit AS ({sql.format(gone=parents)} RETURNING {KEY_SQL[child]} AS natural_key)
+                INSERT INTO refresh_touched (table_name, natural_key)
+                SELECT DISTINCT %(child)s, natural_key FROM hit
+                ON CONFLICT DO NOTHING;
+            """, {'name': name, 'child': child})
+            if sql.startswith("DELETE"):
+                deleted[child] += cur.rowcount
+        cur.execute(f"""
+            DELETE FROM {name} t
+             WHERE {KEY_SQL[name]} IN ({gone});
+        """, {'name': name})
+        deleted[name] += cur.rowcount
+
+    # store the new fingerprints, touching only the keys this refresh saw
+    # change, deleted or hit through a parent. A changed row the upsert
+    # skipped (a review or location whose product is missing) keeps no
+    # fingerprint, so the next refresh tries it again.
+    for name in PHASES:
+        cur.execute(f"""
+            DELETE FROM source_fingerprints f
+             WHERE f.table_name = %(name)s
+               AND f.natural_key IN (
+                     SELECT g.natural_key FROM refresh_gone g WHERE g.table_name = %(name)s
+                     UNION ALL
+                     SELECT d.natural_key FROM refresh_touched d WHERE d.table_name = %(name)s
+                     UNION ALL
+                     SELECT i.natural_key FROM incoming_{name} i
+                      WHERE i.changed
+                        AND NOT EXISTS (SELECT 1 FROM {name} t
+                                         WHERE {KEY_SQL[name]} = i.natural_key));
+        """, {'name': name})
+        cur.execute(f"""
+            INSERT INTO source_fingerprints (table_name, natural_key, row_hash)
+            SELECT %(name)s, i.natural_key, i.row_hash
+              FROM incoming_{name} i
+             WHERE i.changed
+               AND EXISTS (SELECT 1 FROM {name} t
+                            WHERE {KEY_SQL[name]} = i.natural_key)
+               AND NOT EXISTS (SELECT 1 FROM refresh_touched d
+                                WHERE d.table_name = %(name)s AND d.natural_key = i.natural_key)
+            ON CONFLICT (table_name, natural_key) DO UPDATE
+               SET row_hash = EXCLUDED.row_hash;
+        """, {'name': name})
+
+    cur.execute("SELECT " + ", ".join(
+        f"(SELECT COUNT(*) FROM incoming_{n}), (SELECT COUNT(*) FROM incoming_{n} WHERE changed)"
+        for n in PHASES) + ";")
+    counts = cur.fetchone()
+    for name in PHASES:
+        cur.execute(f"DROP TABLE incoming_{name};")
+    cur.execute("DROP TABLE batch_fingerprints, refresh_gone, refresh_touched;")
+    conn.commit()
+    cur.close()
+
+    for i, name in enumerate(PHASES):
+        seen, changed = counts[2 * i], counts[2 * i + 1]
+        print(f"  {name:<10} {seen:>9,} in CSV  {changed:>9,} new/changed  "
+              f"{written[name]:>9,} written  {deleted[name]:>9,} deleted")
+    print(f"Refresh completed in {time.perf_counter() - start:.2f}s.")
 
 def main():
+    parser = argparse.ArgumentParser(description="Load amazon_products_cleaned.csv into public.*")
+    parser.add_argument('--bulk', action='store_true',
+                        help="COPY each table through a temp table instead of row-by-row INSERTs")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="stream the CSV this many rows at a time (default: whole file)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="load independent tables concurrently on this many connections")
+    parser.add_argument('--raw', action='store_true',
+                        help="load amazon_products.csv directly, cleaning it on the fly")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                        help="seed for the country/city assignment when using --raw")
+    parser.add_argument('--refresh', action='store_true',
+                        help="apply only the rows that changed since the last refresh "
+                             "instead of TRUNCATE + full reload")
+    args = parser.parse_args()
+    if args.refresh and (args.bulk or args.workers != 1):
+        parser.error("--refresh always stages the changed rows through COPY on one "
+                     "connection; it takes neither --bulk nor --workers")
+
     THIS_DIR = os.path.dirname(os.path.abspath(__file__))
-    csv_path = os.path.join(THIS_DIR, 'amazon_products_cleaned.csv')
+    csv_name = 'amazon_products.csv' if args.raw else 'amazon_products_cleaned.csv'
+    csv_path = os.path.join(THIS_DIR, csv_name)
 
     conn = create_database_connection()
     if conn:
-        # 0) wipe out _all_ existing rows:
-        clear_data(conn)
+        if args.refresh:
+            # only touch what changed; ids stay as they are
+            create_tables(conn)
+            refresh_data_from_csv(conn, csv_path, chunksize=args.chunksize,
+                                  raw=args.raw, seed=args.seed)
+        else:
+            # 0) wipe out _all_ existing rows:
+            clear_data(conn)
 
-        # 1) ensure tables exist
-        create_tables(conn)
+            # 1) ensure tables exist
+            create_tables(conn)
 
-        # 2) load fresh
-        insert_data_from_csv(conn, csv_path)
+            # 2) load fresh
+            insert_data_from_csv(conn, csv_path, bulk=args.bulk, chunksize=args.chunksize,
+                                 workers=args.workers, raw=args.raw, seed=args.seed)
 
-        conn.close()
+        release_connection(conn)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
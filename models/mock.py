@@ -1,27 +1,14 @@
 # etl_scripts/add_mock_data.py
 
-import psycopg2
-from config.settings import DB_CONFIG
+import pandas as pd
+from config.connection import get_connection, release_connection
 from datetime import datetime
-
-MAX_VARCHAR = 255
-
-def safe_trunc(s: str, length: int = MAX_VARCHAR):
-    """Trim s to at most `length` characters."""
-    if s is None:
-        return None
-    s = str(s)
-    return s if len(s) <= length else s[:length]
-
-def clean_money(x):
-    """Strip currency symbols/commas and convert to float."""
-    if x is None:
-        return None
-    s = str(x).replace('₹','').replace(',','').strip()
-    return float(s) if s else None
+from models.cleaning import (
+    safe_trunc, clean_products, clean_users, clean_reviews, clean_locations, records
+)
 
 def main():
-    conn = psycopg2.connect(**DB_CONFIG)
+    conn = get_connection('mock')
     cur = conn.cursor()
 
     # --------------------------------------------------------------------------
@@ -88,8 +75,9 @@ def main():
             "currency": "USD"
         },
     ]
-    for p in mock_products:
-        cat_id = cat_map.get(p["category"])
+    for row in records(clean_products(pd.DataFrame(mock_products))):
+        (pid, pname, cat_name, dp, ap, disc_pct,
+         rating, rc, about, link, currency) = row
         cur.execute("""
             INSERT INTO products (
                 product_id, product_name, category_id,
@@ -99,17 +87,14 @@ def main():
             ) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
             ON CONFLICT (product_id) DO NOTHING;
         """, (
-            safe_trunc(p["product_id"],255),
-            safe_trunc(p["product_name"],255),
-            cat_id,
-            clean_money(p["discounted_price"]),
-            clean_money(p["actual_price"]),
-            float(p["discount_percentage"]) if p["discount_percentage"] else None,
-            float(p["rating"]) if p["rating"] else None,
-            int(p["rating_count"]) if p["rating_count"] else None,
-            p["about_product"],
-            p["product_link"],
-            safe_trunc(p["currency"],10)
+            pid, pname,
+            cat_map.get(cat_name),
+            dp, ap,
+            disc_pct,
+            rating, rc,
+            about,
+            link,
+            currency
         ))
     conn.commit()
 
@@ -121,15 +106,12 @@ def main():
         {"user_id": "MOCK-U2", "user_name": "Bob Mockson"},
         {"user_id": "MOCK-U3", "user_name": "Carol Mockowitz"},
     ]
-    for u in mock_users:
+    for row in records(clean_users(pd.DataFrame(mock_users))):
         cur.execute("""
             INSERT INTO users (user_id, user_name)
             VALUES (%s,%s)
             ON CONFLICT (user_id) DO NOTHING;
-        """, (
-            safe_trunc(u["user_id"],255),
-            safe_trunc(u["user_name"],255)
-        ))
+        """, row)
     conn.commit()
 
     # --------------------------------------------------------------------------
@@ -145,19 +127,13 @@ def main():
         {"review_id": "MOCK-R4", "product_id": "MOCK-P3", "user_id": "MOCK-U1",
          "review_title": "Excellent", "review_content": "Exceeded my mock expectations."},
     ]
-    for r in mock_reviews:
+    for row in records(clean_reviews(pd.DataFrame(mock_reviews))):
         cur.execute("""
             INSERT INTO reviews
               (review_id, product_id, user_id, review_title, review_content)
             VALUES (%s,%s,%s,%s,%s)
             ON CONFLICT (review_id) DO NOTHING;
-        """, (
-            safe_trunc(r["review_id"],255),
-            safe_trunc(r["product_id"],255),
-            safe_trunc(r["user_id"],255),
-            safe_trunc(r["review_title"],255),
-            r["review_content"]
-        ))
+        """, row)
     conn.commit()
 
     # --------------------------------------------------------------------------
@@ -168,17 +144,13 @@ def main():
         {"product_id": "MOCK-P2", "country": "Canada", "city": "Toronto"},
         {"product_id": "MOCK-P3", "country": "UK", "city": "London"},
     ]
-    for l in mock_locs:
-        cur.execute("SELECT 1 FROM products WHERE product_id = %s", (l["product_id"],))
+    for pid, country, city in records(clean_locations(pd.DataFrame(mock_locs))):
+        cur.execute("SELECT 1 FROM products WHERE product_id = %s", (pid,))
         if cur.fetchone():
             cur.execute("""
                 INSERT INTO locations (product_id, country, city)
                 VALUES (%s,%s,%s);
-            """, (
-                safe_trunc(l["product_id"],255),
-                safe_trunc(l["country"],100),
-                safe_trunc(l["city"],100)
-            ))
+            """, (pid, country, city))
     conn.commit()
 
     # --------------------------------------------------------------------------
@@ -224,7 +196,7 @@ def main():
     conn.commit()
 
     cur.close()
-    conn.close()
+    release_connection(conn)
     print("✅ Mock data inserted, currencies updated, and specified products deleted.")
 
 if __name__ == "__main__":
@@ -1,125 +1,97 @@
 import streamlit as st
-import pandas as pd
-import psycopg2
-from datetime import date
-from config.settings import DB_CONFIG
+from config.connection import connection
+from reports import queries
+from reports.queries import Filters, PAGE_SIZE
+
+# Every sidebar combination is its own cache entry: the database does the
+# filtering and aggregating, and only what the page shows comes back.
 
 @st.cache_data(ttl=3600)
-def load_data():
-    """Load dims + fact_pricing from the star schema into a single DataFrame."""
-    conn = psycopg2.connect(**DB_CONFIG)
-    df = pd.read_sql("""
-      SELECT
-        fp.pricing_sk,
-        dd.full_date,
-        dc.category_name,
-        dp.product_name,
-        dl.country,
-        dl.city,
-        fp.actual_price,
-        fp.discounted_price,
-        fp.discount_percentage,
-        fp.currency,
-        fp.rate_to_base
-      FROM star.fact_pricing AS fp
-      JOIN star.dim_date     AS dd ON fp.date_sk     = dd.date_sk
-      JOIN star.dim_product  AS dp ON fp.product_sk  = dp.product_sk
-      JOIN star.dim_category AS dc ON fp.category_sk = dc.category_sk
-      JOIN star.dim_location AS dl ON fp.location_sk = dl.location_sk
-      ;
-    """, conn)
-    conn.close()
-
-    # ensure full_date is a native date for Streamlit widgets
-    df["full_date"] = pd.to_datetime(df["full_date"]).dt.date
-    return df
+def load_options():
+    """Date bounds and multiselect choices from the dimensions."""
+    with connection('dashboard') as conn:
+        return queries.filter_options(conn)
+
+@st.cache_data(ttl=600)
+def load_kpis(filters):
+    with connection('dashboard') as conn:
+        return queries.kpis(conn, filters)
+
+@st.cache_data(ttl=600)
+def load_mean_price_by(filters, group):
+    with connection('dashboard') as conn:
+        return queries.mean_price_by(conn, filters, group)
+
+@st.cache_data(ttl=600)
+def load_price_over_time(filters):
+    with connection('dashboard') as conn:
+        return queries.price_over_time(conn, filters)
+
+@st.cache_data(ttl=600)
+def load_detail_page(filters, page):
+    with connection('dashboard') as conn:
+        return queries.detail_page(conn, filters, page)
 
 st.set_page_config(page_title="Pricing Dashboard", layout="wide")
 st.title("📊 Pricing & Discount Dashboard")
 
-# 1) Load data
-df = load_data()
+# 1) Filter choices (small, from the dimensions; no fact rows)
+options = load_options()
 
 # 2) Sidebar filters
 st.sidebar.header("Filters")
 
 # date range
-if not df.empty:
-    min_d, max_d = df["full_date"].min(), df["full_date"].max()
-else:
-    min_d = max_d = date.today()
-
 min_date, max_date = st.sidebar.date_input(
     "Date range",
-    value=(min_d, max_d),
+    value=(options["start"], options["end"]),
     key="date_range"
 )
 
 # category & product
-cats  = st.sidebar.multiselect("Category", sorted(df["category_name"].unique()))
-prods = st.sidebar.multiselect("Product",  sorted(df["product_name"].unique()))
+cats  = st.sidebar.multiselect("Category", options["categories"])
+prods = st.sidebar.multiselect("Product",  options["products"])
 
 # country & city
-countries = st.sidebar.multiselect("Country", sorted(df["country"].unique()))
-cities    = st.sidebar.multiselect("City",    sorted(df["city"].unique()))
+countries = st.sidebar.multiselect("Country", options["countries"])
+cities    = st.sidebar.multiselect("City",    options["cities"])
 
-# 3) Apply filters
-mask = (df["full_date"] >= min_date) & (df["full_date"] <= max_date)
-if cats:      mask &= df["category_name"].isin(cats)
-if prods:     mask &= df["product_name"].isin(prods)
-if countries: mask &= df["country"].isin(countries)
-if cities:    mask &= df["city"].isin(cities)
-filtered = df[mask]
+# 3) The selections, as one hashable cache key for every query below
+filters = Filters(min_date, max_date, tuple(sorted(cats)), tuple(sorted(prods)),
+                  tuple(sorted(countries)), tuple(sorted(cities)))
+totals  = load_kpis(Filters(options["start"], options["end"]))
+kpis    = load_kpis(filters)
 
-st.markdown(f"**Showing {len(filtered)} records** from {len(df)} total.")
+st.markdown(f"**Showing {kpis['rows']} records** from {totals['rows']} total.")
 
 # 4) KPIs
 col1, col2, col3, col4 = st.columns(4)
 with col1:
-    st.metric("Avg. Actual Price",      f"${filtered['actual_price'].mean():.2f}")
+    st.metric("Avg. Actual Price",      f"${kpis['actual_price']:.2f}")
 with col2:
-    st.metric("Avg. Discount %",        f"{filtered['discount_percentage'].mean():.1f}%")
+    st.metric("Avg. Discount %",        f"{kpis['discount_percentage']:.1f}%")
 with col3:
-    st.metric("Avg. Rate to Base",      f"{filtered['rate_to_base'].mean():.4f}")
+    st.metric("Avg. Rate to Base",      f"{kpis['rate_to_base']:.4f}")
 with col4:
-    st.metric("Distinct Countries Shown", filtered["country"].nunique())
+    st.metric("Distinct Countries Shown", kpis["countries"])
 
 # 5) Bar chart: Average actual price by category
 st.subheader("Average Actual Price by Category")
-bar_cat = (
-    filtered
-    .groupby("category_name")["actual_price"]
-    .mean()
-    .sort_values(ascending=False)
-)
-st.bar_chart(bar_cat)
+st.bar_chart(load_mean_price_by(filters, "category"))
 
 # 6) Bar chart: Average actual price by country
 st.subheader("Average Actual Price by Country")
-bar_country = (
-    filtered
-    .groupby("country")["actual_price"]
-    .mean()
-    .sort_values(ascending=False)
-)
-st.bar_chart(bar_country)
+st.bar_chart(load_mean_price_by(filters, "country"))
 
 # 7) Line chart: Selected product price over time
 st.subheader("Price Over Time by Product")
 if prods:
-    line = (
-        filtered
-        .pivot_table(
-            index="full_date",
-            columns="product_name",
-            values="actual_price",
-            aggfunc="mean"
-        )
-    )
-    st.line_chart(line)
+    st.line_chart(load_price_over_time(filters))
 else:
     st.info("Select at least one product to see its price trend.")
 
-# 8) Raw data table
+# 8) Raw data table, one page of fact rows at a time
 st.subheader("Underlying Data")
-st.dataframe(filtered, height=300, use_container_width=True)
+pages = max(1, -(-kpis["rows"] // PAGE_SIZE))
+page = st.number_input(f"Page (of {pages}, {PAGE_SIZE} rows each)", min_value=1, max_value=pages, value=1)
+st.dataframe(load_detail_page(filters, int(page)), height=300, use_container_width=True)
@@ -0,0 +1,172 @@
+# reports/queries.py
+#
+# The dashboard's reads, with the sidebar selections pushed down into SQL:
+# KPIs and charts aggregate star.agg_pricing in the database, and the detail
+# table fetches one page of star.fact_pricing at a time. Nothing here caches;
+# the dashboard caches each result per Filters value.
+
+from dataclasses import dataclass
+from datetime import date
+
+import pandas as pd
+
+PAGE_SIZE = 500
+
+# dimension joins, added to a query only when a filter or a grouping needs them
+JOINS = {
+    'dp': "JOIN star.dim_product  AS dp ON {t}.product_sk  = dp.product_sk",
+    'dc': "JOIN star.dim_category AS dc ON {t}.category_sk = dc.category_sk",
+    'dl': "JOIN star.dim_location AS dl ON {t}.location_sk = dl.location_sk",
+}
+
+# chart dimension → (column of star.agg_pricing or a dimension, join it needs)
+GROUPS = {
+    'category': ('dc.category_name', 'dc'),
+    'country':  ('ap.country',       None),
+}
+
+
+@dataclass(frozen=True)
+class Filters:
+    """The sidebar selections; empty tuples mean no filter on that column."""
+    start: date
+    end: date
+    categories: tuple = ()
+    products: tuple = ()
+    countries: tuple = ()
+    cities: tuple = ()
+
+
+def where(filters, table, location):
+    """
+    WHERE clause, parameters and the dimension aliases it needs for `filters`
+    over the relation aliased `table` (its full_date, so a partitioned fact is
+    pruned to the months in range), with country/city taken from `location`.
+    """
+    clauses = [f"{table}.full_date BETWEEN %(start)s AND %(end)s"]
+    params = {'start': filters.start, 'end': filters.end}
+    needs = set()
+    for name, alias, column in (('categories', 'dc',     'category_name'),
+                                ('products',   'dp',     'product_name'),
+                                ('countries',  location, 'country'),
+                                ('cities',     location, 'city')):
+        values = getattr(filters, name)
+        if values:
+            clauses.append(f"{alias}.{column} = ANY(%({name})s)")
+            params[name] = list(values)
+            needs.add(alias)
+    return "WHERE " + "\n        AND ".join(clauses), params, needs - {table}
+
+
+def source(relation, table, needs):
+    """`relation` aliased `table` plus the JOINS listed in `needs`."""
+    return "\n      ".join([f"FROM {relation} AS {table}"] +
+                            [JOINS[alias].format(t=table) for alias in sorted(needs)])
+
+
+def filter_options(conn):
+    """Date bounds and the choices for every multiselect."""
+    cur = conn.cursor()
+    cur.execute("SELECT MIN(full_date), MAX(full_date) FROM star.agg_pricing;")
+    first, last = cur.fetchone()
+    options = {'start': first or date.today(), 'end': last or date.today()}
+    for name, sql in (
+        ('categories', "SELECT DISTINCT category_name FROM star.dim_category WHERE category_name IS NOT NULL ORDER BY 1;"),
+        ('products',   "SELECT DISTINCT product_name  FROM star.dim_product  WHERE product_name  IS NOT NULL ORDER BY 1;"),
+        ('countries',  "SELECT DISTINCT country       FROM star.dim_location WHERE country       IS NOT NULL ORDER BY 1;"),
+        ('cities',     "SELECT DISTINCT city          FROM star.dim_location WHERE city          IS NOT NULL ORDER BY 1;"),
+    ):
+        cur.execute(sql)
+        options[name] = [row[0] for row in cur.fetchall()]
+    cur.close()
+    return options
+
+
+def kpis(conn, filters):
+    """Fact rows, average price, discount and rate, and distinct countries in view."""
+    clause, params, needs = where(filters, 'ap', 'ap')
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT COALESCE(SUM(ap.fact_rows), 0),
+               SUM(ap.actual_price_sum)        / NULLIF(SUM(ap.actual_price_count), 0),
+               SUM(ap.discount_percentage_sum) / NULLIF(SUM(ap.discount_percentage_count), 0),
+               SUM(ap.rate_to_base_sum)        / NULLIF(SUM(ap.rate_to_base_count), 0),
+               COUNT(DISTINCT ap.country)
+        {source('star.agg_pricing', 'ap', needs)}
+        {clause};
+    """, params)
+    rows, price, discount, rate, countries = cur.fetchone()
+    cur.close()
+    return {
+        'rows': int(rows),
+        'actual_price': float(price) if price is not None else float('nan'),
+        'discount_percentage': float(discount) if discount is not None else float('nan'),
+        'rate_to_base': float(rate) if rate is not None else float('nan'),
+        'countries': countries,
+    }
+
+
+def mean_price_by(conn, filters, group):
+    """Average actual price per GROUPS[group] value, highest first, as a Series."""
+    column, join = GROUPS[group]
+    clause, params, needs = where(filters, 'ap', 'ap')
+    df = pd.read_sql(f"""
+        SELECT {column} AS label,
+               SUM(ap.actual_price_sum) / NULLIF(SUM(ap.actual_price_count), 0) AS actual_price
+        {source('star.agg_pricing', 'ap', needs | {join} - {None})}
+        {clause}
+        GROUP BY {column}
+        ORDER BY actual_price DESC NULLS LAST;
+    """, conn, params=params)
+    return df.set_index("label")["actual_price"].astype(float).rename_axis(group)
+
+
+def price_over_time(conn, filters):
+    """Average actual price per day, one column per selected product."""
+    clause, params, needs = where(filters, 'ap', 'ap')
+    df = pd.read_sql(f"""
+        SELECT ap.full_date,
+               dp.product_name,
+               SUM(ap.actual_price_sum) / NULLIF(SUM(ap.actual_price_count), 0) AS actual_price
+        {source('star.agg_pricing', 'ap', needs | {'dp'})}
+        {clause}
+        GROUP BY ap.full_date, dp.product_name
+        ORDER BY ap.full_date;
+    """, conn, params=params)
+    return df.pivot(index="full_date", columns="product_name", values="actual_price").astype(float)
+
+
+def detail_page(conn, filters, page, page_size=PAGE_SIZE):
+    """
+    Page `page` (from 1) of the filtered fact rows, oldest first. The page is
+    picked from the fact first (idx_fact_pricing_page walks it in order) and
+    only its rows are joined to the dimensions for display.
+    """
+    clause, params, needs = where(filters, 'fp', 'dl')
+    params.update(limit=page_size, offset=(page - 1) * page_size)
+    df = pd.read_sql(f"""
+        SELECT fp.pricing_sk,
+               fp.full_date,
+               dc.category_name,
+               dp.product_name,
+               dl.country,
+               dl.city,
+               fp.actual_price,
+               fp.discounted_price,
+               fp.discount_percentage,
+               fp.currency,
+               fp.rate_to_base
+          FROM (
+                SELECT fp.*
+                {source('star.fact_pricing', 'fp', needs)}
+                {clause}
+                ORDER BY fp.full_date, fp.pricing_sk
+                LIMIT %(limit)s OFFSET %(offset)s
+               ) AS fp
+          {JOINS['dc'].format(t='fp')}
+          {JOINS['dp'].format(t='fp')}
+          {JOINS['dl'].format(t='fp')}
+         ORDER BY fp.full_date, fp.pricing_sk;
+    """, conn, params=params)
+    df["full_date"] = pd.to_datetime(df["full_date"]).dt.date
+    return df
@@ -0,0 +1,9 @@
+# tests/conftest.py
+#
+# The modules are run as `python -m models.x` / `python -m elt.x` from the
+# repository root; make the tests import them the same way.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,34 @@
+import pytest
+
+from elt.catalog import bare, renamed, retarget_index
+
+
+def test_renamed_and_bare():
+    assert renamed('warehouse.products', '_shadow') == 'warehouse.products_shadow'
+    assert bare('warehouse.products_shadow') == 'products_shadow'
+
+
+def test_retarget_index_plain_table():
+    ddl = ("CREATE UNIQUE INDEX ux_products_current ON warehouse.products USING btree (product_id) "
+           "INCLUDE (products_sk) WHERE (end_date = '9999-12-31 00:00:00'::timestamp without time zone)")
+    assert retarget_index(ddl, 'ux_products_current', 'warehouse.products',
+                          'ux_products_current_shadow', 'warehouse.products_shadow') == (
+        "CREATE UNIQUE INDEX ux_products_current_shadow ON warehouse.products_shadow USING btree (product_id) "
+        "INCLUDE (products_sk) WHERE (end_date = '9999-12-31 00:00:00'::timestamp without time zone)")
+
+
+def test_retarget_index_drops_on_only_of_a_partitioned_table():
+    ddl = "CREATE INDEX idx_fact_pricing_page ON ONLY star.fact_pricing USING btree (full_date, pricing_sk)"
+    assert retarget_index(ddl, 'idx_fact_pricing_page', 'star.fact_pricing',
+                          'idx_fact_pricing_page', 'star.fact_pricing_shadow') == (
+        "CREATE INDEX idx_fact_pricing_page ON star.fact_pricing_shadow USING btree (full_date, pricing_sk)")
+
+
+def test_retarget_index_only_rewrites_the_target():
+    # a table name that is a prefix of another, and a column named like the index
+    ddl = "CREATE INDEX idx_users ON warehouse.users USING btree (idx_users)"
+    assert retarget_index(ddl, 'idx_users', 'warehouse.users', 'idx_users_new', 'warehouse.users_new') == (
+        "CREATE INDEX idx_users_new ON warehouse.users_new USING btree (idx_users)")
+    with pytest.raises(ValueError):
+        retarget_index("CREATE INDEX idx_users ON warehouse.users_old USING btree (x)",
+                       'idx_users', 'warehouse.users', 'idx_users_new', 'warehouse.users_new')
@@ -0,0 +1,97 @@
+import math
+
+import pandas as pd
+
+from models import cleaning
+
+
+def values(series):
+    """Series → list with every NA as None."""
+    return [None if pd.isna(v) else v for v in series]
+
+
+def test_money_strips_rupee_sign_and_separators():
+    s = pd.Series(['₹1,099', ' ₹ 399 ', '₹0', 'abc', '', None])
+    assert values(cleaning.money(s)) == [1099.0, 399.0, 0.0, None, None, None]
+    assert cleaning.money(s).dtype == 'float64'
+
+
+def test_percentage_and_rating():
+    assert values(cleaning.percentage(pd.Series(['64%', ' 5 %', 'x', None]))) == [64.0, 5.0, None, None]
+    assert values(cleaning.rating(pd.Series(['4.2', ' 3.9 ', '|', None]))) == [4.2, 3.9, None, None]
+
+
+def test_count_only_accepts_digits():
+    s = pd.Series(['24,269', ' 12 ', '1.5', '-3', '|', '', None])
+    result = cleaning.count(s)
+    assert str(result.dtype) == 'Int64'
+    assert values(result) == [24269, 12, None, None, None, None, None]
+
+
+def test_by_value_parses_each_distinct_value_once_and_keeps_na_and_index():
+    seen = []
+
+    def parse(s):
+        seen.append(list(s))
+        return pd.to_numeric(s, errors='coerce')
+
+    s = pd.Series(['1', '2', None, '1', '2', None], index=[10, 11, 12, 13, 14, 15])
+    result = cleaning.by_value(s, parse)
+    assert seen == [['1', '2']]
+    assert list(result.index) == [10, 11, 12, 13, 14, 15]
+    assert values(result) == [1, 2, None, 1, 2, None]
+
+
+def test_by_value_all_na():
+    result = cleaning.money(pd.Series([None, None], dtype='object'))
+    assert len(result) == 2 and result.isna().all()
+
+
+def test_frames_of_a_chunk_without_priced_products():
+    df = pd.DataFrame({col: [None] for col in (
+        'product_id', 'product_name', 'category', 'discounted_price', 'actual_price',
+        'discount_percentage', 'rating', 'rating_count', 'about_product', 'product_link',
+        'currency', 'user_id', 'user_name', 'review_id', 'review_title', 'review_content',
+        'country', 'city')}, dtype='object')
+    frames = cleaning.clean_frames(df)
+    assert all(len(frame) == 0 for frame in frames.values())
+
+
+def test_text_and_present_treat_blanks_as_na():
+    s = pd.Series(['a', '  ', '', None, ' b '])
+    assert values(cleaning.text(s)) == ['a', None, None, None, ' b ']
+    assert list(cleaning.present(s)) == [True, False, False, False, True]
+
+
+def test_main_category_and_truncate():
+    s = pd.Series(['Computers&Accessories|Cables', ' Electronics ', '|Home', None])
+    assert values(cleaning.main_category(s)) == ['Computers&Accessories', 'Electronics', None, None]
+    assert values(cleaning.truncate(pd.Series(['abcdef', None]), 3)) == ['abc', None]
+    assert cleaning.safe_trunc('abcdef', 3) == 'abc' and cleaning.safe_trunc(None) is None
+
+
+def test_clean_products_skips_missing_prices_and_keeps_first_duplicate():
+    df = pd.DataFrame({
+        'product_id':          ['P1', 'P2', 'P1', 'P3'],
+        'product_name':        ['one', 'two', 'one again', 'three'],
+        'category':            ['A|B', 'C', 'A', 'D'],
+        'discounted_price':    ['₹10', '₹20', '₹11', '₹30'],
+        'actual_price':        ['₹100', ' ', '₹110', '₹300'],
+        'discount_percentage': ['90%', '0%', '90%', '90%'],
+        'rating':              ['4.1', '4.2', '4.3', '|'],
+        'rating_count':        ['1,000', '2', '3', 'n/a'],
+        'about_product':       ['x', 'y', 'z', ''],
+        'product_link':        ['l1', 'l2', 'l3', 'l4'],
+        'currency':            ['INR', 'INR', 'INR', 'USD'],
+    })
+    products = cleaning.clean_products(df)
+    assert list(products['product_id']) == ['P1', 'P3']
+    assert list(products['product_name']) == ['one', 'three']
+    assert list(products['category_name']) == ['A', 'D']
+    assert values(products['rating_count']) == [1000, None]
+    assert values(products['about_product']) == ['x', None]
+
+
+def test_records_turn_na_into_none():
+    frame = pd.DataFrame({'a': pd.Series([1, None], dtype='Int64'), 'b': [1.5, math.nan], 'c': ['x', None]})
+    assert list(cleaning.records(frame)) == [(1, 1.5, 'x'), (None, None, None)]
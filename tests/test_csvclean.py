@@ -0,0 +1,96 @@
+import csv
+import io
+
+import pandas as pd
+import pytest
+
+from models import csvClean
+
+HEADER = ['product_id', 'product_name', 'about_product']
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        writer.writerows(rows)
+
+
+def read_range(path, start, end):
+    return list(csv.reader(csvClean._lines(path, start, end)))
+
+
+@pytest.fixture
+def multiline_csv(tmp_path):
+    """Rows whose quoted fields hold newlines, commas and escaped quotes."""
+    rows = []
+    for i in range(200):
+        about = f'line one of {i}\nline "two", with comma\n\nline four' if i % 3 == 0 else f'plain {i}'
+        rows.append([f'P{i:04d}', f'name "{i}"' if i % 5 == 0 else f'name {i}', about])
+    path = tmp_path / 'in.csv'
+    write_csv(path, rows)
+    return str(path), rows
+
+
+@pytest.mark.parametrize('parts', [1, 2, 3, 7, 16, 500])
+def test_split_ranges_cover_the_data_and_end_on_record_boundaries(multiline_csv, parts):
+    path, rows = multiline_csv
+    ranges = csvClean.split_ranges(path, parts)
+
+    assert 1 <= len(ranges) <= parts
+    with open(path, 'rb') as f:
+        header_end = len(f.readline())
+        size = len(f.read()) + header_end
+    assert ranges[0][0] == header_end and ranges[-1][1] == size
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+
+    # every range parses on its own into whole records, in input order
+    assert [row for start, end in ranges for row in read_range(path, start, end)] == rows
+
+
+def test_split_ranges_never_cuts_inside_a_quoted_field(tmp_path):
+    # one record spanning most of the file: a cut can only fall after it
+    path = tmp_path / 'in.csv'
+    write_csv(path, [['P1', 'a', 'x\n' * 500], ['P2', 'b', 'y'], ['P3', 'c', 'z']])
+    ranges = csvClean.split_ranges(str(path), 4)
+    assert read_range(str(path), *ranges[0])[0] == ['P1', 'a', 'x\n' * 500]
+    for start, end in ranges:
+        assert all(len(row) == 3 for row in read_range(str(path), start, end))
+
+
+def test_split_ranges_header_only(tmp_path):
+    path = tmp_path / 'in.csv'
+    write_csv(path, [])
+    assert csvClean.split_ranges(str(path), 4) == []
+
+
+def test_assign_location_is_seeded_and_valid():
+    country, city = csvClean.assign_location('B000123', seed=1)
+    assert city in csvClean.country_cities[country]
+    assert csvClean.assign_location('B000123', seed=1) == (country, city)
+    assert len({csvClean.assign_location(f'P{i}', seed=0) for i in range(200)}) > 10
+
+
+def test_clean_csv_output_does_not_depend_on_workers(multiline_csv, tmp_path):
+    path, rows = multiline_csv
+    outputs = []
+    for workers in (1, 3):
+        out = tmp_path / f'out-{workers}.csv'
+        assert csvClean.clean_csv(path, str(out), seed=7, workers=workers) == len(rows)
+        outputs.append(out.read_text(encoding='utf-8'))
+    assert outputs[0] == outputs[1]
+
+    cleaned = list(csv.reader(io.StringIO(outputs[0], newline='')))
+    assert cleaned[0] == HEADER + csvClean.ADDED_FIELDS
+    assert [r[:3] for r in cleaned[1:]] == rows
+    assert all(r[3] == csvClean.CURRENCY and r[5] in csvClean.country_cities[r[4]] for r in cleaned[1:])
+
+
+def test_enrich_frame_matches_the_csv_cleaner():
+    df = pd.DataFrame({'product_id': ['P1', 'P2', None, 'P1']})
+    enriched = csvClean.enrich_frame(df, seed=7)
+    assert 'currency' not in df
+    assert list(enriched['currency']) == [csvClean.CURRENCY] * 4
+    assert (enriched.loc[0, 'country'], enriched.loc[0, 'city']) == csvClean.assign_location('P1', 7)
+    assert enriched.loc[3, 'city'] == enriched.loc[0, 'city']
+    assert pd.isna(enriched.loc[2, 'country'])
@@ -0,0 +1,58 @@
+import csv
+
+import pytest
+
+from models import database
+
+HEADER = ['product_id', 'product_name', 'category', 'discounted_price', 'actual_price',
+          'discount_percentage', 'rating', 'rating_count', 'about_product', 'user_id',
+          'user_name', 'review_id', 'review_title', 'review_content', 'product_link',
+          'currency', 'country', 'city']
+
+
+def row(pid, price, review, user, city):
+    return [pid, f'name {pid}', 'Cat|Sub', '₹10', price, '10%', '4.0', '5', 'about',
+            user, f'user {user}', review, 'title', 'content', 'link', 'INR', 'India', city]
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """Replace the loaders with an in-memory public.* that enforces the FKs like insert_reviews."""
+    db = {name: [] for name in database.PHASES}
+
+    def load_frames(conn, frames, bulk, stats, workers=1):
+        for name in database.PHASES:
+            for r in frames[name].astype(object).itertuples(index=False, name=None):
+                if name in ('reviews', 'locations'):
+                    if r[0 if name == 'locations' else 1] not in {p[0] for p in db['products']}:
+                        raise RuntimeError(f"FK violation on {name}: {r}")
+                # ON CONFLICT DO NOTHING on every table but locations
+                if name == 'locations' or r[0] not in {k[0] for k in db[name]}:
+                    db[name].append(r)
+        return dict.fromkeys(database.PHASES, 0.0)
+
+    monkeypatch.setattr(database, 'load_frames', load_frames)
+    return db
+
+
+def test_children_wait_for_a_product_priced_in_a_later_chunk(tmp_path, fake_db):
+    path = tmp_path / 'in.csv'
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        # chunk 1: P1 has no valid price yet, so it isn't loaded with its review/location
+        writer.writerow(row('P1', '', 'R1', 'U1', 'Mumbai'))
+        writer.writerow(row('P2', '₹20', 'R2', 'U2', 'Delhi'))
+        # chunk 2: P1 is priced here, and repeats the location already deferred
+        writer.writerow(row('P1', '₹15', 'R3', 'U1', 'Mumbai'))
+        writer.writerow(row('P3', '₹30', 'R4', 'U3', 'Pune'))
+
+    database.insert_data_from_csv(None, str(path), chunksize=2)
+    chunked = {name: sorted(rows) for name, rows in fake_db.items()}
+    for rows in fake_db.values():
+        rows.clear()
+    database.insert_data_from_csv(None, str(path))
+
+    assert chunked == {name: sorted(rows) for name, rows in fake_db.items()}
+    assert sorted(r[0] for r in chunked['reviews']) == ['R1', 'R2', 'R3', 'R4']
+    assert sorted(r[2] for r in chunked['locations']) == ['Delhi', 'Mumbai', 'Pune']
@@ -0,0 +1,31 @@
+import re
+
+from elt.incremental_load_warehouse import WAREHOUSE_TABLES
+from elt.migrations import MIGRATIONS, REWRITES_DATA
+from elt.scd2 import row_hash_sql
+
+
+def squash(sql):
+    return re.sub(r'\s+', '', sql)
+
+
+def statements(migration_id):
+    return next(stmts for mid, _, stmts in MIGRATIONS if mid == migration_id)
+
+
+def test_migration_ids_are_unique_and_ordered():
+    ids = [m[0] for m in MIGRATIONS]
+    assert ids == sorted(set(ids))
+    assert REWRITES_DATA <= set(ids)
+
+
+def test_row_hash_columns_match_the_merge_hash():
+    generated = {
+        re.search(r'ALTER TABLE (\S+)', sql).group(1):
+            re.search(r'GENERATED ALWAYS AS \((.*)\) STORED', sql, re.S).group(1)
+        for sql in statements('009_warehouse_row_hash')
+    }
+    assert set(generated) == {spec.table for spec in WAREHOUSE_TABLES}
+    for spec in WAREHOUSE_TABLES:
+        types = {c: 'timestamp without time zone' if c == 'fetched_at' else 'text' for c in spec.tracked}
+        assert squash(generated[spec.table]) == squash(row_hash_sql(spec, types))
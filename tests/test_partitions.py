@@ -0,0 +1,85 @@
+from datetime import date
+
+import pytest
+
+from elt import partitions
+from elt.partitions import _partitioned_index, _with_key_column, add_months, month_start, partition_name
+
+
+@pytest.mark.parametrize('month, n, expected', [
+    (date(2025, 1, 1), 1, date(2025, 2, 1)),
+    (date(2025, 11, 1), 2, date(2026, 1, 1)),
+    (date(2025, 12, 1), 1, date(2026, 1, 1)),
+    (date(2025, 1, 1), -1, date(2024, 12, 1)),
+    (date(2025, 3, 1), -24, date(2023, 3, 1)),
+    (date(2025, 3, 1), 0, date(2025, 3, 1)),
+    (date(2024, 6, 1), 25, date(2026, 7, 1)),
+])
+def test_add_months(month, n, expected):
+    assert add_months(month, n) == expected
+
+
+def test_month_start_and_partition_name():
+    assert month_start(date(2024, 2, 29)) == date(2024, 2, 1)
+    assert partition_name('star.fact_pricing', date(2025, 3, 1)) == 'star.fact_pricing_p202503'
+    assert partition_name('warehouse.exchange_rates', date(2026, 12, 1)) == 'warehouse.exchange_rates_p202612'
+
+
+@pytest.mark.parametrize('definition, expected', [
+    # constraints from table_constraints
+    ("PRIMARY KEY (pricing_sk)",
+     "PRIMARY KEY (pricing_sk, full_date)"),
+    ("UNIQUE (date_sk, product_sk, location_sk)",
+     "UNIQUE (date_sk, product_sk, location_sk, full_date)"),
+    ("UNIQUE NULLS NOT DISTINCT (date_sk, product_sk)",
+     "UNIQUE NULLS NOT DISTINCT (date_sk, product_sk, full_date)"),
+    # the key already holds the partition column
+    ("UNIQUE (date_sk, product_sk, location_sk, full_date)",
+     "UNIQUE (date_sk, product_sk, location_sk, full_date)"),
+    ("UNIQUE (full_date,pricing_sk)",
+     "UNIQUE (full_date,pricing_sk)"),
+    # the index tail enable() passes in: only the key list changes, not INCLUDE or WHERE
+    (" USING btree (product_id) INCLUDE (products_sk) WHERE (end_date = '9999-12-31 00:00:00'::timestamp without time zone)",
+     " USING btree (product_id, full_date) INCLUDE (products_sk) WHERE (end_date = '9999-12-31 00:00:00'::timestamp without time zone)"),
+    # expressions with parentheses of their own
+    (" USING btree (lower((product_name)::text), product_id)",
+     " USING btree (lower((product_name)::text), product_id, full_date)"),
+    (" USING btree (COALESCE(city, ''::character varying))",
+     " USING btree (COALESCE(city, ''::character varying), full_date)"),
+    # a column whose name only contains the partition column is not it
+    ("UNIQUE (full_date_sk)",
+     "UNIQUE (full_date_sk, full_date)"),
+])
+def test_with_key_column(definition, expected):
+    assert _with_key_column(definition, 'full_date') == expected
+
+
+CURRENT_RATE_INDEX = ("CREATE UNIQUE INDEX ux_exchange_rates_current ON warehouse.exchange_rates USING btree "
+                      "(base_currency, target_currency) INCLUDE (rate_to_base, start_date) "
+                      "WHERE (end_date = '9999-12-31 00:00:00'::timestamp without time zone)")
+
+
+def test_partitioned_unique_index_gets_the_partition_column_in_its_key():
+    ddl = _partitioned_index(CURRENT_RATE_INDEX, 'ux_exchange_rates_current',
+                             'warehouse.exchange_rates', 'start_date')
+    assert ddl == ("CREATE UNIQUE INDEX ux_exchange_rates_current ON warehouse.exchange_rates USING btree "
+                   "(base_currency, target_currency, start_date) INCLUDE (rate_to_base, start_date) "
+                   "WHERE (end_date = '9999-12-31 00:00:00'::timestamp without time zone)")
+    # applying it again changes nothing
+    assert _partitioned_index(ddl, 'ux_exchange_rates_current',
+                              'warehouse.exchange_rates', 'start_date') == ddl
+
+
+def test_partitioned_plain_index_is_kept_as_is():
+    ddl = ("CREATE INDEX idx_fact_pricing_page ON star.fact_pricing USING btree "
+           "(full_date, pricing_sk)")
+    assert _partitioned_index(ddl, 'idx_fact_pricing_page', 'star.fact_pricing', 'full_date') == ddl
+    ddl = "CREATE INDEX idx_exchange_rates_natural ON warehouse.exchange_rates USING btree (base_currency)"
+    assert _partitioned_index(ddl, 'idx_exchange_rates_natural',
+                              'warehouse.exchange_rates', 'start_date') == ddl
+
+
+def test_partitioned_tables_are_ranged_on_dates_and_derived_tables_follow_them():
+    assert partitions.PARTITIONED == {'warehouse.exchange_rates': 'start_date', 'star.fact_pricing': 'full_date'}
+    assert set(partitions.DERIVED) <= set(partitions.PARTITIONED)
+    assert set(partitions.PINNED) <= set(partitions.PARTITIONED)
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import pytest
+
+from config.scheduler import StagesFailed, run_stages
+
+
+def recorder(log, lock=threading.Lock()):
+    """stage(name, fail=False, sleep=0) → a callable appending (start/end, name) to `log`."""
+    def stage(name, fail=False, sleep=0):
+        def run():
+            with lock:
+                log.append(('start', name))
+            time.sleep(sleep)
+            if fail:
+                raise RuntimeError(f"{name} broke")
+            with lock:
+                log.append(('end', name))
+        return run
+    return stage
+
+
+def position(log, event, name):
+    return log.index((event, name))
+
+
+def test_stages_start_only_after_their_dependencies():
+    log = []
+    stage = recorder(log)
+    deps = {'products': ['categories'], 'reviews': ['products', 'users'], 'locations': ['products']}
+    stages = {n: stage(n, sleep=0.01) for n in ('categories', 'users', 'products', 'reviews', 'locations')}
+
+    timings = run_stages(stages, deps, max_workers=4)
+
+    assert set(timings) == set(stages) and all(t >= 0 for t in timings.values())
+    for name, parents in deps.items():
+        for parent in parents:
+            assert position(log, 'end', parent) < position(log, 'start', name)
+
+
+def test_independent_stages_run_concurrently():
+    log = []
+    stage = recorder(log)
+    run_stages({'a': stage('a', sleep=0.05), 'b': stage('b', sleep=0.05)}, {}, max_workers=2)
+    assert position(log, 'start', 'b') < position(log, 'end', 'a')
+
+
+def test_failure_stops_new_stages_and_reraises_the_error():
+    log = []
+    stage = recorder(log)
+    stages = {'a': stage('a', fail=True), 'b': stage('b'), 'c': stage('c')}
+
+    with pytest.raises(RuntimeError, match="a broke"):
+        run_stages(stages, {'b': ['a'], 'c': ['b']}, max_workers=2)
+    assert ('start', 'b') not in log and ('start', 'c') not in log
+
+
+def test_keep_going_skips_only_the_dependents_of_a_failure():
+    log = []
+    stage = recorder(log)
+    stages = {'a': stage('a', fail=True), 'b': stage('b'), 'c': stage('c'), 'd': stage('d'), 'e': stage('e')}
+    deps = {'b': ['a'], 'c': ['b'], 'e': ['d']}
+
+    with pytest.raises(StagesFailed) as failed:
+        run_stages(stages, deps, max_workers=2, keep_going=True)
+
+    e = failed.value
+    assert set(e.errors) == {'a'} and str(e.errors['a']) == "a broke"
+    assert e.skipped == {'b', 'c'}
+    assert set(e.timings) == {'d', 'e'}
+    assert ('end', 'd') in log and ('end', 'e') in log
+    assert "skipped: ['b', 'c']" in str(e)
+
+
+def test_unsatisfiable_dependencies_are_reported():
+    with pytest.raises(ValueError, match=r"unsatisfiable dependencies: \['b'\]"):
+        run_stages({'a': lambda: None, 'b': lambda: None}, {'b': ['missing']})
+
+
+def test_warehouse_merge_stages_follow_their_lookups():
+    from elt.incremental_load_warehouse import WAREHOUSE_TABLES
+    from elt.scd2 import dependency_order, stage_deps
+
+    deps = stage_deps(WAREHOUSE_TABLES)
+    assert deps['products'] == ('categories',)
+    assert set(deps['reviews']) == {'products', 'users'}
+    assert deps['categories'] == () and deps['exchange_rates'] == ()
+
+    order = [spec.name for spec in dependency_order(WAREHOUSE_TABLES)]
+    for name, parents in deps.items():
+        assert all(order.index(parent) < order.index(name) for parent in parents)